@@ -1,112 +1,322 @@
-import sqlite3
-from datetime import datetime, timedelta
-from completion import Completion
+import heapq
+import os
+from datetime import datetime
 from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from streaks import last_completion_days, day_number, get_streak_backend, STREAK_BACKENDS
+from storage import day_to_date
+from cache import cached_query, bump_write_counter  # results are reused while the data is unchanged
+from hooks import merge_completion_log  # reads include the completions still in the completion log
+from profiling import profiled  # wall time per call while --profile is active
 
-completion_tracker = Completion(DB_PATH)  # Create instance of Completion
+# The streak backends, the snapshot reader, the rates and the registry are imported by the functions
+# using them, so every CLI command only pays for the modules it needs
 
-def get_all_habits():
+# Default streak backend, can be overridden with the HABITS_STREAK_BACKEND environment variable
+STREAK_BACKEND = os.environ.get('HABITS_STREAK_BACKEND', 'stats')
+
+# Orders of the paginated habit listing; each one is an indexed column, so a page starts with an index seek
+HABIT_SORT_KEYS = ('name', 'id')
+
+# Habits per page of iter_habits
+DEFAULT_PAGE_SIZE = 100
+
+@profiled
+def get_all_habits(db_path=DB_PATH, snapshot=None):
     """
     Retrieve a list of all habits with their descriptions.
 
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file (see snapshot.py) to read instead of the database.
     :return: List of strings in the format "<habit_name>: <description>" for each habit.
     """
-    with sqlite3.connect(DB_PATH) as db:
+    if snapshot is not None:
+        from snapshot import Snapshot
+        with Snapshot(snapshot) as snap:
+            return [f"{name}: {description}" for _, name, description, _ in snap.habits()]
+
+    with get_connection(db_path) as db:
         cursor = db.cursor()
-        cursor.execute('SELECT name, description FROM habits')
-        return [f"{row[0]}: {row[1]}" for row in cursor.fetchall()]
 
-def get_habits_by_periodicity(periodicity: str):
+        def query():
+            cursor.execute('SELECT name, description FROM habits')
+            return [f"{row[0]}: {row[1]}" for row in cursor.fetchall()]
+
+        return list(cached_query(db, ('get_all_habits', os.fspath(db_path)), query))
+
+@profiled
+def get_habits_by_periodicity(periodicity: str, db_path=DB_PATH, snapshot=None):
     """
     Retrieve a list of habits with a specified periodicity, including their descriptions.
 
     :param periodicity: The periodicity of the habits to retrieve ("daily" or "weekly").
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file (see snapshot.py) to read instead of the database.
     :return: List of strings in the format "<habit_name>: <description>" for each habit with the specified periodicity.
     """
-    with sqlite3.connect(DB_PATH) as db:
+    if snapshot is not None:
+        from snapshot import Snapshot
+        with Snapshot(snapshot) as snap:
+            return [f"{name}: {description}" for _, name, description, _ in snap.habits(periodicity)]
+
+    with get_connection(db_path) as db:
         cursor = db.cursor()
-        cursor.execute('SELECT name, description FROM habits WHERE periodicity = ?', (periodicity,))
-        return [f"{row[0]}: {row[1]}" for row in cursor.fetchall()]
+
+        def query():
+            cursor.execute('SELECT name, description FROM habits WHERE periodicity = ?', (periodicity,))
+            return [f"{row[0]}: {row[1]}" for row in cursor.fetchall()]
+
+        return list(cached_query(db, ('get_habits_by_periodicity', os.fspath(db_path), periodicity), query))
+
+
+def _prefix_end(prefix):
+    """
+    Return the smallest string greater than every string starting with a prefix.
+
+    :param prefix: Non-empty name prefix.
+    :return: The upper bound, or None if there is none (the prefix consists of the largest code point).
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
+@profiled
+def get_habits_page(limit=None, after=None, periodicity=None, name_prefix=None, sort='name',
+                    db_path=DB_PATH, snapshot=None):
+    """
+    Retrieve one page of the habits, optionally filtered, in name or id order.
+
+    Pages are selected by key instead of by offset: the next page starts after the sort key of
+    the last habit of the previous page. Every filter and order is served by an index
+    (idx_habits_name, idx_habits_periodicity_name, idx_habits_periodicity or the primary key),
+    so a page only reads its own rows, however many habits come before it (with a name prefix
+    and sort='id', the habits matching the prefix are sorted by id first).
+
+    :param limit: Optional; maximum number of habits on the page (all remaining habits if None).
+    :param after: Optional; sort key (name or id) of the last habit of the previous page.
+    :param periodicity: Optional; only list the habits with this periodicity ("daily" or "weekly").
+    :param name_prefix: Optional; only list the habits whose name starts with this prefix (case-sensitive).
+    :param sort: Optional; 'name' or 'id' (creation order).
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file to read instead of the database (created_at is None).
+    :return: List of HabitRecord objects.
+    :raises ValueError: If sort is not one of HABIT_SORT_KEYS.
+    """
+    if sort not in HABIT_SORT_KEYS:
+        raise ValueError(f"Unknown sort key '{sort}', expected one of: {', '.join(HABIT_SORT_KEYS)}.")
+    if sort == 'id' and after is not None:
+        after = int(after)
+    from registry import HabitRecord
+
+    if snapshot is not None:
+        from snapshot import Snapshot
+        with Snapshot(snapshot) as snap:
+            records = [HabitRecord(habit_id, name, kind, None, description)
+                       for habit_id, name, description, kind in snap.habits(periodicity)
+                       if not name_prefix or name.startswith(name_prefix)]
+        records.sort(key=lambda record: getattr(record, sort))
+        records = [record for record in records if after is None or getattr(record, sort) > after]
+        return records if limit is None else records[:limit]
+
+    conditions = []
+    params = []
+    if periodicity is not None:
+        conditions.append('periodicity = ?')
+        params.append(periodicity)
+    if name_prefix:
+        conditions.append('name >= ?')
+        params.append(name_prefix)
+        upper = _prefix_end(name_prefix)
+        if upper is not None:
+            conditions.append('name < ?')
+            params.append(upper)
+    if after is not None:
+        conditions.append(f'{sort} > ?')
+        params.append(after)
+    sql = 'SELECT id, name, periodicity, created_at, description FROM habits'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {sort}'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    with get_connection(db_path) as db:
+        cursor = db.cursor()
+
+        def query():
+            cursor.execute(sql, params)
+            return [HabitRecord(*row) for row in cursor.fetchall()]
+
+        key = ('get_habits_page', os.fspath(db_path), limit, after, periodicity, name_prefix, sort)
+        return list(cached_query(db, key, query))
+
+
+def iter_habits(page_size=DEFAULT_PAGE_SIZE, periodicity=None, name_prefix=None, sort='name', db_path=DB_PATH):
+    """
+    Iterate over all (matching) habits page by page, so only one page is held in memory at a time.
+
+    :param page_size: Optional; number of habits read per query.
+    :param periodicity: Optional; only list the habits with this periodicity.
+    :param name_prefix: Optional; only list the habits whose name starts with this prefix.
+    :param sort: Optional; 'name' or 'id'.
+    :param db_path: Optional; path of the SQLite database file.
+    :return: Generator of HabitRecord objects in the chosen order.
+    """
+    after = None
+    while True:
+        page = get_habits_page(page_size, after, periodicity, name_prefix, sort, db_path)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = getattr(page[-1], sort)
+
+
+@profiled
+def _habit_streaks(habit_name=None, backend=None, db_path=DB_PATH, snapshot=None):
+    """
+    Compute the longest and current streak of every habit (or one habit) with the chosen backend.
+
+    :param habit_name: Optional; only compute the streaks of this habit.
+    :param backend: Optional; name of the streak backend, defaults to STREAK_BACKEND.
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file to compute the streaks from instead (the backend is ignored).
+    :return: List of (habit_name, periodicity, longest, current, last_day) tuples, or None if the habit does not exist.
+    """
+    if snapshot is not None:
+        from snapshot import Snapshot
+        with Snapshot(snapshot) as snap:
+            if habit_name and not snap.has_habit(habit_name):
+                print(f"Habit '{habit_name}' does not exist.")
+                return None
+            return list(snap.habit_streaks(habit_name))
+
+    from registry import get_registry
+    backend = backend or STREAK_BACKEND
+    habit_streaks = get_streak_backend(backend)
+
+    merge_completion_log(db_path)
+    with get_connection(db_path) as db:
+        cursor = db.cursor()
+
+        def query():
+            # If a specific habit name is provided, make sure it exists before computing its streak
+            if habit_name and get_registry(db_path).get(habit_name) is None:
+                return None
+
+            # Habits without completions are skipped by the backends
+            return list(habit_streaks(cursor, habit_name))
+
+        # The current streaks depend on the date, so it is part of the cache key
+        key = ('habit_streaks', os.fspath(db_path), habit_name, backend, datetime.now().date())
+        streaks = cached_query(db, key, query)
+
+    if streaks is None:
+        print(f"Habit '{habit_name}' does not exist.")
+        return None
+    return list(streaks)
 
 
-def get_longest_streak(habit_name=None):
+@profiled
+def get_longest_streak(habit_name=None, backend=None, db_path=DB_PATH, snapshot=None):
     """
     Calculate the longest streak of completions for a specific habit or across all habits.
 
     :param habit_name: Optional; if provided, calculate the longest streak for this specific habit.
                        If not provided, calculates the longest streak across all habits.
+    :param backend: Optional; streak backend to use ('stats', 'python', 'sql', 'bitset' or 'numpy'), defaults to STREAK_BACKEND.
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file (see snapshot.py) to read instead of the database.
     :return: List of tuples in the format [(habit_name, longest_streak, period_type)].
              period_type is "days" for daily habits and "weeks" for weekly habits.
     """
     longest_streak = 0
     longest_habits = []  # List to store all habits with the longest streak
 
-    with sqlite3.connect(DB_PATH) as db:
-        cursor = db.cursor()
+    for name, periodicity, streak, _, _ in _habit_streaks(habit_name, backend, db_path, snapshot) or []:
+        # Update longest_streak and longest_habits based on the streak of this habit
+        if streak > longest_streak:
+            longest_streak = streak
+            longest_habits = [(name, longest_streak, 'days' if periodicity == 'daily' else 'weeks')]
+        elif streak == longest_streak:
+            longest_habits.append((name, streak, 'days' if periodicity == 'daily' else 'weeks'))
 
-        # If a specific habit name is provided, filter by it; otherwise, get all habits
-        if habit_name:
-            cursor.execute("SELECT id, name, periodicity FROM habits WHERE name = ?", (habit_name,))
-            habits = cursor.fetchall()
-            if not habits:
-                print(f"Habit '{habit_name}' does not exist.")
-                return []
-        else:
-            cursor.execute("SELECT id, name, periodicity FROM habits")
-            habits = cursor.fetchall()
-
-        for habit_id, habit_name, periodicity in habits:
-            completions = completion_tracker.get_completions(habit_id)
-            if not completions:
-                continue  # Skip if there are no completions for this habit
-
-            current_streak = 1
-            period_days = 1 if periodicity == 'daily' else 7
-            last_completion_date = completions[0]
-
-            for completed_date in completions[1:]:
-                # Check if the completion is within the expected period for the streak
-                if (last_completion_date - completed_date).days == period_days:
-                    current_streak += 1
-                else:
-                    current_streak = 1  # Reset the streak if there's a gap
+    return longest_habits
 
-                last_completion_date = completed_date
 
-            # Update longest_streak and longest_habits based on current_streak
-            if current_streak > longest_streak:
-                longest_streak = current_streak
-                longest_habits = [(habit_name, longest_streak, 'days' if periodicity == 'daily' else 'weeks')]
-            elif current_streak == longest_streak:
-                longest_habits.append((habit_name, current_streak, 'days' if periodicity == 'daily' else 'weeks'))
+@profiled
+def get_current_streaks(habit_name=None, backend=None, db_path=DB_PATH, snapshot=None):
+    """
+    Calculate the current (still running) streak of a specific habit or of all habits.
 
-    return longest_habits
+    :param habit_name: Optional; if provided, only return the current streak of this habit.
+    :param backend: Optional; streak backend to use ('stats', 'python', 'sql', 'bitset' or 'numpy'), defaults to STREAK_BACKEND.
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file (see snapshot.py) to read instead of the database.
+    :return: List of tuples in the format [(habit_name, current_streak, period_type)] for every habit
+             with completions. current_streak is 0 if the habit was missed in the previous period.
+    """
+    return [(name, current, 'days' if periodicity == 'daily' else 'weeks')
+            for name, periodicity, _, current, _ in _habit_streaks(habit_name, backend, db_path, snapshot) or []]
 
-def check_all_broken_habits():
+@profiled
+def check_all_broken_habits(backend=None, db_path=DB_PATH, snapshot=None):
     """
     Check all tracked habits to identify any broken habits, those not completed within their required periodicity.
 
+    :param backend: Optional; streak backend providing the last completion days. By default they are read
+                    with one MAX(completed_at) query per database (see streaks.last_completion_days).
+    :param db_path: Optional; path of the SQLite database file.
+    :param snapshot: Optional; path of a snapshot file (see snapshot.py) to read instead of the database.
     :return: List of strings describing broken habits, including their names, periodicity, and how long ago they were last completed.
              If a habit has never been completed, it is also marked as broken.
     """
-    broken_habits = []  # Clear the list at the start to avoid duplicates
-    today = datetime.now().date()
+    today = day_number(datetime.now().date())
+    if snapshot is not None:
+        from snapshot import Snapshot
+        with Snapshot(snapshot) as snap:
+            return _broken_habits(snap.last_days(), today)
+
+    merge_completion_log(db_path)
+    with get_connection(db_path) as db:
+        key = ('check_all_broken_habits', os.fspath(db_path), backend, today)
+        return list(cached_query(db, key, lambda: _broken_habits(_last_days(db.cursor(), backend), today)))
 
-    with sqlite3.connect(DB_PATH) as db:
-        cursor = db.cursor()
-        cursor.execute("SELECT id, name, periodicity FROM habits")
-        habits = cursor.fetchall()
 
-    for habit_id, habit_name, periodicity in habits:
-        completions = completion_tracker.get_completions(habit_id)
+def _last_days(cursor, backend=None):
+    """
+    Read the day of the most recent completion of every habit.
+
+    :param cursor: Cursor of the shared connection.
+    :param backend: Optional; name of the streak backend providing the days, None for the aggregate query.
+    :return: List of (habit_name, periodicity, last_day) tuples in habit id order; last_day is None for
+             habits without completions.
+    """
+    if backend is None:
+        return list(last_completion_days(cursor))
+
+    cursor.execute("SELECT name, periodicity FROM habits ORDER BY id")
+    habits = cursor.fetchall()
+    last_days = {name: last_day for name, _, _, _, last_day in get_streak_backend(backend)(cursor)}
+    return [(name, periodicity, last_days.get(name)) for name, periodicity in habits]
+
+
+def _broken_habits(last_days, today):
+    """
+    Build the messages of check_all_broken_habits.
+
+    :param last_days: List of (habit_name, periodicity, last_day) tuples as returned by _last_days.
+    :param today: Day number of today.
+    :return: List of strings describing broken habits.
+    """
+    broken_habits = []  # Clear the list at the start to avoid duplicates
 
-        if completions:
-            last_completion_date = completions[0]  # Get the most recent completion date
-            period_delta = timedelta(days=1) if periodicity == "daily" else timedelta(weeks=1)
+    for habit_name, periodicity, last_day in last_days:
+        if last_day is not None:
+            period_days = 1 if periodicity == "daily" else 7
 
             # Check if the last completion date is outside the required period
-            if today - last_completion_date > period_delta:
-                days_or_weeks = (today - last_completion_date).days
+            if today - last_day > period_days:
+                days_or_weeks = today - last_day
                 if periodicity == "daily":
                     broken_habits.append(f"Habit '{habit_name}' (Daily) is broken; last completed {days_or_weeks} days ago.")
                 else:
@@ -121,4 +331,97 @@ def check_all_broken_habits():
                 broken_habits.append(f"Habit '{habit_name}' (Weekly) has never been completed and is broken.")
 
 
-    return broken_habits
\ No newline at end of file
+    return broken_habits
+
+@profiled
+def get_due_habits(limit=None, db_path=DB_PATH):
+    """
+    List the habits by their next deadline, the most urgent first.
+
+    A habit is due one period (1 or 7 days) after its last completion; after that day,
+    check_all_broken_habits reports it as broken. Habits that have never been completed are
+    overdue and come first. The habits are selected with a heap, so a small limit doesn't sort all of them.
+
+    :param limit: Optional; only return this many habits.
+    :param db_path: Optional; path of the SQLite database file.
+    :return: List of tuples in the format [(habit_name, periodicity, due_date, days_left)]. days_left is
+             negative for overdue habits; due_date and days_left are None for habits never completed.
+    """
+    today = day_number(datetime.now().date())
+
+    merge_completion_log(db_path)
+    with get_connection(db_path) as db:
+        key = ('last_completion_days', os.fspath(db_path))
+        last_days = cached_query(db, key, lambda: _last_days(db.cursor()))
+
+    # (due day, position) keys keep habits with the same deadline in habit id order
+    deadlines = [(float('-inf') if last_day is None else last_day + (1 if periodicity == 'daily' else 7), position)
+                 for position, (_, periodicity, last_day) in enumerate(last_days)]
+    due_habits = []
+    for due_day, position in heapq.nsmallest(len(deadlines) if limit is None else limit, deadlines):
+        name, periodicity, last_day = last_days[position]
+        if last_day is None:
+            due_habits.append((name, periodicity, None, None))
+        else:
+            due_habits.append((name, periodicity, day_to_date(due_day), due_day - today))
+    return due_habits
+
+@profiled
+def get_completion_rates(windows=None, habit_name=None, db_path=DB_PATH):
+    """
+    Calculate the share of completed periods over rolling windows ending today, per habit and in aggregate.
+
+    The prefix sums of all habits are built once and cached until the data changes,
+    so every further window costs O(1) per habit.
+
+    :param windows: Optional; window lengths in days (weekly habits count the whole weeks of a window),
+                    defaults to rates.DEFAULT_WINDOWS.
+    :param habit_name: Optional; only calculate the rates of this habit.
+    :param db_path: Optional; path of the SQLite database file.
+    :return: Tuple (habit_rates, overall_rates). habit_rates is a list of (habit_name, periodicity, rates)
+             tuples, overall_rates the rates of all listed habits together; rates are lists with one rate
+             (0.0 to 1.0, or None for a window without periods) per window.
+    """
+    from rates import load_prefix_sums, window_counts, DEFAULT_WINDOWS
+    windows = windows or DEFAULT_WINDOWS
+    today = day_number(datetime.now().date())
+
+    merge_completion_log(db_path)
+    with get_connection(db_path) as db:
+        prefix_sums = cached_query(db, ('completion_prefix_sums', os.fspath(db_path)),
+                                   lambda: load_prefix_sums(db.cursor()))
+
+    habit_rates = []
+    totals = [[0, 0] for _ in windows]
+    for habit_prefix in prefix_sums:
+        if habit_name and habit_prefix[0] != habit_name:
+            continue
+        rates = []
+        for total, window in zip(totals, windows):
+            completed, periods = window_counts(habit_prefix, window, today)
+            total[0] += completed
+            total[1] += periods
+            rates.append(completed / periods if periods else None)
+        habit_rates.append((habit_prefix[0], habit_prefix[1], rates))
+
+    return habit_rates, [completed / periods if periods else None for completed, periods in totals]
+
+@profiled
+def rebuild_habit_stats(db_path=DB_PATH):
+    """
+    Regenerate the habit_stats and habit_daymaps tables from the raw completions, e.g. to recover
+    after completions were changed outside of the Completion class.
+
+    :param db_path: Optional; path of the SQLite database file.
+    :return: Number of habits with completions whose statistics were rebuilt.
+    """
+    from stats import rebuild_stats
+    from daymap import rebuild_daymaps
+
+    merge_completion_log(db_path)
+    with get_connection(db_path) as db:
+        count = rebuild_stats(db.cursor())
+        rebuild_daymaps(db.cursor())
+        db.commit()
+    bump_write_counter()
+    return count
@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+import analytics
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from habit import Habit
+from completion import Completion
+
+# Number of threads running read operations concurrently (reads don't block each other in WAL mode)
+DEFAULT_READ_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+# Maximum number of operations submitted to the DB threads at once; further calls wait for a free slot
+DEFAULT_MAX_PENDING = 256
+
+### asyncio facade for the habit tracker
+
+class AsyncHabitStore:
+    """
+    Awaitable counterparts of the Habit, Completion and analytics operations.
+
+    The blocking sqlite3 calls run on DB threads instead of the event loop: all writes on one
+    dedicated writer thread (so writers never wait for each other's locks), reads on a pool of
+    reader threads. Every thread opens its shared connection once when it starts, so coroutines
+    don't wait for connection setup. At most max_pending operations are queued at a time.
+
+    Usage:
+        async with AsyncHabitStore() as store:
+            await store.add_completion("Read Book")
+            streaks = await store.get_longest_streak()
+    """
+
+    def __init__(self, db_path=DB_PATH, read_workers=DEFAULT_READ_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        """
+        Initialize the store and start its DB threads.
+
+        :param db_path: Path of the SQLite database file.
+        :param read_workers: Number of reader threads.
+        :param max_pending: Maximum number of operations queued on the DB threads at once.
+        """
+        self.db_path = db_path
+        self.habits = Habit(db_path)
+        self.completions = Completion(db_path)
+        warm_up = dict(initializer=get_connection, initargs=(db_path,))
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='habits-writer', **warm_up)
+        self._readers = ThreadPoolExecutor(read_workers, thread_name_prefix='habits-reader', **warm_up)
+        self.max_pending = max_pending
+        self._pending = None  # created by the first operation, in the event loop running the store
+
+    async def _run(self, executor, function, *args, **kwargs):
+        """
+        Run a blocking function on a DB thread without blocking the event loop.
+
+        :param executor: Executor of the writer or the reader threads.
+        :param function: Blocking function to call.
+        :return: Result of the function.
+        """
+        if self._pending is None:
+            # before Python 3.10, a semaphore binds to the event loop current when it is created
+            self._pending = asyncio.BoundedSemaphore(self.max_pending)
+        async with self._pending:  # back pressure once max_pending operations are queued
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+    async def _write(self, function, *args, **kwargs):
+        return await self._run(self._writer, function, *args, **kwargs)
+
+    async def _read(self, function, *args, **kwargs):
+        return await self._run(self._readers, function, *args, **kwargs)
+
+    # Habit and Completion operations
+
+    async def add_habit(self, name: str, description: str = "", periodicity: str = "daily"):
+        """Awaitable Habit.add_habit."""
+        return await self._write(self.habits.add_habit, name, description, periodicity)
+
+    async def delete_habit(self, name):
+        """Awaitable Habit.delete_habit."""
+        return await self._write(self.habits.delete_habit, name)
+
+    async def add_completion(self, habit_name):
+        """Awaitable Completion.add_completion."""
+        return await self._write(self.completions.add_completion, habit_name)
+
+    async def get_completions(self, habit_id):
+        """Awaitable Completion.get_completions."""
+        return await self._read(self.completions.get_completions, habit_id)
+
+    # analytics operations
+
+    async def get_all_habits(self):
+        """Awaitable analytics.get_all_habits."""
+        return await self._read(analytics.get_all_habits, self.db_path)
+
+    async def get_habits_by_periodicity(self, periodicity: str):
+        """Awaitable analytics.get_habits_by_periodicity."""
+        return await self._read(analytics.get_habits_by_periodicity, periodicity, self.db_path)
+
+    async def get_longest_streak(self, habit_name=None, backend=None):
+        """Awaitable analytics.get_longest_streak."""
+        return await self._read(analytics.get_longest_streak, habit_name, backend, self.db_path)
+
+    async def get_current_streaks(self, habit_name=None, backend=None):
+        """Awaitable analytics.get_current_streaks."""
+        return await self._read(analytics.get_current_streaks, habit_name, backend, self.db_path)
+
+    async def check_all_broken_habits(self, backend=None):
+        """Awaitable analytics.check_all_broken_habits."""
+        return await self._read(analytics.check_all_broken_habits, backend, self.db_path)
+
+    async def rebuild_habit_stats(self):
+        """Awaitable analytics.rebuild_habit_stats."""
+        return await self._write(analytics.rebuild_habit_stats, self.db_path)
+
+    # lifecycle
+
+    async def close(self):
+        """
+        Wait for the queued operations and stop the DB threads (their connections are closed when the threads exit).
+        """
+        loop = asyncio.get_running_loop()
+        for executor in (self._writer, self._readers):
+            await loop.run_in_executor(None, executor.shutdown, True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,111 @@
+import shlex
+import sys
+import time
+import click
+from db import DB_PATH
+from connection import get_connection
+from cache import bump_write_counter
+
+### batch mode: many CLI commands in one process, sharing one connection and one transaction
+
+
+def parse_lines(lines):
+    """
+    Split batch input into command lines.
+
+    Blank lines and lines starting with '#' are skipped; the other lines are split like a shell would.
+
+    :param lines: Iterable of input lines.
+    :return: Generator of (line_number, args) tuples; args is a list of strings, or a ValueError
+             for lines that can't be split (e.g. an unclosed quote).
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield line_number, shlex.split(line)
+        except ValueError as error:
+            yield line_number, error
+
+
+def _run_line(cli, args):
+    """
+    Run one command line through the CLI group.
+
+    :param cli: click group dispatching the commands.
+    :param args: Arguments of the command line.
+    :return: None if the command succeeded, otherwise the error message.
+    """
+    if args[0] == 'batch':
+        return "batch commands can't be nested"
+    try:
+        cli.main(args, prog_name='batch', standalone_mode=False)
+    except click.exceptions.Exit as exit_:
+        return None if exit_.exit_code == 0 else f"exit code {exit_.exit_code}"
+    except click.Abort:
+        return "aborted"
+    except click.ClickException as error:
+        return error.format_message()
+    except Exception as error:
+        return f"{type(error).__name__}: {error}"
+    return None
+
+
+def run_batch(cli, lines, transaction=True, stop_on_error=False, db_path=DB_PATH, err=None):
+    """
+    Run command lines through the CLI group in this process.
+
+    All commands share the connection of the current thread. With transaction=True the writes of
+    all commands are committed together at the end (instead of one commit per command); every line
+    runs in its own savepoint, so a failing command only rolls back its own changes.
+
+    :param cli: click group dispatching the commands.
+    :param lines: Iterable of input lines (see parse_lines).
+    :param transaction: Optional; run all commands in one transaction.
+    :param stop_on_error: Optional; stop at the first failing line (the lines before it are still committed).
+    :param db_path: Optional; database the transaction is held on.
+    :param err: Optional; file the errors are written to (defaults to stderr).
+    :return: Tuple (commands, failures, seconds).
+    """
+    err = err or sys.stderr
+    db = get_connection(db_path)
+    commands = failures = 0
+    started = time.perf_counter()
+
+    if transaction:
+        db.commit()  # nothing left over from before the batch
+        db.execute('BEGIN')
+        db.deferred = True
+    try:
+        for line_number, args in parse_lines(lines):
+            commands += 1
+            if isinstance(args, ValueError):
+                error = str(args)
+            elif transaction:
+                db.execute('SAVEPOINT batch_line')
+                error = _run_line(cli, args)
+                if error is not None:
+                    db.execute('ROLLBACK TO batch_line')
+                    bump_write_counter()  # cached results may have seen the rolled back writes
+                db.execute('RELEASE batch_line')
+            else:
+                error = _run_line(cli, args)
+
+            if error is not None:
+                failures += 1
+                print(f"line {line_number}: {error}", file=err)
+                if stop_on_error:
+                    break
+    except BaseException:
+        if transaction:
+            db.deferred = False
+            db.rollback()
+            bump_write_counter()
+        raise
+    if transaction:
+        db.deferred = False
+        db.commit()
+        bump_write_counter()
+
+    return commands, failures, time.perf_counter() - started
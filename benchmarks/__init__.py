@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Habit Tracker.
+
+Each module can be run with `python -m benchmarks.<module>` from the repository root
+and writes its results as JSON, so runs on different commits can be compared.
+"""
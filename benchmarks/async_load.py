@@ -0,0 +1,175 @@
+"""
+Load test of the asyncio facade (async_store.AsyncHabitStore).
+
+A synthetic database is generated (see benchmarks.generator) in a temporary directory, then
+many concurrent clients send a mix of reads and completions through one store. The latency
+of every request is recorded, and a ticker coroutine measures how long the event loop is
+blocked (it should stay close to the tick interval, since all sqlite3 calls run on DB threads).
+
+Usage:
+    python -m benchmarks.async_load --clients 500 --requests 20 --output async_load.json
+"""
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import click
+
+import db
+from connection import close_connections
+from benchmarks.generator import SCALES, generate_history
+
+# Interval of the event loop ticker in seconds
+TICK_INTERVAL = 0.005
+
+
+def percentile(values, fraction):
+    """
+    Return the value below which the given fraction of the sorted values lies.
+
+    :param values: Sorted list of numbers.
+    :param fraction: Fraction between 0 and 1, e.g. 0.99 for the p99.
+    :return: The percentile value.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies):
+    """
+    Summarize request latencies.
+
+    :param latencies: List of latencies in seconds.
+    :return: Dictionary with the count and the p50/p95/p99/max latency in ms.
+    """
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(values),
+        'p50_ms': round(statistics.median(values), 3),
+        'p95_ms': round(percentile(values, 0.95), 3),
+        'p99_ms': round(percentile(values, 0.99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+async def run_load(store, habits, clients, requests, write_ratio, seed):
+    """
+    Send requests from concurrent clients through the store.
+
+    :param store: Open AsyncHabitStore.
+    :param habits: Number of habits in the database (named like the generator names them).
+    :param clients: Number of concurrent clients.
+    :param requests: Requests per client.
+    :param write_ratio: Fraction of the requests that record a completion.
+    :param seed: Seed of the request mix.
+    :return: Dictionary with the latency summaries, throughput and event loop lag.
+    """
+    rng = random.Random(seed)
+    latencies = {}
+    ticker_lag = []
+    done = asyncio.Event()
+
+    # Request functions by operation name, taking the name of a random habit
+    operations = {
+        'add_completion': store.add_completion,
+        'get_all_habits': lambda name: store.get_all_habits(),
+        'get_habits_by_periodicity': lambda name: store.get_habits_by_periodicity('daily'),
+        'get_longest_streak': store.get_longest_streak,
+        'get_current_streaks': lambda name: store.get_current_streaks(),
+        'check_all_broken_habits': lambda name: store.check_all_broken_habits(),
+        'get_completions': lambda name: store.get_completions(int(name[-5:])),  # habit IDs match the name numbers
+    }
+    reads = sorted(operations.keys() - {'add_completion'})
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK_INTERVAL)
+            ticker_lag.append(time.perf_counter() - started - TICK_INTERVAL)
+
+    async def client(plan):
+        for operation, habit_name in plan:
+            started = time.perf_counter()
+            await operations[operation](habit_name)
+            latencies.setdefault(operation, []).append(time.perf_counter() - started)
+
+    # The request mix is drawn up front, so it doesn't depend on the scheduling
+    plans = [[('add_completion' if rng.random() < write_ratio else rng.choice(reads),
+               f'Habit {rng.randrange(habits) + 1:05d}') for _ in range(requests)] for _ in range(clients)]
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(client(plan) for plan in plans))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticker_task
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        'clients': clients,
+        'requests_per_client': requests,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(all_latencies) / elapsed, 1),
+        'latency': summarize(all_latencies),
+        'latency_by_operation': {operation: summarize(values) for operation, values in sorted(latencies.items())},
+        'event_loop_max_lag_ms': round(max(ticker_lag, default=0) * 1000, 3),
+    }
+
+
+@click.command()
+@click.option('--scale', default='1k', show_default=True, type=click.Choice(list(SCALES)), help="Data size.")
+@click.option('--clients', default=500, show_default=True, type=click.IntRange(min=1), help="Concurrent clients.")
+@click.option('--requests', default=20, show_default=True, type=click.IntRange(min=1), help="Requests per client.")
+@click.option('--write-ratio', default=0.1, show_default=True, type=click.FloatRange(0, 1),
+              help="Fraction of the requests that record a completion.")
+@click.option('--read-workers', type=click.IntRange(min=1), help="Reader threads of the store.")
+@click.option('--seed', default=1, show_default=True, help="Seed of the data generator and the request mix.")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write the JSON results to this file.")
+def main(scale, clients, requests, write_ratio, read_workers, seed, output):
+    """Measure request latency of AsyncHabitStore under many concurrent clients."""
+    from async_store import AsyncHabitStore, DEFAULT_READ_WORKERS
+
+    habits, years = SCALES[scale]
+    read_workers = read_workers or DEFAULT_READ_WORKERS
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The modules use the relative db.DB_PATH, so the benchmark database is created in the working directory
+        os.chdir(workdir)
+        try:
+            with sqlite3.connect(db.DB_PATH) as connection:
+                generate_history(connection, habits, years, seed)
+            connection.close()
+
+            async def load():
+                async with AsyncHabitStore(read_workers=read_workers) as store:
+                    return await run_load(store, habits, clients, requests, write_ratio, seed)
+
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # discard the messages
+                results = asyncio.run(load())
+        finally:
+            close_connections()
+            os.chdir(previous_dir)
+
+    results = json.dumps({
+        'benchmark': 'async_load',
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'write_ratio': write_ratio,
+        'read_workers': read_workers,
+        **results,
+    }, indent=2)
+    if output:
+        with open(output, 'w') as file:
+            file.write(results + '\n')
+    click.echo(results)
+
+
+if __name__ == '__main__':
+    main()
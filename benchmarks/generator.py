@@ -0,0 +1,115 @@
+"""
+Deterministic synthetic habit histories of any size.
+
+Uses the recording patterns of example_data.add_example_completions (daily habits are
+completed on about 2 out of 3 days, weekly habits in about every other week), but for
+any number of habits over several years. The same seed and end date always produce
+the same database.
+
+Usage:
+    python -m benchmarks.generator bench.db --habits 64 --years 10 --seed 1
+    python -m benchmarks.generator bench.db --storage epoch
+"""
+import random
+import sqlite3
+from datetime import date, datetime, time, timedelta
+import click
+
+from db import migrate
+from example_data import DAILY_CHOICES, WEEKLY_CHOICES
+from stats import rebuild_stats
+from daymap import rebuild_daymaps
+from storage import convert_storage, STORAGE_FORMATS, ISO_FORMAT
+
+# Number of completion rows written per executemany call
+CHUNK_SIZE = 50000
+
+# Named sizes used by the benchmark scenarios: (habits, years) giving roughly 1k, 100k and 10M completions
+SCALES = {
+    '1k': (6, 1),
+    '100k': (64, 10),
+    '10m': (6400, 10),
+}
+
+
+def iter_habit_completions(rng, habit_id, periodicity, start, end):
+    """
+    Generate the completions of one habit between two dates.
+
+    :param rng: Seeded random.Random instance.
+    :param habit_id: ID of the habit.
+    :param periodicity: 'daily' or 'weekly'.
+    :param start: First possible completion date.
+    :param end: Last possible completion date.
+    :return: Generator of (habit_id, completed_at) rows with ISO timestamps.
+    """
+    step = timedelta(days=1) if periodicity == 'daily' else timedelta(weeks=1)
+    choices = DAILY_CHOICES if periodicity == 'daily' else WEEKLY_CHOICES
+    day = start
+    while day <= end:
+        if rng.choice(choices):
+            # Completion at a random time of the day, like completions recorded through the CLI
+            completed_at = datetime.combine(day, time(rng.randrange(24), rng.randrange(60), rng.randrange(60)))
+            yield habit_id, completed_at.isoformat()
+        day += step
+
+
+def generate_history(db, habits, years, seed=1, end=None):
+    """
+    Fill an empty database with synthetic habits and their completions.
+
+    Three out of five habits are daily, the others weekly, as in the example data.
+
+    :param db: Open sqlite3 connection to an empty database.
+    :param habits: Number of habits to create.
+    :param years: Years of completion history per habit.
+    :param seed: Seed of the random generator.
+    :param end: Optional; date of the most recent possible completion (defaults to today).
+    :return: Number of completions written.
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=365 * years)
+    migrate(db)
+    cursor = db.cursor()
+
+    batch = []
+    count = 0
+    for index in range(habits):
+        periodicity = 'weekly' if index % 5 in (2, 3) else 'daily'
+        cursor.execute(
+            'INSERT INTO habits (name, description, periodicity, created_at) VALUES (?, ?, ?, ?)',
+            (f'Habit {index + 1:05d}', f'Synthetic {periodicity} habit', periodicity,
+             datetime.combine(start, time()).isoformat())
+        )
+        batch.extend(iter_habit_completions(rng, cursor.lastrowid, periodicity, start, end))
+        if len(batch) >= CHUNK_SIZE:
+            cursor.executemany('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)', batch)
+            count += len(batch)
+            batch.clear()
+
+    cursor.executemany('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)', batch)
+    count += len(batch)
+    rebuild_stats(cursor)
+    rebuild_daymaps(cursor)
+    db.commit()
+    return count
+
+
+@click.command()
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--habits', default=64, show_default=True, type=click.IntRange(min=1), help="Number of habits.")
+@click.option('--years', default=10, show_default=True, type=click.IntRange(min=1), help="Years of history.")
+@click.option('--seed', default=1, show_default=True, help="Seed of the random generator.")
+@click.option('--storage', type=click.Choice(STORAGE_FORMATS), default=ISO_FORMAT, show_default=True,
+              help="Storage format of the completions.")
+def main(path, habits, years, seed, storage):
+    """Generate a synthetic habit database at PATH."""
+    with sqlite3.connect(path) as db:
+        count = generate_history(db, habits, years, seed)
+        convert_storage(db, storage)
+    click.echo(f"Generated {habits} habits with {count} completions in {path}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Timed scenarios for every CLI command and analytics function at several data sizes.
+
+For every scale a synthetic database is generated (see benchmarks.generator) in a temporary
+directory, and each scenario is run repeatedly in-process, so the numbers exclude interpreter
+startup (measured separately by benchmarks.startup).
+
+Usage:
+    python -m benchmarks.scenarios --scale 1k --scale 100k --output scenarios.json
+    python -m benchmarks.scenarios --scale 10m --repeat 1
+    python -m benchmarks.scenarios --storage epoch
+"""
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import time
+import click
+
+import db
+from connection import close_connections
+from storage import convert_storage, STORAGE_FORMATS, ISO_FORMAT
+from benchmarks.generator import SCALES, generate_history
+
+
+def build_scenarios(workdir):
+    """
+    Build the benchmark scenarios.
+
+    :param workdir: Temporary directory holding the benchmark database.
+    :return: Dictionary mapping scenario names to functions without arguments.
+    """
+    import analytics
+    from main import cli
+
+    import_file = os.path.join(workdir, 'import.csv')
+    with open(import_file, 'w') as file:
+        file.write('habit,completed_at\n')
+        file.writelines(f'Habit 00001,2000-01-01T{minute // 60:02d}:{minute % 60:02d}:00\n' for minute in range(1000))
+
+    counter = iter(range(10 ** 9))
+
+    def run_cli(*args):
+        cli.main(list(args), standalone_mode=False)
+
+    def add_and_delete_habit():
+        name = f'Benchmark {next(counter)}'
+        run_cli('add-habit', name, 'daily')
+        run_cli('delete-habit', name)
+
+    scenarios = {
+        'analytics.get_all_habits': analytics.get_all_habits,
+        'analytics.get_habits_by_periodicity': lambda: analytics.get_habits_by_periodicity('daily'),
+        'analytics.get_longest_streak(habit)': lambda: analytics.get_longest_streak('Habit 00001'),
+        'analytics.get_current_streaks': analytics.get_current_streaks,
+        'analytics.rebuild_habit_stats': analytics.rebuild_habit_stats,
+        'cli.add-habit+delete-habit': add_and_delete_habit,
+        'cli.complete-habit': lambda: run_cli('complete-habit', 'Habit 00001'),
+        'cli.list-habits': lambda: run_cli('list-habits'),
+        'cli.list-by-period': lambda: run_cli('list-by-period', 'weekly'),
+        'cli.longest-streak': lambda: run_cli('longest-streak'),
+        'cli.check-habits': lambda: run_cli('check-habits'),
+        'cli.rebuild-stats': lambda: run_cli('rebuild-stats'),
+        'cli.export': lambda: run_cli('export'),
+        'cli.import-completions(1000 rows)': lambda: run_cli('import-completions', import_file),
+    }
+    for backend in analytics.STREAK_BACKENDS:
+        scenarios[f'analytics.get_longest_streak[{backend}]'] = \
+            lambda backend=backend: analytics.get_longest_streak(backend=backend)
+        scenarios[f'analytics.check_all_broken_habits[{backend}]'] = \
+            lambda backend=backend: analytics.check_all_broken_habits(backend)
+    return scenarios
+
+
+def time_scenario(function, repeat):
+    """
+    Run a scenario repeatedly with its output discarded.
+
+    :param function: Scenario function.
+    :param repeat: Number of runs.
+    :return: Dictionary with the number of runs and min/median wall time in ms.
+    """
+    timings = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+    return {'runs': repeat, 'min_ms': round(min(timings), 3), 'median_ms': round(statistics.median(timings), 3)}
+
+
+def run_scale(scale, repeat, seed, only=None, storage=ISO_FORMAT):
+    """
+    Generate the database of one scale and time all scenarios on it.
+
+    :param scale: Name of the scale in benchmarks.generator.SCALES.
+    :param repeat: Number of runs per scenario.
+    :param seed: Seed of the data generator.
+    :param only: Optional; substring a scenario name must contain to be run.
+    :param storage: Optional; storage format of the completions ('iso' or 'epoch').
+    :return: Dictionary with the data size, generation time and scenario timings.
+    """
+    habits, years = SCALES[scale]
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The modules use the relative db.DB_PATH, so the benchmark database is created in the working directory
+        os.chdir(workdir)
+        try:
+            started = time.perf_counter()
+            with sqlite3.connect(db.DB_PATH) as connection:
+                completions = generate_history(connection, habits, years, seed)
+                convert_storage(connection, storage, vacuum=True)
+            connection.close()
+            generate_seconds = time.perf_counter() - started
+            database_bytes = os.path.getsize(db.DB_PATH)
+
+            close_connections()
+            results = {}
+            for name, function in build_scenarios(workdir).items():
+                if only is None or only in name:
+                    results[name] = time_scenario(function, repeat)
+        finally:
+            close_connections()
+            os.chdir(previous_dir)
+
+    return {
+        'habits': habits,
+        'years': years,
+        'completions': completions,
+        'storage': storage,
+        'database_bytes': database_bytes,
+        'generate_s': round(generate_seconds, 3),
+        'scenarios': results,
+    }
+
+
+@click.command()
+@click.option('--scale', 'scales', multiple=True, type=click.Choice(list(SCALES)),
+              help="Data size to benchmark, can be repeated (default: 1k and 100k).")
+@click.option('--repeat', default=5, show_default=True, type=click.IntRange(min=1), help="Runs per scenario.")
+@click.option('--seed', default=1, show_default=True, help="Seed of the data generator.")
+@click.option('--only', help="Only run scenarios whose name contains this text.")
+@click.option('--storage', type=click.Choice(STORAGE_FORMATS), default=ISO_FORMAT, show_default=True,
+              help="Storage format of the completions.")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write the JSON results to this file.")
+def main(scales, repeat, seed, only, storage, output):
+    """Time every CLI command and analytics function on synthetic databases."""
+    results = {
+        'benchmark': 'scenarios',
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seed,
+        'scales': {scale: run_scale(scale, repeat, seed, only, storage) for scale in scales or ('1k', '100k')},
+    }
+    results = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w') as file:
+            file.write(results + '\n')
+    click.echo(results)
+
+
+if __name__ == '__main__':
+    main()
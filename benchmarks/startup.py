@@ -0,0 +1,95 @@
+"""
+Cold-start latency of the CLI commands.
+
+Every command is run repeatedly as a fresh `python main.py ...` process against a
+temporary database, so the numbers include interpreter startup, imports, database
+initialization and the command itself.
+
+Usage:
+    python -m benchmarks.startup --runs 20 --output startup.json
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import click
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+# Command lines to measure, by name; write commands are paired so the database stays the same size
+COMMANDS = {
+    'help': ['--help'],
+    'list-habits': ['list-habits'],
+    'list-by-period': ['list-by-period', 'daily'],
+    'longest-streak': ['longest-streak'],
+    'check-habits': ['check-habits'],
+    'complete-habit': ['complete-habit', 'Read Book'],
+    'add-habit': ['add-habit', 'Benchmark Habit', 'daily'],
+    'delete-habit': ['delete-habit', 'Benchmark Habit'],
+}
+
+
+def run_command(args, cwd):
+    """
+    Run one CLI invocation in a new process.
+
+    :param args: Command line arguments for main.py.
+    :param cwd: Working directory holding the database.
+    :return: Wall time of the process in milliseconds.
+    """
+    started = time.perf_counter()
+    subprocess.run([sys.executable, MAIN_PATH, *args], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_startup(runs=20, commands=None):
+    """
+    Measure the cold-start latency of CLI commands.
+
+    :param runs: Number of measured invocations per command.
+    :param commands: Optional; names from COMMANDS to measure (all by default).
+    :return: Dictionary with the environment and min/median/p95 latency in ms per command.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        run_command(['list-habits'], workdir)  # creates the database with example data, not measured
+
+        for name in commands or COMMANDS:
+            timings = sorted(run_command(COMMANDS[name], workdir) for _ in range(runs))
+            results[name] = {
+                'runs': runs,
+                'min_ms': round(timings[0], 2),
+                'median_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(timings[min(runs - 1, int(runs * 0.95))], 2),
+            }
+
+    return {
+        'benchmark': 'startup',
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commands': results,
+    }
+
+
+@click.command()
+@click.option('--runs', default=20, show_default=True, type=click.IntRange(min=1),
+              help="Measured invocations per command.")
+@click.option('--command', 'commands', multiple=True, type=click.Choice(list(COMMANDS)),
+              help="Command to measure, can be repeated (default: all).")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write the JSON results to this file.")
+def main(runs, commands, output):
+    """Measure the cold-start latency of every CLI command."""
+    results = json.dumps(measure_startup(runs, commands), indent=2)
+    if output:
+        with open(output, 'w') as file:
+            file.write(results + '\n')
+    click.echo(results)
+
+
+if __name__ == '__main__':
+    main()
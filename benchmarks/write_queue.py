@@ -0,0 +1,129 @@
+"""
+Completion throughput with and without the write-behind queue (write_queue.CompletionQueue)
+and the append-only completion log (completion_log.CompletionLog).
+
+Producer threads record completions of random habits in a synthetic database, either
+synchronously (one transaction per completion), through a shared write-behind queue
+(one transaction per batch) or through the completion log (one fsync per batch, merged into
+the database in large transactions), and the completions per second of the modes are reported.
+
+Usage:
+    python -m benchmarks.write_queue --completions 5000 --threads 1 --threads 8 --output write_queue.json
+"""
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import click
+
+from connection import close_connections
+from benchmarks.generator import generate_history
+
+# Habits of the benchmark database
+HABITS = 64
+
+
+def record(db_path, completions, threads, mode, flush_interval_ms, max_batch, seed):
+    """
+    Record completions from several producer threads and measure the throughput.
+
+    :param db_path: Path of the benchmark database.
+    :param completions: Total number of completions.
+    :param threads: Number of producer threads.
+    :param mode: 'sync', 'write-behind' (CompletionQueue) or 'log' (CompletionLog).
+    :param flush_interval_ms: Flush interval of the queue.
+    :param max_batch: Largest batch of the queue.
+    :param seed: Seed of the habit choice.
+    :return: Dictionary with the elapsed time, completions per second and number of commits
+             (merged segments for the log, whose remaining records are merged when it is closed).
+    """
+    from completion import Completion
+    from write_queue import CompletionQueue
+    from completion_log import CompletionLog
+
+    rng = random.Random(seed)
+    names = [f'Habit {rng.randrange(HABITS) + 1:05d}' for _ in range(completions)]
+    shares = [names[index::threads] for index in range(threads)]
+    if mode == 'write-behind':
+        completion_queue = CompletionQueue(db_path, flush_interval_ms, max_batch)
+    elif mode == 'log':
+        completion_queue = CompletionLog(db_path, sync_interval_ms=flush_interval_ms)
+    else:
+        completion_queue = None
+
+    def produce(share):
+        completion = Completion(db_path, write_behind=completion_queue)
+        futures = [completion.add_completion(name) for name in share]
+        if completion_queue:
+            for future in futures:
+                future.result()  # the completion counts once it is committed
+        close_connections()
+
+    workers = [threading.Thread(target=produce, args=(share,)) for share in shares]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # discard the messages
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+    if completion_queue:
+        completion_queue.close()
+
+    return {
+        'threads': threads,
+        'elapsed_s': round(elapsed, 3),
+        'completions_per_s': round(completions / elapsed, 1),
+        'commits': completion_queue.compactions if mode == 'log' else
+                   completion_queue.commits if completion_queue else completions,
+    }
+
+
+@click.command()
+@click.option('--completions', default=5000, show_default=True, type=click.IntRange(min=1),
+              help="Completions recorded per run.")
+@click.option('--threads', 'thread_counts', multiple=True, type=click.IntRange(min=1),
+              help="Producer threads, can be repeated (default: 1 and 8).")
+@click.option('--flush-interval-ms', default=5, show_default=True, type=click.FloatRange(min=0),
+              help="Flush interval of the write-behind queue.")
+@click.option('--max-batch', default=1000, show_default=True, type=click.IntRange(min=1),
+              help="Largest batch of the write-behind queue.")
+@click.option('--seed', default=1, show_default=True, help="Seed of the data generator and the habit choice.")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write the JSON results to this file.")
+def main(completions, thread_counts, flush_interval_ms, max_batch, seed, output):
+    """Measure completions per second with synchronous commits, the write-behind queue and the completion log."""
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for threads in thread_counts or (1, 8):
+            for mode in ('sync', 'write-behind', 'log'):
+                db_path = os.path.join(workdir, f'{mode}-{threads}.db')
+                with sqlite3.connect(db_path) as connection:
+                    generate_history(connection, HABITS, 1, seed)
+                connection.close()
+                result = record(db_path, completions, threads, mode, flush_interval_ms, max_batch, seed)
+                runs.append({'mode': mode, **result})
+                close_connections()
+
+    results = json.dumps({
+        'benchmark': 'write_queue',
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'completions': completions,
+        'flush_interval_ms': flush_interval_ms,
+        'max_batch': max_batch,
+        'runs': runs,
+    }, indent=2)
+    if output:
+        with open(output, 'w') as file:
+            file.write(results + '\n')
+    click.echo(results)
+
+
+if __name__ == '__main__':
+    main()
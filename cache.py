@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+### bounded LRU cache for the results of read queries
+
+# Maximum number of cached results, can be overridden with the HABITS_CACHE_SIZE environment variable (0 disables the cache)
+CACHE_SIZE = int(os.environ.get('HABITS_CACHE_SIZE', 128))
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# (connection, key) -> (data token, result), least recently used first
+_entries = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+_write_counter = 0
+
+
+def bump_write_counter():
+    """
+    Record a write to the database, so every cached result becomes invalid.
+
+    Called by the Habit and Completion writes and other bulk writers. PRAGMA data_version
+    only reports commits made through other connections, so writes through the shared
+    connection have to be announced here.
+    """
+    global _write_counter
+    with _lock:
+        _write_counter += 1
+
+
+def _data_token(db):
+    """
+    Build the token identifying the current state of the database as seen by a connection.
+
+    :param db: Open sqlite3 connection the result is read from.
+    :return: Tuple that changes whenever the data may have changed.
+    """
+    data_version = db.execute('PRAGMA data_version').fetchone()[0]  # changes on commits of other connections
+    # total_changes also catches writes through this connection that were not announced with bump_write_counter
+    return data_version, db.total_changes, _write_counter
+
+
+def cached_query(db, key, compute, maxsize=None):
+    """
+    Return the cached result of a read query, or compute and cache it.
+
+    Results are only reused while the database is unchanged, i.e. neither PRAGMA data_version
+    of the connection, its total_changes nor the write counter have changed since the result
+    was cached. Callers must not modify the returned result.
+
+    :param db: Open sqlite3 connection the result is read from.
+    :param key: Hashable key of the query and its arguments (including the database path).
+    :param compute: Function without arguments computing the result on a cache miss.
+    :param maxsize: Optional; maximum number of cached results, defaults to CACHE_SIZE.
+    :return: The (possibly cached) result.
+    """
+    global _hits, _misses
+    maxsize = CACHE_SIZE if maxsize is None else maxsize
+    token = _data_token(db)
+    # Entries are kept per connection, since data_version values are only comparable on the same connection
+    # (threads using their own connections, e.g. the workers of AsyncHabitStore, don't evict each other's results)
+    key = db, key
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == token:
+            _entries.move_to_end(key)
+            _hits += 1
+            return entry[1]
+        _misses += 1
+
+    result = compute()
+    if maxsize > 0:
+        with _lock:
+            _entries[key] = (token, result)
+            _entries.move_to_end(key)
+            while len(_entries) > maxsize:
+                _entries.popitem(last=False)  # evict the least recently used result
+    return result
+
+
+def cache_info():
+    """
+    Return the hit/miss statistics of the query cache.
+
+    :return: CacheInfo(hits, misses, maxsize, currsize), like functools.lru_cache.
+    """
+    with _lock:
+        return CacheInfo(_hits, _misses, CACHE_SIZE, len(_entries))
+
+
+def clear_cache():
+    """
+    Remove all cached results and reset the statistics.
+    """
+    global _hits, _misses
+    with _lock:
+        _entries.clear()
+        _hits = _misses = 0
@@ -1,44 +1,88 @@
+import os
 import sqlite3
 from datetime import datetime
 from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection, iter_rows  # shared per-thread connection
+from stats import record_completion  # keeps habit_stats up to date
+from daymap import record_period  # keeps habit_daymaps up to date
+from streaks import day_number
+from storage import get_storage_format, cached_storage_format, completion_row, day_bound, day_to_date
+from storage import INSERT_SQL, COMPLETED_AT_SQL, EPOCH_FORMAT
+from cache import cached_query, bump_write_counter  # cached reads are invalidated by every write
+from profiling import profiled  # wall time per call while --profile is active
+import hooks  # change notifications, e.g. for the reminder scheduler; merges the completion log before reads
+from registry import get_registry  # habit lookups without SQL
+
+def write_completion(cursor, habit_id, periodicity, completed_at, storage_format=None):
+    """
+    Insert a completion row and update the streak statistics and bitset, without committing.
+
+    :param cursor: Cursor of an open connection.
+    :param habit_id: ID of the completed habit.
+    :param periodicity: Periodicity of the habit ('daily' or 'weekly').
+    :param completed_at: datetime of the completion.
+    :param storage_format: Optional; storage format of the database, detected once per connection if omitted.
+    """
+    # The row is written in the storage format of the database (ISO text or epoch seconds)
+    storage_format = storage_format or cached_storage_format(cursor)
+    try:
+        cursor.execute(INSERT_SQL[storage_format], completion_row(storage_format, habit_id, completed_at))
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
+        # The columns don't match if another process converted the storage format in the meantime
+        current_format = cached_storage_format(cursor, refresh=True)
+        if current_format == storage_format:
+            raise
+        cursor.execute(INSERT_SQL[current_format], completion_row(current_format, habit_id, completed_at))
+    # Update the streak statistics and the completion bitset in the same transaction
+    day = day_number(completed_at.date())
+    record_completion(cursor, habit_id, periodicity, day)
+    record_period(cursor, habit_id, periodicity, day)
+
 
 class Completion:
-    def __init__(self, db_path=DB_PATH):
+    def __init__(self, db_path=DB_PATH, write_behind=None):
         """
         Initialize the Completion class with a database path.
+
+        :param db_path: Path of the SQLite database file.
+        :param write_behind: Optional; write_queue.CompletionQueue or completion_log.CompletionLog the completions
+                             are handed to instead of being committed one by one (write-behind mode).
         """
-        self.db_path = DB_PATH  # Use the imported DB_PATH
+        self.db_path = db_path
+        self.write_behind = write_behind
 
+    @profiled
     def add_completion(self, habit_name):
         """
         Add a completion record for a given habit.
 
         :param habit_name: The name of the habit to mark as complete.
+        :return: In write-behind mode a Future resolved once the completion is committed, otherwise None.
         """
-        with sqlite3.connect(self.db_path) as db:
+        if self.write_behind is not None:
+            return self.write_behind.submit(habit_name)
+
+        with get_connection(self.db_path) as db:
             cursor = db.cursor()
-            # Retrieve habit ID
-            cursor.execute("SELECT id FROM habits WHERE name = ?", (habit_name,))
-            habit = cursor.fetchone()
+            # Retrieve habit ID and periodicity from the registry, without a query
+            habit = get_registry(self.db_path).get(habit_name)
 
             if not habit:
                 print(f"Habit '{habit_name}' does not exist.")
                 return
 
-            habit_id = habit[0]
-            completed_at = datetime.now().isoformat()  # Record completion in ISO format
+            habit_id, periodicity = habit.id, habit.periodicity
+            now = datetime.now()
+            completed_at = now.isoformat()  # Record completion in ISO format
 
-            cursor.execute(
-                '''
-                INSERT INTO completions (habit_id, completed_at)
-                VALUES (?, ?)
-                ''',
-                (habit_id, completed_at)
-            )
+            write_completion(cursor, habit_id, periodicity, now)
             db.commit()
+            bump_write_counter()
+            hooks.notify(self.db_path, habit_name, 'completed')
             print(f"Habit '{habit_name}' marked as complete at {completed_at}.")
 
 
+    @profiled
     def get_completions(self, habit_id):
         """
         Retrieve all completion dates for a given habit ID as datetime.date objects.
@@ -46,15 +90,59 @@ class Completion:
         :param habit_id: ID of the habit to retrieve completions for.
         :return: List of completion dates as datetime.date objects.
         """
-        with sqlite3.connect(self.db_path) as db:
+        hooks.merge_completion_log(self.db_path)
+        with get_connection(self.db_path) as db:
             cursor = db.cursor()
-            cursor.execute(
-                '''
-                SELECT completed_at FROM completions
-                WHERE habit_id = ?
-                ORDER BY completed_at DESC
-                ''',
-                (habit_id,)
-            )
-            # Parse each date to a datetime.date object and return a list of dates
-            return [datetime.fromisoformat(row[0]).date() for row in cursor.fetchall()]
\ No newline at end of file
+
+            def query():
+                precomputed = get_storage_format(cursor) == EPOCH_FORMAT
+                cursor.execute(
+                    f'''
+                    SELECT {'day' if precomputed else 'completed_at'} FROM completions
+                    WHERE habit_id = ?
+                    ORDER BY completed_at DESC
+                    ''',
+                    (habit_id,)
+                )
+                if precomputed:
+                    # The epoch storage format keeps the day number of each completion, no parsing needed
+                    return [day_to_date(row[0]) for row in cursor.fetchall()]
+                # Parse each date to a datetime.date object and return a list of dates
+                return [datetime.fromisoformat(row[0]).date() for row in cursor.fetchall()]
+
+            # Repeated reads of an unchanged habit are served from the query cache
+            return list(cached_query(db, ('get_completions', os.fspath(self.db_path), habit_id), query))
+
+    def iter_completions(self, habit_id=None, since=None, until=None):
+        """
+        Stream completion records grouped by habit, in chronological order per habit, without building a list.
+
+        :param habit_id: Optional; only yield completions of this habit.
+        :param since: Optional; datetime.date of the first day to include.
+        :param until: Optional; datetime.date of the first day to exclude.
+        :return: Generator of (habit_id, habit_name, completed_at) tuples, completed_at as ISO string.
+        """
+        hooks.merge_completion_log(self.db_path)
+        cursor = get_connection(self.db_path).cursor()
+        storage_format = get_storage_format(cursor)
+        query = f'''
+            SELECT c.habit_id, h.name, {COMPLETED_AT_SQL[storage_format]}
+            FROM completions c
+            JOIN habits h ON h.id = c.habit_id
+        '''
+        conditions, params = [], []
+        if habit_id is not None:
+            conditions.append('c.habit_id = ?')
+            params.append(habit_id)
+        if since is not None:
+            conditions.append('c.completed_at >= ?')
+            params.append(day_bound(storage_format, since))
+        if until is not None:
+            conditions.append('c.completed_at < ?')
+            params.append(day_bound(storage_format, until))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY c.habit_id, c.completed_at'  # follows the completion index, no sorting needed
+
+        cursor.execute(query, params)
+        yield from iter_rows(cursor)
\ No newline at end of file
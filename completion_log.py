@@ -0,0 +1,421 @@
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection, close_connections  # shared per-thread connection
+from storage import get_storage_format, completion_row, INSERT_SQL, EPOCH
+from stats import record_completions  # keeps habit_stats up to date
+from daymap import record_periods  # keeps habit_daymaps up to date
+from cache import bump_write_counter
+import hooks
+from registry import get_registry  # habit lookups without SQL
+
+# Every open segment is locked with flock, so logs of other processes on the same database don't take
+# it for a crash leftover; without fcntl (Windows), only one process may open a log per database
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Record of a logged completion: habit id and local time of the completion in seconds since 1970-01-01
+RECORD = struct.Struct('<Iq')
+
+# Longest time an appended completion waits for the fsync making it durable, in milliseconds
+DEFAULT_SYNC_INTERVAL_MS = 10
+
+# The log is merged into the completions table once it holds this many records ...
+DEFAULT_COMPACT_RECORDS = 50000
+
+# ... or once its oldest record is this many seconds old
+DEFAULT_COMPACT_INTERVAL_S = 1.0
+
+# Open logs of this process by database path, so reads can merge their tail first
+_logs = {}
+_lock = threading.Lock()
+
+### append-only completion log, compacted into the completions table
+
+
+def segment_path(db_path, segment):
+    """
+    Return the path of a log segment, next to the database file.
+
+    :param db_path: Path of the SQLite database file.
+    :param segment: Number of the segment.
+    :return: Path of the segment file.
+    """
+    return f'{os.fspath(db_path)}-completions.{segment:08d}.log'
+
+
+def list_segments(db_path):
+    """
+    List the log segments of a database that exist on disk.
+
+    :param db_path: Path of the SQLite database file.
+    :return: List of (segment, path) tuples, the oldest segment first.
+    """
+    directory, name = os.path.split(os.path.abspath(db_path))
+    pattern = re.compile(re.escape(name) + r'-completions\.(\d{8})\.log')
+    segments = []
+    for entry in os.listdir(directory):
+        match = pattern.fullmatch(entry)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(directory, entry)))
+    return sorted(segments)
+
+
+def _lock_file(file, wait=True):
+    """
+    Take an exclusive lock on an open file, held until the file is closed.
+
+    :param file: Open file object.
+    :param wait: Optional; wait for the lock if another process holds it.
+    :return: True if the lock was taken, False if another process holds it (only without wait).
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def create_segment(db_path):
+    """
+    Create and lock the next unused log segment.
+
+    The file is created and locked under a temporary name and then linked to its segment name,
+    so it is never visible unlocked and two logs never get the same segment. The segments on
+    disk are listed before the merged ones are read: a segment merged by another log in the
+    meantime is recorded in completion_log_segments before its file is removed.
+
+    :param db_path: Path of the SQLite database file.
+    :return: Tuple (segment, file) with the number of the segment and the locked file opened for appending.
+    """
+    on_disk = [segment for segment, _ in list_segments(db_path)]
+    merged = get_connection(db_path).execute('SELECT MAX(segment) FROM completion_log_segments').fetchone()[0] or 0
+    segment = max(on_disk + [merged]) + 1
+
+    temporary_path = f'{os.fspath(db_path)}-completions.{os.getpid()}-{threading.get_ident()}.new'
+    file = open(temporary_path, 'wb')
+    _lock_file(file)
+    try:
+        while True:
+            try:
+                os.link(temporary_path, segment_path(db_path, segment))
+                return segment, file
+            except FileExistsError:
+                segment += 1
+    finally:
+        os.remove(temporary_path)
+
+
+def remove_segment(db_path, segment):
+    """
+    Remove the file of a merged segment and forget that it was merged.
+
+    The highest merged segment stays recorded, so create_segment never reuses its number.
+
+    :param db_path: Path of the SQLite database file.
+    :param segment: Number of the merged segment.
+    """
+    try:
+        os.remove(segment_path(db_path, segment))
+    except FileNotFoundError:
+        pass  # removed by an earlier attempt that failed afterwards
+    db = get_connection(db_path)
+    db.execute('DELETE FROM completion_log_segments WHERE segment = ? '
+               'AND segment < (SELECT MAX(segment) FROM completion_log_segments)', (segment,))
+    db.commit()
+
+
+def recover_segments(db_path):
+    """
+    Merge and remove the segments left by crashed logs of a database.
+
+    Segments locked by an open log (of any process) are skipped.
+
+    :param db_path: Path of the SQLite database file.
+    :return: Number of segments recovered.
+    """
+    recovered = 0
+    for segment, path in list_segments(db_path):
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            continue  # merged by its log in the meantime
+        with file:
+            if not _lock_file(file, wait=False) or os.fstat(file.fileno()).st_nlink == 0:
+                continue  # still open, or merged and removed before the lock was taken
+            merge_segment(db_path, segment, read_segment(path))
+            remove_segment(db_path, segment)
+            recovered += 1
+    return recovered
+
+
+def read_segment(path):
+    """
+    Read the records of a log segment.
+
+    :param path: Path of the segment file.
+    :return: List of (habit_id, seconds) tuples; a record cut short by a crash is ignored.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    return list(RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]))
+
+
+def merge_segment(db_path, segment, records):
+    """
+    Write the records of a segment into the completions table in one transaction.
+
+    The completion rows are inserted with one executemany, and the statistics and bitset of
+    every habit are updated once for all of its records. The segment number is stored in
+    completion_log_segments in the same transaction, so a segment whose file was not removed
+    before a crash is not merged twice. Records of habits deleted in the meantime are skipped.
+    The caller holds the lock of the segment.
+
+    :param db_path: Path of the SQLite database file.
+    :param segment: Number of the segment.
+    :param records: Records of the segment as returned by read_segment.
+    :return: Number of completions written (0 if the segment was merged before).
+    """
+    db = get_connection(db_path)
+    cursor = db.cursor()
+    if cursor.execute('SELECT 1 FROM completion_log_segments WHERE segment = ?', (segment,)).fetchone():
+        return 0
+
+    storage_format = get_storage_format(cursor)
+    habits = {}  # habit id -> (name, periodicity), each habit is looked up once per segment
+    days = {}    # habit id -> day numbers of its records
+    rows = []
+    try:
+        for habit_id, seconds in records:
+            if habit_id not in habits:
+                habits[habit_id] = cursor.execute('SELECT name, periodicity FROM habits WHERE id = ?',
+                                                  (habit_id,)).fetchone()
+            if habits[habit_id] is None:
+                continue
+            rows.append(completion_row(storage_format, habit_id, EPOCH + timedelta(seconds=seconds)))
+            days.setdefault(habit_id, []).append(seconds // 86400)
+        cursor.executemany(INSERT_SQL[storage_format], rows)
+        for habit_id, habit_days in days.items():
+            habit_days.sort()
+            record_completions(cursor, habit_id, habits[habit_id][1], habit_days)
+            record_periods(cursor, habit_id, habits[habit_id][1], habit_days)
+
+        cursor.execute('INSERT INTO completion_log_segments (segment, records) VALUES (?, ?)', (segment, len(records)))
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+    bump_write_counter()
+
+    for habit_id in days:
+        hooks.notify(db_path, habits[habit_id][0], 'completed')
+    return len(rows)
+
+
+def merge_tail(db_path=DB_PATH):
+    """
+    Merge the records of this process's open log of a database into the completions table.
+
+    Called before reading completions, so results include the completions still in the log.
+
+    :param db_path: Path of the SQLite database file.
+    """
+    log = _logs.get(os.fspath(db_path))
+    if log is not None:
+        log.compact()
+
+
+class CompletionLog:
+    """
+    Append-only log of completions for write-heavy ingestion.
+
+    submit() appends a fixed-size binary record (habit id, epoch seconds) to the current log
+    segment. A background thread fsyncs the log every sync_interval_ms (one fsync for all records
+    appended meanwhile) and merges full or old segments into the completions table in one
+    transaction each. Reads through Completion and analytics merge the log first, so their
+    results stay exact. Segments left by a crashed process are merged when a log is opened again.
+    Several processes can open a log of the same database: every log appends to its own segment
+    and holds a lock on it, so other logs leave it alone.
+
+    Usage:
+        with CompletionLog() as completion_log:
+            future = Completion(write_behind=completion_log).add_completion("Read Book")
+            future.result()  # wait until the completion is durable in the log
+    """
+
+    def __init__(self, db_path=DB_PATH, sync_interval_ms=DEFAULT_SYNC_INTERVAL_MS,
+                 compact_records=DEFAULT_COMPACT_RECORDS, compact_interval_s=DEFAULT_COMPACT_INTERVAL_S):
+        """
+        Merge leftover segments, open a new segment and start the background thread.
+
+        :param db_path: Path of the SQLite database file.
+        :param sync_interval_ms: Longest time an appended completion waits for its fsync.
+        :param compact_records: Number of records after which the log is merged into the database.
+        :param compact_interval_s: Age of the oldest record after which the log is merged into the database.
+        """
+        self.db_path = db_path
+        self.sync_interval = sync_interval_ms / 1000
+        self.compact_records = compact_records
+        self.compact_interval = compact_interval_s
+        self.compactions = 0  # number of segments merged so far
+        self._lock = threading.Lock()          # appends and segment rotation
+        self._sync_lock = threading.Lock()     # one fsync or rotation at a time
+        self._compact_lock = threading.Lock()  # one merge at a time
+        self._futures = []  # futures of the records appended since the last fsync
+        self._records = 0   # records in the current segment
+        self._started = None  # time of the first record of the current segment
+        self._unmerged = []  # (segment, file, futures) of the segments left to merge, the oldest first
+        self._closed = False
+        self._stopping = threading.Event()
+
+        key = os.fspath(db_path)
+        if key in _logs:
+            raise RuntimeError(f"A completion log of '{key}' is already open in this process.")
+
+        recover_segments(db_path)
+        self._segment, self._file = create_segment(db_path)
+
+        self._syncer = threading.Thread(target=self._run, name='habits-completion-log', daemon=True)
+        self._syncer.start()
+        with _lock:
+            _logs[key] = self
+
+    def submit(self, habit_name):
+        """
+        Append a completion of a habit, timestamped now.
+
+        :param habit_name: The name of the habit to mark as complete.
+        :return: Future resolved with the completion time (datetime) once the record is fsynced,
+                 or with None if the habit does not exist.
+        """
+        future = Future()
+        habit = get_registry(self.db_path).get(habit_name)
+        if habit is None:
+            future.set_result(None)
+            return future
+
+        now = datetime.now()
+        delta = now - EPOCH
+        record = RECORD.pack(habit.id, delta.days * 86400 + delta.seconds)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The completion log is closed.")
+            self._file.write(record)
+            if not self._records:
+                self._started = time.monotonic()
+            self._records += 1
+            self._futures.append((future, now))
+        return future
+
+    def sync(self):
+        """
+        Make the appended records durable (one fsync) and resolve their futures.
+        """
+        with self._sync_lock:
+            with self._lock:
+                self._file.flush()
+                futures, self._futures = self._futures, []
+            try:
+                os.fsync(self._file.fileno())
+            except OSError:
+                with self._lock:  # the next sync tries again
+                    self._futures[:0] = futures
+                raise
+        for future, completed_at in futures:
+            future.set_result(completed_at)
+
+    def compact(self):
+        """
+        Merge the records appended so far into the completions table and start a new segment.
+
+        Segments that failed to merge earlier (e.g. because the database was locked) are merged
+        first; they stay open, and so locked, until they are merged.
+
+        :return: Number of completions written to the database.
+        """
+        with self._compact_lock:
+            with self._sync_lock:
+                with self._lock:
+                    if self._records:
+                        self._unmerged.append((self._segment, self._file, self._futures))
+                        self._segment, self._file = create_segment(self.db_path)
+                        self._futures, self._records = [], 0
+
+            merged = 0
+            while self._unmerged:
+                segment, file, futures = self._unmerged[0]
+                file.flush()
+                os.fsync(file.fileno())
+                for future, completed_at in futures:
+                    future.set_result(completed_at)
+                futures.clear()
+
+                merged += merge_segment(self.db_path, segment, read_segment(segment_path(self.db_path, segment)))
+                remove_segment(self.db_path, segment)
+                file.close()  # keeps the segment locked until its file is removed
+                del self._unmerged[0]
+                self.compactions += 1
+            return merged
+
+    def close(self):
+        """
+        Merge the remaining records, stop the background thread and remove the empty segment.
+
+        If the remaining records can't be merged, their futures fail with the error, and their
+        segments are left for the next log of the database to recover.
+        """
+        with self._lock:  # submits after this point raise, so none lands in the segment removed below
+            if self._closed:
+                return
+            self._closed = True
+        with _lock:
+            _logs.pop(os.fspath(self.db_path), None)
+        self._stopping.set()
+        self._syncer.join()
+        try:
+            self.compact()
+        except Exception as error:
+            for _, file, futures in self._unmerged:
+                for future, _ in futures:
+                    future.set_exception(error)
+                file.close()
+            raise
+        finally:
+            os.remove(segment_path(self.db_path, self._segment))
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        """
+        Background thread: fsync the log regularly and merge it once it is full or old enough.
+        """
+        while not self._stopping.wait(self.sync_interval):
+            try:
+                if self._futures:
+                    self.sync()
+                records, started = self._records, self._started
+                if self._unmerged or records >= self.compact_records \
+                        or (records and time.monotonic() - started >= self.compact_interval):
+                    self.compact()
+            except Exception:
+                # the records stay in their segments, and are synced and merged by a later attempt
+                import traceback  # imported here, only needed when syncing or merging fails
+                print(f"The completion log of '{os.fspath(self.db_path)}' failed, retrying:", file=sys.stderr)
+                traceback.print_exc()
+                self._stopping.wait(self.compact_interval)
+        close_connections(self.db_path)
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+from db import DB_PATH  # Import the DB_PATH
+import profiling  # profiled connections while --profile is active
+
+# Number of rows fetched per round trip when streaming query results
+FETCH_BATCH_SIZE = 1000
+
+# How long a connection waits for a lock held by another writer before raising
+BUSY_TIMEOUT_MS = 5000
+
+# Connections are reused per thread, since sqlite3 connections must not be shared between threads
+_local = threading.local()
+_lock = threading.Lock()
+_opened = 0
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection whose commits can be deferred.
+
+    While deferred is set, commit(), rollback() and leaving a `with connection:` block don't end
+    the transaction, so batch mode can run the writes of many commands in one transaction.
+    """
+    deferred = False
+    storage_format = None  # (conversions, format) cached by storage.cached_storage_format
+
+    def commit(self):
+        if not self.deferred:
+            super().commit()
+
+    def rollback(self):
+        if not self.deferred:
+            super().rollback()
+
+    def __exit__(self, *exc_info):
+        if self.deferred:
+            return False
+        return super().__exit__(*exc_info)
+
+
+class ProfiledConnection(Connection):
+    """
+    Connection whose cursors (including those of Connection.execute) time their statements.
+    """
+
+    def cursor(self, factory=profiling.ProfiledCursor):
+        return super().cursor(factory)
+
+
+def get_connection(db_path=DB_PATH):
+    """
+    Return the shared connection of the current thread for the given database.
+
+    The connection is opened on first use and then reused by every Habit, Completion and
+    analytics call of the same thread. New connections are configured for WAL journaling,
+    synchronous=NORMAL and a busy timeout, so readers don't block the writer and
+    concurrent writers wait instead of failing immediately.
+
+    :param db_path: Path of the SQLite database file.
+    :return: An open sqlite3.Connection.
+    """
+    global _opened
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        # Connections inherited from the parent of a forked process (e.g. a ProcessPoolExecutor worker)
+        # must not be used, so the child opens its own
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    key = os.fspath(db_path)
+    db = connections.get(key)
+    if db is None:
+        if profiling.enabled():
+            profiling.count_connection()
+            factory = ProfiledConnection
+        else:
+            factory = Connection
+        db = sqlite3.connect(key, timeout=BUSY_TIMEOUT_MS / 1000, factory=factory)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        connections[key] = db
+        with _lock:
+            _opened += 1
+    return db
+
+
+def close_connections(db_path=None):
+    """
+    Close the connections the current thread has opened through get_connection.
+
+    :param db_path: Optional; only close the connection to this database.
+    """
+    connections = getattr(_local, 'connections', {})
+    if db_path is not None:
+        db = connections.pop(os.fspath(db_path), None)
+        if db is not None:
+            db.close()
+        return
+    for db in connections.values():
+        db.close()
+    connections.clear()
+
+
+def opened_connections():
+    """
+    Return how many connections have been opened by get_connection in this process.
+
+    :return: Number of connections opened so far (across all threads).
+    """
+    return _opened
+
+
+def iter_rows(cursor, batch_size=FETCH_BATCH_SIZE):
+    """
+    Stream the rows of an executed query in batches of fetchmany, so large results
+    are never held in memory as a whole.
+
+    :param cursor: Cursor on which a query has been executed.
+    :param batch_size: Number of rows fetched per batch.
+    :return: Generator of result rows.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
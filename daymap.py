@@ -0,0 +1,262 @@
+from datetime import date
+from streaks import day_number, period_number, iter_completion_days, current_streak
+
+### habit_daymaps: one bit per day (daily habits) or week (weekly habits) since the first completion
+
+# A habit's history is a Python int used as a bitset: bit i is set if the habit was completed in
+# period first_period + i. It is stored as a little-endian BLOB, so a 10-year daily habit takes
+# about 460 bytes, and streaks are computed with a few shifts and masks over the whole history.
+
+
+def build_daymap(periods):
+    """
+    Build the bitset of a habit from the periods it was completed in.
+
+    :param periods: Iterable of period numbers (day numbers or week numbers).
+    :return: Tuple (first_period, bits), or (None, 0) if there are no periods.
+    """
+    periods = set(periods)
+    if not periods:
+        return None, 0
+    first_period = min(periods)
+    bits = 0
+    for period in periods:
+        bits |= 1 << (period - first_period)
+    return first_period, bits
+
+
+def set_period(first_period, bits, period):
+    """
+    Mark one more period as completed.
+
+    :param first_period: First period of the bitset (None for an empty bitset).
+    :param bits: The bitset.
+    :param period: Completed period.
+    :return: Tuple (first_period, bits) of the updated bitset.
+    """
+    if first_period is None:
+        return period, 1
+    if period < first_period:
+        return period, (bits << (first_period - period)) | 1  # the bitset grows to the left
+    return first_period, bits | (1 << (period - first_period))
+
+
+def to_blob(bits):
+    """
+    Serialize a bitset as little-endian bytes.
+
+    :param bits: The bitset.
+    :return: bytes with one bit per period.
+    """
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def from_blob(blob):
+    """
+    Deserialize a bitset written by to_blob.
+
+    :param blob: bytes from the periods column.
+    :return: The bitset.
+    """
+    return int.from_bytes(blob, 'little')
+
+
+def longest_run(bits):
+    """
+    Length of the longest run of set bits.
+
+    Every `bits &= bits >> 1` shortens all runs by one, so the number of steps until no bit is
+    left is the length of the longest run.
+
+    :param bits: The bitset.
+    :return: Length of the longest run of consecutive completed periods.
+    """
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def last_run(bits):
+    """
+    Length of the run of set bits ending at the highest set bit (the most recent period).
+
+    :param bits: The bitset.
+    :return: Length of the most recent run of consecutive completed periods.
+    """
+    top = bits.bit_length()
+    gaps = ~bits & ((1 << top) - 1)  # the missed periods below the most recent one
+    return top - gaps.bit_length()
+
+
+def count_periods(bits, start=0, stop=None):
+    """
+    Number of set bits, optionally only those in the bit range [start, stop).
+
+    :param bits: The bitset.
+    :param start: Optional; first bit index.
+    :param stop: Optional; bit index after the last one.
+    :return: Number of completed periods in the range.
+    """
+    start = max(start, 0)
+    bits >>= start
+    if stop is not None:
+        if stop <= start:
+            return 0
+        bits &= (1 << (stop - start)) - 1
+    return bin(bits).count('1')
+
+
+def compute_daymaps(cursor, habit_id=None):
+    """
+    Build the bitsets of all habits (or a single habit) from the raw completions, without storing them.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: Optional; only build the bitset of this habit.
+    :return: List of (habit_id, first_period, total_count, bits) tuples for the habits with completions.
+    """
+    daymaps = []
+    for map_habit_id, _, periodicity, days in iter_completion_days(cursor, habit_id=habit_id):
+        days = list(days)
+        first_period, bits = build_daymap(period_number(day, periodicity) for day in days)
+        daymaps.append((map_habit_id, first_period, len(days), bits))
+    return daymaps
+
+
+def rebuild_daymaps(cursor, habit_id=None):
+    """
+    Regenerate habit_daymaps from the raw completions, for all habits or a single habit.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: Optional; only rebuild the bitset of this habit.
+    :return: Number of habits with bitsets written.
+    """
+    rows = [(map_habit_id, first_period, count, to_blob(bits))
+            for map_habit_id, first_period, count, bits in compute_daymaps(cursor, habit_id)]
+
+    if habit_id is None:
+        cursor.execute('DELETE FROM habit_daymaps')
+    else:
+        cursor.execute('DELETE FROM habit_daymaps WHERE habit_id = ?', (habit_id,))
+    cursor.executemany(
+        'INSERT INTO habit_daymaps (habit_id, first_period, total_count, periods) VALUES (?, ?, ?, ?)',
+        rows
+    )
+    return len(rows)
+
+
+def record_period(cursor, habit_id, periodicity, day):
+    """
+    Set the bit of a completion that has just been inserted, inside the caller's transaction.
+
+    The bitset of a habit without one (e.g. in a database upgraded from before the bitsets) is
+    built from its completions instead.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: ID of the completed habit.
+    :param periodicity: Periodicity of the habit ('daily' or 'weekly').
+    :param day: Day number of the completion.
+    """
+    record_periods(cursor, habit_id, periodicity, (day,))
+
+
+def record_periods(cursor, habit_id, periodicity, days):
+    """
+    Set the bits of several completions that have just been inserted, with one read and one write of the bitset.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: ID of the completed habit.
+    :param periodicity: Periodicity of the habit ('daily' or 'weekly').
+    :param days: Day numbers of the completions.
+    """
+    row = cursor.execute('SELECT first_period, periods FROM habit_daymaps WHERE habit_id = ?', (habit_id,)).fetchone()
+    if row is None:
+        rebuild_daymaps(cursor, habit_id)  # the completions are already inserted
+        return
+    first_period, bits = row[0], from_blob(row[1])
+    count = 0
+    for day in days:
+        first_period, bits = set_period(first_period, bits, period_number(day, periodicity))
+        count += 1
+    cursor.execute(
+        'UPDATE habit_daymaps SET first_period = ?, total_count = total_count + ?, periods = ? WHERE habit_id = ?',
+        (first_period, count, to_blob(bits), habit_id)
+    )
+
+
+def load_daymaps(cursor, habit_name=None):
+    """
+    Read the bitsets of every habit with completions (or of one habit).
+
+    A bitset is missing or outdated if its completion count differs from habit_stats (e.g. after
+    completions were changed outside of the Completion class); such bitsets are built from the
+    completions in memory. Reads never write: stored bitsets are only rebuilt by writers (the
+    importer, merges of the completion log and rebuild-stats).
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only read the bitset of this habit.
+    :return: List of (habit_name, periodicity, first_period, bits, last_day) tuples in habit id order.
+    """
+    query = '''
+        SELECT h.id, h.name, h.periodicity, s.total_count, s.last_day, d.total_count, d.first_period, d.periods
+        FROM habit_stats s
+        JOIN habits h ON h.id = s.habit_id
+        LEFT JOIN habit_daymaps d ON d.habit_id = s.habit_id
+    '''
+    params = ()
+    if habit_name:
+        query += ' WHERE h.name = ?'
+        params = (habit_name,)
+    query += ' ORDER BY h.id'
+
+    daymaps = []
+    outdated = []
+    for habit_id, name, periodicity, total_count, last_day, map_count, first_period, blob in cursor.execute(query, params).fetchall():
+        if map_count != total_count:
+            outdated.append(len(daymaps))
+            daymaps.append([habit_id, name, periodicity, None, 0, last_day])
+        else:
+            daymaps.append([habit_id, name, periodicity, first_period, from_blob(blob), last_day])
+
+    for index in outdated:
+        for _, first_period, _, bits in compute_daymaps(cursor, daymaps[index][0]):
+            daymaps[index][3:5] = first_period, bits
+
+    return [tuple(daymap[1:]) for daymap in daymaps]
+
+
+def bitset_habit_streaks(cursor, habit_name=None, today=None):
+    """
+    Compute the longest and current streak of every habit (or one habit) from the stored bitsets.
+
+    Same results as the other streak backends, with run lengths taken from bit operations
+    instead of iterating over the completions.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only compute the streaks of this habit.
+    :param today: Optional; reference date for the current streak (defaults to today).
+    :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order.
+    """
+    today = day_number(today or date.today())
+    for name, periodicity, first_period, bits, last_day in load_daymaps(cursor, habit_name):
+        last_period = first_period + bits.bit_length() - 1
+        current = current_streak(last_run(bits), last_period, periodicity, today)
+        yield name, periodicity, longest_run(bits), current, last_day
+
+
+def bitset_completion_rates(cursor, periods, habit_name=None, today=None):
+    """
+    Compute the share of completed periods among the most recent periods of every habit.
+
+    :param cursor: Cursor of an open database connection.
+    :param periods: Number of periods (days for daily, weeks for weekly habits) up to and including today.
+    :param habit_name: Optional; only compute the rate of this habit.
+    :param today: Optional; reference date (defaults to today).
+    :return: Generator of (habit_name, periodicity, completed_periods, rate) tuples in habit id order.
+    """
+    today = day_number(today or date.today())
+    for name, periodicity, first_period, bits, _ in load_daymaps(cursor, habit_name):
+        stop = period_number(today, periodicity) + 1 - first_period
+        completed = count_periods(bits, stop - periods, stop)
+        yield name, periodicity, completed, completed / periods
@@ -1,42 +1,204 @@
 import sqlite3
-from example_data import add_example_habits  # function for adding example data
 import os # used for checking if database file already exists
 
 # Default path for the database
 # Use 'data.db' as default or test.db for testing with pytest
 DB_PATH = 'data.db'
 
+# Storage format of completions in new databases: 'iso' (ISO text) or 'epoch' (integer epoch seconds
+# plus a precomputed day column). Existing databases are converted with the convert-storage command.
+STORAGE_FORMAT = os.environ.get('HABITS_STORAGE_FORMAT', 'iso')
+
+### schema migrations
+
+def _fill_habit_stats(cursor):
+    """
+    Data migration filling habit_stats for the completions of an existing database.
+    """
+    from stats import rebuild_stats  # imported here, only needed when upgrading old databases
+    rebuild_stats(cursor)
+
+
+def _resolve_duplicate_names(cursor):
+    """
+    Data migration making the habit names unique before the unique name index is created.
+
+    Older versions didn't prevent duplicate names. Duplicates with the same periodicity are merged
+    into the oldest habit, which gets the completions of the others; duplicates with another
+    periodicity are renamed to "<name> (<periodicity>)" (plus a number if that name is taken too).
+    """
+    duplicates = cursor.execute('SELECT name FROM habits GROUP BY name HAVING COUNT(*) > 1').fetchall()
+    for (name,) in duplicates:
+        habits = cursor.execute('SELECT id, periodicity FROM habits WHERE name = ? ORDER BY id', (name,)).fetchall()
+        kept = {}  # periodicity -> id of the habit kept for it
+        for habit_id, periodicity in habits:
+            if periodicity in kept:
+                cursor.execute('UPDATE completions SET habit_id = ? WHERE habit_id = ?', (kept[periodicity], habit_id))
+                cursor.execute('DELETE FROM habits WHERE id = ?', (habit_id,))
+                print(f"Duplicate habit '{name}' (id {habit_id}) merged into habit id {kept[periodicity]}.")
+                continue
+            if kept:
+                new_name = f'{name} ({periodicity})'
+                number = 2
+                while cursor.execute('SELECT 1 FROM habits WHERE name = ?', (new_name,)).fetchone():
+                    new_name = f'{name} ({periodicity} {number})'
+                    number += 1
+                cursor.execute('UPDATE habits SET name = ? WHERE id = ?', (new_name, habit_id))
+                print(f"Duplicate habit '{name}' (id {habit_id}) renamed to '{new_name}'.")
+            kept[periodicity] = habit_id
+
+
+# Each entry upgrades the schema by one version. The current version of a database
+# file is stored in PRAGMA user_version, so existing files are upgraded in place and
+# only the missing steps are applied. A step is either an SQL statement or a function
+# receiving the cursor, for data migrations.
+MIGRATIONS = [
+    # version 1: base tables
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS habits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            periodicity TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS completions (
+            habit_id INTEGER,
+            completed_at TEXT NOT NULL,
+            FOREIGN KEY(habit_id) REFERENCES habits(id)
+        )
+        ''',
+    ],
+    # version 2: indexes for name lookups and per-habit completion scans
+    [
+        _resolve_duplicate_names,
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_name ON habits (name)',
+        'CREATE INDEX IF NOT EXISTS idx_completions_habit_completed ON completions (habit_id, completed_at)',
+    ],
+    # version 3: streak statistics per habit, maintained by Completion.add_completion
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS habit_stats (
+            habit_id INTEGER PRIMARY KEY,
+            current_streak INTEGER NOT NULL,
+            longest_streak INTEGER NOT NULL,
+            last_period INTEGER NOT NULL,
+            last_day INTEGER NOT NULL,
+            total_count INTEGER NOT NULL,
+            FOREIGN KEY(habit_id) REFERENCES habits(id)
+        )
+        ''',
+        _fill_habit_stats,
+    ],
+    # version 4: completion bitsets per habit (see daymap.py), built by the next write of each habit
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS habit_daymaps (
+            habit_id INTEGER PRIMARY KEY,
+            first_period INTEGER NOT NULL,
+            total_count INTEGER NOT NULL,
+            periods BLOB NOT NULL,
+            FOREIGN KEY(habit_id) REFERENCES habits(id)
+        )
+        ''',
+    ],
+    # version 5: segments of the completion log (see completion_log.py) already merged into completions
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS completion_log_segments (
+            segment INTEGER PRIMARY KEY,
+            records INTEGER NOT NULL
+        )
+        ''',
+    ],
+    # version 6: version number of the habits table, increased by every change (see registry.py)
+    [
+        'CREATE TABLE IF NOT EXISTS habit_catalog (version INTEGER NOT NULL)',
+        'INSERT INTO habit_catalog (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM habit_catalog)',
+        'CREATE TRIGGER IF NOT EXISTS habits_inserted AFTER INSERT ON habits BEGIN UPDATE habit_catalog SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS habits_updated AFTER UPDATE ON habits BEGIN UPDATE habit_catalog SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS habits_deleted AFTER DELETE ON habits BEGIN UPDATE habit_catalog SET version = version + 1; END',
+    ],
+    # version 7: indexes for listing the habits of one periodicity page by page, by name or by id
+    [
+        'CREATE INDEX IF NOT EXISTS idx_habits_periodicity_name ON habits (periodicity, name)',
+        'CREATE INDEX IF NOT EXISTS idx_habits_periodicity ON habits (periodicity)',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(db):
+    """
+    Read the schema version of a database.
+
+    :param db: Open sqlite3 connection.
+    :return: The value of PRAGMA user_version (0 for a new or unversioned database).
+    """
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db):
+    """
+    Apply all pending migrations to the database.
+
+    Every migration step runs in its own transaction together with the update
+    of PRAGMA user_version, so an interrupted upgrade never leaves a half-applied step.
+
+    :param db: Open sqlite3 connection.
+    :return: The schema version after migrating.
+    """
+    version = get_schema_version(db)
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        cursor = db.cursor()
+        cursor.execute('BEGIN')
+        try:
+            for statement in MIGRATIONS[target - 1]:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {target}')
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        db.commit()
+    return max(version, SCHEMA_VERSION)
+
 ### database initialization incl. example data
 
-def init_db():
+def init_db(db_path=DB_PATH, example_data=True):
     """
     the init_db is called in the main.py and test_habit_tracker.py
     in order to generate the main data.db or for testing purposes the test.db
 
-    It initializes the SQLite database for storing habits and
-    adds example data if it's the first time generating the DB.
+    It initializes the SQLite database for storing habits, upgrades the schema
+    of existing databases and adds example data if it's the first time generating the DB.
+    The shared connection opened here is reused by the command that runs afterwards.
+
+    :param db_path: Optional; path of the SQLite database file.
+    :param example_data: Optional; add the example habits to a new database (disabled for the shards of shards.py).
     """
-    db_exists = os.path.exists(DB_PATH) # checks if database already exists or not
-    with sqlite3.connect(DB_PATH) as db:
-        cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS habits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                periodicity TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS completions (
-                habit_id INTEGER,
-                completed_at TEXT NOT NULL,
-                FOREIGN KEY(habit_id) REFERENCES habits(id)
-            )
-        ''')
-    db.commit()
+    from connection import get_connection  # imported here, connection.py depends on DB_PATH
+
+    db_exists = os.path.exists(db_path) # checks if database already exists or not
+    db = get_connection(db_path)
+
+    # fast path: the schema is current, so no DDL has to run
+    if db_exists and get_schema_version(db) == SCHEMA_VERSION:
+        return
+
+    migrate(db)
 
 ### adds example data to the database if the DB is generated for the first time
     if not db_exists:
-        add_example_habits(db)
\ No newline at end of file
+        from storage import convert_storage
+        if example_data:
+            from example_data import add_example_habits  # only needed for new databases
+            add_example_habits(db)
+            db.commit()
+        convert_storage(db, STORAGE_FORMAT)
@@ -1,6 +1,11 @@
 import random
+from stats import rebuild_stats  # keeps habit_stats in sync with the inserted completions
 from datetime import datetime, timedelta
 
+# Recording patterns of the random example data, also used by the benchmark data generator
+DAILY_CHOICES = [True, False, True]  # Higher chance of recording
+WEEKLY_CHOICES = [True, False]  # 50% chance of recording
+
 def add_example_completions(db, habit_id, periodicity):
     """
     Adds random completion data for a habit over a period of 4 weeks.
@@ -16,24 +21,25 @@ def add_example_completions(db, habit_id, periodicity):
     cursor = db.cursor()
     today = datetime.now()
 
+    completions = []  # rows are collected and written with a single executemany
+
     if periodicity == 'daily':
         # Simulate daily habit completions for 4 weeks with random days skipped
         for day in range(28):  # 4 weeks
             completion_date = today - timedelta(days=day)
             # Randomly decide whether to add a completion for each day
-            if random.choice([True, False, True]):  # Higher chance of recording
-                cursor.execute('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)',
-                               (habit_id, completion_date))
+            if random.choice(DAILY_CHOICES):
+                completions.append((habit_id, completion_date))
 
     elif periodicity == 'weekly':
         # Simulate weekly habit completions for the past 4 weeks with some random skips
         for week in range(4):
             completion_date = today - timedelta(weeks=week)
             # Randomly decide whether to add a completion for each week
-            if random.choice([True, False]):  # 50% chance of recording
-                cursor.execute('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)',
-                               (habit_id, completion_date))
+            if random.choice(WEEKLY_CHOICES):
+                completions.append((habit_id, completion_date))
 
+    cursor.executemany('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)', completions)
     db.commit()
 
 
@@ -53,24 +59,22 @@ def add_test_example_completions(db, habit_id, periodicity):
     cursor = db.cursor()
     today = (datetime.now() - timedelta(days=2)).date()  # Set the latest possible completion date to 2 days ago
 
+    completions = []  # rows are collected and written with a single executemany
+
     if periodicity == 'daily':
         # Complete every day except certain days
         for day in range(0, 28):
             completion_date = today - timedelta(days=day)
             if day not in {7, 14, 21}:  # Skip specific days to break the streak
-                cursor.execute(
-                    'INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)',
-                    (habit_id, completion_date)
-                )
+                completions.append((habit_id, completion_date))
 
     elif periodicity == 'weekly':
         # Complete every other week to ensure a two-week gap and stop at least one week before today
         for week in range(2, 8, 2):  # Avoid completing on the most recent week
             completion_date = today - timedelta(weeks=week)
-            cursor.execute(
-                'INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)',
-                (habit_id, completion_date)
-            )
+            completions.append((habit_id, completion_date))
+
+    cursor.executemany('INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)', completions)
 
 def add_example_habits(db, test_data=False):
     """
@@ -124,4 +128,8 @@ def add_example_habits(db, test_data=False):
         if test_data: # test_data=True in the test_habit_tracker.py db initialisation to add the fixed test example data to the db.
             add_test_example_completions(db, habit_id, habit["periodicity"])
         else:
-            add_example_completions(db, habit_id, habit["periodicity"])
\ No newline at end of file
+            add_example_completions(db, habit_id, habit["periodicity"])
+
+    # The completions are inserted directly, so the streak statistics are regenerated once at the end
+    rebuild_stats(db.cursor())
+    db.commit()
\ No newline at end of file
@@ -0,0 +1,65 @@
+import csv
+import json
+from db import DB_PATH  # Import the DB_PATH
+from habit import Habit
+from completion import Completion
+from connection import get_connection  # shared per-thread connection
+
+# Columns written for each kind of export; the completion columns match the import format
+EXPORT_COLUMNS = {
+    'completions': ['habit', 'completed_at'],
+    'habits': ['id', 'name', 'description', 'periodicity', 'created_at'],
+}
+
+### streaming export of completions and habits
+
+def iter_export_records(kind='completions', habit_name=None, since=None, until=None, db_path=DB_PATH):
+    """
+    Stream the records of an export as dictionaries.
+
+    :param kind: 'completions' or 'habits'.
+    :param habit_name: Optional; only export completions of this habit.
+    :param since: Optional; datetime.date of the first completion day to export.
+    :param until: Optional; datetime.date of the first completion day not to export.
+    :param db_path: Path of the SQLite database file.
+    :return: Generator of dictionaries keyed by the columns in EXPORT_COLUMNS.
+    """
+    if kind == 'habits':
+        for row in Habit(db_path).iter_habits():
+            yield dict(zip(EXPORT_COLUMNS['habits'], row))
+        return
+
+    habit_id = None
+    if habit_name:
+        habit = get_connection(db_path).execute("SELECT id FROM habits WHERE name = ?", (habit_name,)).fetchone()
+        if habit is None:
+            print(f"Habit '{habit_name}' does not exist.")
+            return
+        habit_id = habit[0]
+
+    for _, name, completed_at in Completion(db_path).iter_completions(habit_id, since, until):
+        yield {'habit': name, 'completed_at': completed_at}
+
+
+def export_records(records, file, kind='completions', file_format='csv'):
+    """
+    Write export records to an open text file one by one, in constant memory.
+
+    :param records: Iterable of record dictionaries, e.g. from iter_export_records.
+    :param file: Writable text file, e.g. sys.stdout.
+    :param kind: 'completions' or 'habits', selects the CSV header.
+    :param file_format: 'csv' or 'jsonl'.
+    :return: Number of records written.
+    """
+    count = 0
+    if file_format == 'jsonl':
+        for record in records:
+            file.write(json.dumps(record) + '\n')
+            count += 1
+    else:
+        writer = csv.DictWriter(file, fieldnames=EXPORT_COLUMNS[kind], lineterminator='\n')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    return count
@@ -1,12 +1,17 @@
-import sqlite3
 from datetime import datetime
 from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection, iter_rows  # shared per-thread connection
+from cache import bump_write_counter  # cached reads are invalidated by every write
+from profiling import profiled  # wall time per call while --profile is active
+import hooks  # change notifications, e.g. for the reminder scheduler; merges the completion log before reads
+from registry import HabitRecord, get_registry  # habit lookups without SQL
 
 class Habit:
     """
     A class to represent a habit with a task, periodicity, and description.
 
-    Attributes:
+    Habits are stored in the habits table and looked up through the registry of registry.py,
+    which returns them as HabitRecord objects with these attributes:
     name (str): The name of the habit.
     periodicity (str): The periodicity of the habit, either 'daily' or 'weekly'.
     description (str): A description of the habit.
@@ -19,6 +24,7 @@ class Habit:
         """
         self.db_path = db_path
 
+    @profiled
     def add_habit(self, name: str, description: str = "", periodicity: str = "daily"):
         """
         Add a new habit to the database.
@@ -27,47 +33,68 @@ class Habit:
         :param description: A description of the habit.
         :param periodicity: The periodicity of the habit ('daily' or 'weekly').
         """
-        with sqlite3.connect(self.db_path) as db:
+        registry = get_registry(self.db_path)
+        with get_connection(self.db_path) as db:
             cursor = db.cursor()
             # Check if the habit already exists to prevent duplicates
-            cursor.execute("SELECT id FROM habits WHERE name = ?", (name,))
-            if cursor.fetchone():
+            if registry.get(name) is not None:
                 print(f"Habit '{name}' already exists.")
                 return  # Exit if habit already exists
 
             # Insert the habit into the database
+            created_at = datetime.now().isoformat()
             cursor.execute(
                 '''
                 INSERT INTO habits (name, description, periodicity, created_at)
                 VALUES (?, ?, ?, ?)
                 ''',
-                (name, description, periodicity, datetime.now().isoformat())
+                (name, description, periodicity, created_at)
             )
             db.commit()
+            registry.add(HabitRecord(cursor.lastrowid, name, periodicity, created_at, description))
+            bump_write_counter()
+            hooks.notify(self.db_path, name, 'added')
             print(f"Habit '{name}' with periodicity '{periodicity}' added. Task description: '{description}'")
 
+    @profiled
     def delete_habit(self, name):
         """
         Delete a habit from the database by its name.
 
         :param name: Name of the habit to delete.
         """
-        with sqlite3.connect(self.db_path) as db:
+        hooks.merge_completion_log(self.db_path)  # logged completions of the habit are deleted with it
+        registry = get_registry(self.db_path)
+        with get_connection(self.db_path) as db:
             cursor = db.cursor()
             # Find the habit by name
-            cursor.execute("SELECT id FROM habits WHERE name = ?", (name,))
-            habit_id = cursor.fetchone()
+            habit = registry.get(name)
 
-            if habit_id is None:
+            if habit is None:
                 print(f"Habit '{name}' does not exist.")
                 return
 
-            habit_id = habit_id[0]
+            habit_id = habit.id
 
             # Delete completions related to the habit
             cursor.execute("DELETE FROM completions WHERE habit_id = ?", (habit_id,))
+            cursor.execute("DELETE FROM habit_stats WHERE habit_id = ?", (habit_id,))
+            cursor.execute("DELETE FROM habit_daymaps WHERE habit_id = ?", (habit_id,))
 
             # Delete the habit itself
             cursor.execute("DELETE FROM habits WHERE id = ?", (habit_id,))
             db.commit()
-            print(f"Habit '{name}' and its completions have been deleted.")
\ No newline at end of file
+            registry.remove(name)
+            bump_write_counter()
+            hooks.notify(self.db_path, name, 'deleted')
+            print(f"Habit '{name}' and its completions have been deleted.")
+
+    def iter_habits(self):
+        """
+        Stream all habits in ID order without building a list.
+
+        :return: Generator of (id, name, description, periodicity, created_at) tuples.
+        """
+        cursor = get_connection(self.db_path).cursor()
+        cursor.execute('SELECT id, name, description, periodicity, created_at FROM habits ORDER BY id')
+        yield from iter_rows(cursor)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+
+### in-process change notifications (e.g. for the reminder scheduler in scheduler.py)
+
+# Listeners called after committed changes of habits and completions
+_listeners = []
+_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """
+    Register a function to be called after every committed change of a habit.
+
+    :param listener: Callable taking (db_path, habit_name, change); change is 'added', 'completed',
+                     'deleted' or 'imported' (habit_name is None for imports, which may touch every habit).
+                     It is called in the thread that made the change, so it should return quickly;
+                     exceptions are printed to stderr and don't reach the writer.
+    """
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """
+    Unregister a function registered with add_listener.
+
+    :param listener: The registered callable.
+    """
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def notify(db_path, habit_name, change):
+    """
+    Call the registered listeners about a committed change.
+
+    :param db_path: Path of the changed database.
+    :param habit_name: Name of the changed habit, or None if any habit may have changed.
+    :param change: Kind of change ('added', 'completed', 'deleted' or 'imported').
+    """
+    if not _listeners:
+        return
+    with _lock:
+        listeners = list(_listeners)
+    db_path = os.fspath(db_path)
+    for listener in listeners:
+        try:
+            listener(db_path, habit_name, change)
+        except Exception:
+            # the change is committed already, so a failing listener must not fail the writer
+            import traceback  # imported here, only needed when a listener fails
+            print(f"Listener {listener!r} failed on the {change} change of {habit_name!r}:", file=sys.stderr)
+            traceback.print_exc()
+
+
+def merge_completion_log(db_path):
+    """
+    Merge the open completion log of a database into the completions table before reading them.
+
+    A log can only be open if completion_log.py was imported, so processes that never import it
+    (e.g. most CLI commands) don't pay for importing it here.
+
+    :param db_path: Path of the SQLite database file.
+    """
+    completion_log = sys.modules.get('completion_log')
+    if completion_log is not None:
+        completion_log.merge_tail(db_path)
@@ -0,0 +1,116 @@
+import csv
+import json
+import time
+from datetime import datetime
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from stats import rebuild_stats
+from daymap import rebuild_daymaps
+from storage import get_storage_format, completion_row, INSERT_SQL
+from cache import bump_write_counter
+import hooks  # change notifications
+
+# Number of completions written per transaction
+DEFAULT_CHUNK_SIZE = 10000
+
+### streaming bulk import of completion history
+
+def detect_format(path):
+    """
+    Guess the file format from the file extension.
+
+    :param path: Path of the import file.
+    :return: 'jsonl' for .jsonl/.json files, otherwise 'csv'.
+    """
+    return 'jsonl' if str(path).lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def iter_completion_rows(path, file_format=None):
+    """
+    Stream (habit_name, completed_at) pairs from a CSV or JSONL file without loading it into memory.
+
+    CSV files need a header with the columns 'habit' and 'completed_at'. JSONL files contain
+    one object per line with the keys 'habit' and 'completed_at'. Blank lines are ignored.
+    Malformed rows (invalid JSON, missing keys) are yielded as (None, None), so the caller can count them.
+
+    :param path: Path of the import file.
+    :param file_format: Optional; 'csv' or 'jsonl', detected from the extension if omitted.
+    :return: Generator of (habit_name, completed_at) tuples.
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'jsonl':
+            records = (line for line in file if line.strip())
+        else:
+            records = csv.DictReader(file)
+        for record in records:
+            try:
+                if file_format == 'jsonl':
+                    record = json.loads(record)
+                row = record['habit'], record['completed_at']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                row = None, None
+            yield row
+
+
+def import_completions(path, file_format=None, chunk_size=DEFAULT_CHUNK_SIZE, db_path=DB_PATH):
+    """
+    Import completions from a CSV or JSONL file.
+
+    Habit names are resolved to IDs once up front, the rows are written with executemany
+    in one transaction per chunk, and the streak statistics and bitsets of all affected habits are
+    rebuilt at the end, or when the import fails after some chunks were committed. Malformed rows
+    and rows for unknown habits or with invalid timestamps are skipped.
+
+    :param path: Path of the import file.
+    :param file_format: Optional; 'csv' or 'jsonl', detected from the extension if omitted.
+    :param chunk_size: Number of completions written per transaction.
+    :param db_path: Path of the SQLite database file.
+    :return: Tuple (imported, skipped, seconds).
+    """
+    started = time.perf_counter()
+    imported = skipped = 0
+    touched_habits = set()
+
+    with get_connection(db_path) as db:
+        cursor = db.cursor()
+        habit_ids = dict(cursor.execute('SELECT name, id FROM habits'))
+        storage_format = get_storage_format(cursor)
+        insert = INSERT_SQL[storage_format]
+
+        batch = []
+        try:
+            for habit_name, completed_at in iter_completion_rows(path, file_format):
+                try:
+                    habit_id = habit_ids.get(habit_name)
+                    completed_at = datetime.fromisoformat(completed_at)  # rows are stored in one uniform format
+                except (TypeError, ValueError):
+                    habit_id = None
+                if habit_id is None:
+                    skipped += 1
+                    continue
+
+                batch.append(completion_row(storage_format, habit_id, completed_at))
+                touched_habits.add(habit_id)
+                if len(batch) >= chunk_size:
+                    cursor.executemany(insert, batch)
+                    db.commit()
+                    imported += len(batch)
+                    batch.clear()
+
+            cursor.executemany(insert, batch)
+            imported += len(batch)
+        except BaseException:
+            db.rollback()  # only the current chunk, the committed chunks stay imported
+            raise
+        finally:
+            # Imported history is usually older than the recorded completions, so the statistics and
+            # bitsets are recomputed, also when the import fails after some chunks were committed
+            for habit_id in touched_habits:
+                rebuild_stats(cursor, habit_id)
+                rebuild_daymaps(cursor, habit_id)
+            db.commit()
+            bump_write_counter()
+            hooks.notify(db_path, None, 'imported')
+
+    return imported, skipped, time.perf_counter() - started
@@ -1,12 +1,12 @@
+import os
+import shlex
+import sys
 import click
 from db import init_db, DB_PATH  # Import the DB_PATH and initialze function for the DB
-from habit import Habit
-from completion import Completion
-from analytics import get_all_habits, get_habits_by_periodicity, get_longest_streak, check_all_broken_habits
+from streaks import STREAK_BACKENDS  # names of the streak backends; each one is imported when used
 
-# Create instances of the Habit and Completion classes
-habit = Habit(DB_PATH)
-completion = Completion(DB_PATH)
+# Analytics, Habit, Completion, the importer and the exporter are imported inside the commands
+# using them, so every CLI invocation only pays for the modules of the command it runs
 
 class OrderedGroup(click.Group):
     """
@@ -20,9 +20,22 @@ class OrderedGroup(click.Group):
 
 # Initialize the CLI group with OrderedGroup
 @click.group(cls=OrderedGroup)
-def cli():
+@click.option('--profile', is_flag=True, envvar='HABITS_PROFILE',
+              help="Print wall time per function, SQL statement timings and opened connections "
+                   "to stderr after the command (also enabled with HABITS_PROFILE=1).")
+@click.option('--profile-format', type=click.Choice(['table', 'json']), default='table', show_default=True,
+              envvar='HABITS_PROFILE_FORMAT', help="Format of the profile summary.")
+@click.option('--profile-dump', type=click.Path(dir_okay=False), envvar='HABITS_PROFILE_DUMP', default=None,
+              help="Also run cProfile and write its statistics to this file (also set with HABITS_PROFILE_DUMP).")
+@click.pass_context
+def cli(ctx, profile, profile_format, profile_dump):
     """Main entry point for the Habit Tracker CLI."""
-    pass
+    import profiling
+    if (profile or profile_dump) and not profiling.enabled():  # commands of a profiled batch are profiled as a whole
+        profiling.start(profile_dump)
+        ctx.call_on_close(lambda: profiling.finish(profile_format if profile else None))
+    if ctx.invoked_subcommand != 'shards':  # the shard commands only use the databases of the shard directory
+        init_db()  # runs before every command, but not for --help
 
 @cli.command()
 @click.argument('name')
@@ -36,7 +49,8 @@ def add_habit(name, description, periodicity):
     :param description: Optional. A brief description of the habit.
     :param periodicity: Specifies the frequency of the habit ('daily' or 'weekly').
     """
-    habit.add_habit(name, description, periodicity)
+    from habit import Habit
+    Habit(DB_PATH).add_habit(name, description, periodicity)
 
 
 @cli.command()
@@ -47,7 +61,8 @@ def delete_habit(name):
 
     :param name: The name of the habit to delete.
     """
-    habit.delete_habit(name)
+    from habit import Habit
+    Habit(DB_PATH).delete_habit(name)
 
 
 @cli.command()
@@ -58,16 +73,52 @@ def complete_habit(name):
 
     :param name: The name of the habit to mark as complete for the current date.
     """
-    completion.add_completion(name)
+    from completion import Completion
+    Completion(DB_PATH).add_completion(name)
 
 @cli.command()
-def list_habits():
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Read a snapshot file (see the snapshot command) instead of the database.")
+@click.option('--limit', type=click.IntRange(min=1), default=None, help="Only show this many habits (one page).")
+@click.option('--after', default=None,
+              help="Start after this name (or id with --sort id), as printed at the end of the previous page.")
+@click.option('--periodicity', type=click.Choice(['daily', 'weekly']), default=None,
+              help="Only show habits with this periodicity.")
+@click.option('--name-prefix', default=None, help="Only show habits whose name starts with this prefix.")
+@click.option('--sort', type=click.Choice(['name', 'id']), default=None,
+              help="Order of the habits: by name, or by id (creation order). Defaults to name.")
+def list_habits(snapshot, limit, after, periodicity, name_prefix, sort):
     """
     List all current habits being tracked.
 
-    Displays all tracked habits along with their descriptions.
+    Displays all tracked habits along with their descriptions. With any of --limit, --after,
+    --periodicity, --name-prefix or --sort, the habits are listed page by page in a fixed order;
+    every page is read with an index seek, so large catalogs can be browsed quickly.
+
+    :param snapshot: Optional. Snapshot file to read instead of the database.
+    :param limit: Optional. Number of habits per page.
+    :param after: Optional. Sort key of the last habit of the previous page.
+    :param periodicity: Optional. 'daily' or 'weekly'.
+    :param name_prefix: Optional. Prefix of the habit names to show.
+    :param sort: Optional. 'name' or 'id'.
     """
-    habits = get_all_habits()
+    from analytics import get_all_habits, get_habits_page
+
+    if limit is not None or after is not None or periodicity or name_prefix or sort:
+        sort = sort or 'name'
+        if sort == 'id' and after is not None and not after.isdigit():
+            click.echo(f"Invalid --after value '{after}': habit ids are numbers.")
+            return
+        records = get_habits_page(limit, after, periodicity, name_prefix, sort, DB_PATH, snapshot)
+        for record in records:
+            click.echo(f"- {record.name} ({record.periodicity}, id {record.id}): {record.description}")
+        if not records:
+            click.echo("No habits found.")
+        elif limit is not None and len(records) == limit:
+            click.echo(f"Next page: --after {shlex.quote(str(getattr(records[-1], sort)))}")
+        return
+
+    habits = get_all_habits(snapshot=snapshot)
     if habits:
         click.echo("Current Habits:")
         for habit in habits:
@@ -77,14 +128,19 @@ def list_habits():
 
 @cli.command()
 @click.argument('periodicity')
-def list_by_period(periodicity):
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Read a snapshot file (see the snapshot command) instead of the database.")
+def list_by_period(periodicity, snapshot):
     """
     List habits by specified periodicity.
 
     :param periodicity: The periodicity of habits to list ('daily' or 'weekly').
+    :param snapshot: Optional. Snapshot file to read instead of the database.
     Displays habits with the given frequency.
     """
-    habits = get_habits_by_periodicity(periodicity)
+    from analytics import get_habits_by_periodicity
+
+    habits = get_habits_by_periodicity(periodicity, snapshot=snapshot)
     if habits:
         click.echo(f"Habits with {periodicity.capitalize()} periodicity:")
         for habit in habits:
@@ -94,14 +150,22 @@ def list_by_period(periodicity):
 
 @cli.command()
 @click.option('--habit-name', help="Name of the habit to check the longest streak for.")
-def longest_streak(habit_name):
+@click.option('--backend', type=click.Choice(sorted(STREAK_BACKENDS)), default=None,
+              help="Streak backend: read the stored statistics or compute in Python or inside SQLite.")
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Read a snapshot file (see the snapshot command) instead of the database.")
+def longest_streak(habit_name, backend, snapshot):
     """
     Show the longest streak of completions for a specific habit or all habits.
 
     :param habit_name: Optional. Name of a specific habit to display the longest streak for.
                        If omitted, shows the longest streak across all habits.
+    :param backend: Optional. Streak backend to use ('stats', 'python', 'sql', 'bitset' or 'numpy').
+    :param snapshot: Optional. Snapshot file to read instead of the database.
     """
-    longest_streaks = get_longest_streak(habit_name)
+    from analytics import get_longest_streak
+
+    longest_streaks = get_longest_streak(habit_name, backend, snapshot=snapshot)
 
     if longest_streaks:
         for habit, streak, period_type in longest_streaks:
@@ -113,13 +177,22 @@ def longest_streak(habit_name):
             print("No streaks found for any habits.")
 
 @cli.command()
-def check_habits():
+@click.option('--backend', type=click.Choice(sorted(STREAK_BACKENDS)), default=None,
+              help="Backend providing the last completion of each habit (default: one aggregate MAX query).")
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Read a snapshot file (see the snapshot command) instead of the database.")
+def check_habits(backend, snapshot):
     """
     Check if any habits are currently broken (missed the required periodic completion).
 
     Displays a message for each broken habit, showing the time since it was last completed.
+
+    :param backend: Optional. Streak backend to use ('stats', 'python', 'sql', 'bitset' or 'numpy').
+    :param snapshot: Optional. Snapshot file to read instead of the database.
     """
-    broken_habits = check_all_broken_habits()
+    from analytics import check_all_broken_habits
+
+    broken_habits = check_all_broken_habits(backend, snapshot=snapshot)
 
     if broken_habits:
         for message in broken_habits:
@@ -127,7 +200,280 @@ def check_habits():
     else:
         print("All habits are up to date and not broken.")
 
+@cli.command()
+@click.option('--limit', type=click.IntRange(min=1), default=None, help="Only show the most urgent habits.")
+def due_soon(limit):
+    """
+    Show the habits ordered by their next deadline, overdue habits first.
+
+    :param limit: Optional. Number of habits to show.
+    """
+    from analytics import get_due_habits
+
+    due_habits = get_due_habits(limit)
+
+    for habit_name, periodicity, due_date, days_left in due_habits:
+        label = "Daily" if periodicity == "daily" else "Weekly"
+        if due_date is None:
+            print(f"Habit '{habit_name}' ({label}) has never been completed and is overdue.")
+        elif days_left < 0:
+            print(f"Habit '{habit_name}' ({label}) was due on {due_date} and is overdue.")
+        elif days_left == 0:
+            print(f"Habit '{habit_name}' ({label}) is due today.")
+        else:
+            print(f"Habit '{habit_name}' ({label}) is due in {days_left} day(s), on {due_date}.")
+    if not due_habits:
+        print("No habits found.")
+
+@cli.command()
+@click.option('--format', 'output_format', type=click.Choice(['text', 'jsonl']), default='text', show_default=True,
+              help="Print the events as messages or as one JSON object per line.")
+@click.option('--refresh', type=click.FloatRange(min=0.1), default=60.0, show_default=True,
+              help="Seconds between checks for changes made by other processes.")
+def watch(output_format, refresh):
+    """
+    Keep running and report habits as they become due and as they break (stop with Ctrl+C).
+
+    :param output_format: Optional. 'text' or 'jsonl'.
+    :param refresh: Optional. Seconds between checks for changes made by other processes.
+    """
+    from scheduler import HabitWatcher
+
+    def emit(event):
+        if output_format == 'jsonl':
+            import json  # only needed for JSON output
+            click.echo(json.dumps(event))
+            return
+        label = "Daily" if event['periodicity'] == "daily" else "Weekly"
+        if event['event'] == 'due':
+            message = f"is due today; last completed on {event['last_completed']}."
+        elif event['last_completed'] is None:
+            message = "has never been completed and is broken."
+        else:
+            message = f"is broken; last completed on {event['last_completed']}."
+        click.echo(f"[{event['time']}] Habit '{event['habit']}' ({label}) {message}")
+
+    with HabitWatcher(DB_PATH, emit, refresh) as watcher:
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+
+@cli.command()
+@click.option('--habit-name', default=None, help="Only show the completion rates of this habit.")
+@click.option('--window', 'windows', multiple=True, type=click.IntRange(min=1),
+              help="Window length in days, can be repeated (default: 7, 30, 90 and 365).")
+def stats(habit_name, windows):
+    """
+    Show the completion rates of the habits over rolling windows ending today.
+
+    The rate is the share of days (daily habits) or weeks (weekly habits) in the window in which
+    the habit was completed, counted from the day the habit was created.
+
+    :param habit_name: Optional. Name of a specific habit to display the rates for.
+    :param windows: Optional. Window lengths in days.
+    """
+    from analytics import get_completion_rates
+
+    windows = windows or (7, 30, 90, 365)
+    habit_rates, overall_rates = get_completion_rates(windows, habit_name)
+    if not habit_rates:
+        print(f"Habit '{habit_name}' does not exist." if habit_name else "No habits found.")
+        return
+
+    def format_rates(rates):
+        return "".join(f"{'-' if rate is None else f'{rate:.0%}':>7}" for rate in rates)
+
+    width = max(len(name) for name, _, _ in habit_rates + [("All habits", None, None)])
+    print(f"{'Habit':<{width}}  {'Period':<7}" + "".join(f"{f'{window}d':>7}" for window in windows))
+    for name, periodicity, rates in habit_rates:
+        print(f"{name:<{width}}  {periodicity:<7}" + format_rates(rates))
+    if not habit_name:
+        print(f"{'All habits':<{width}}  {'':<7}" + format_rates(overall_rates))
+
+@cli.command()
+def rebuild_stats():
+    """
+    Regenerate the stored streak statistics of all habits from the raw completions.
+
+    Use this to recover if completions were changed directly in the database.
+    """
+    from analytics import rebuild_habit_stats
+
+    count = rebuild_habit_stats()
+    click.echo(f"Rebuilt streak statistics for {count} habits.")
+
+@cli.command('import-completions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help="File format, detected from the file extension if omitted.")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=None,
+              help="Number of completions written per transaction (default: 10000).")
+def import_completions_command(path, file_format, chunk_size):
+    """
+    Import completion history from a CSV or JSONL file.
+
+    :param path: File with 'habit' and 'completed_at' columns (CSV) or keys (JSONL).
+    :param file_format: Optional. 'csv' or 'jsonl'.
+    :param chunk_size: Optional. Number of completions written per transaction.
+    """
+    from importer import import_completions, DEFAULT_CHUNK_SIZE
+    imported, skipped, seconds = import_completions(path, file_format, chunk_size or DEFAULT_CHUNK_SIZE, DB_PATH)
+    rate = imported / seconds if seconds else imported
+    click.echo(f"Imported {imported} completions in {seconds:.2f} seconds ({rate:.0f} rows/sec).")
+    if skipped:
+        click.echo(f"Skipped {skipped} rows with unknown habits or invalid timestamps.")
+
+@cli.command()
+@click.argument('kind', type=click.Choice(['completions', 'habits']), default='completions')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True,
+              help="Output format.")
+@click.option('--habit-name', help="Only export the completions of this habit.")
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help="First day to export (YYYY-MM-DD).")
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help="First day not to export (YYYY-MM-DD).")
+def export(kind, file_format, habit_name, since, until):
+    """
+    Stream completions or habits as CSV or JSONL to stdout.
+
+    :param kind: What to export ('completions' or 'habits').
+    :param file_format: Optional. 'csv' or 'jsonl'.
+    :param habit_name: Optional. Only export the completions of this habit.
+    :param since: Optional. First completion day to export.
+    :param until: Optional. First completion day not to export.
+    """
+    from exporter import iter_export_records, export_records
+    records = iter_export_records(kind, habit_name, since and since.date(), until and until.date(), DB_PATH)
+    export_records(records, sys.stdout, kind, file_format)
+
+@cli.command()
+@click.argument('path', type=click.Path(dir_okay=False), default='habits.snapshot')
+def snapshot(path):
+    """
+    Write the habits and their completion days into a read-only snapshot file.
+
+    list-habits, list-by-period, longest-streak and check-habits read it with --snapshot, without
+    touching the database; the file is memory-mapped, so concurrent readers share one copy.
+
+    :param path: Optional. Path of the snapshot file.
+    """
+    from snapshot import write_snapshot
+
+    habits, days = write_snapshot(path, DB_PATH)
+    click.echo(f"Snapshot of {habits} habit(s) with {days} completion day(s) written to {path}.")
+
+@cli.command()
+@click.argument('storage_format', type=click.Choice(['iso', 'epoch']))
+def convert_storage(storage_format):
+    """
+    Convert the stored completions to another storage format.
+
+    'epoch' stores integer epoch seconds plus a precomputed day number, which makes the database
+    and its index smaller and lets the read paths skip date parsing. 'iso' converts back to ISO text.
+
+    :param storage_format: Target storage format ('iso' or 'epoch').
+    """
+    from connection import get_connection
+    from storage import convert_storage as convert
+
+    db = get_connection(DB_PATH)
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # so the file size includes all committed pages
+    size_before = os.path.getsize(DB_PATH)
+    if convert(db, storage_format, vacuum=True):
+        size_after = os.path.getsize(DB_PATH)
+        click.echo(f"Converted completions to the '{storage_format}' storage format "
+                   f"(database size {size_before} -> {size_after} bytes).")
+    else:
+        click.echo(f"Completions are already stored in the '{storage_format}' format.")
+
+
+@cli.command()
+@click.argument('commands', type=click.File('r'), default='-')
+@click.option('--transaction/--no-transaction', default=True, show_default=True,
+              help="Commit the writes of all commands together at the end instead of after every command.")
+@click.option('--stop-on-error', is_flag=True, help="Stop at the first failing command.")
+def batch(commands, transaction, stop_on_error):
+    """
+    Run many commands in one process, one command per line (read from a file or stdin).
+
+    Lines are written like the arguments of this CLI, e.g. `complete-habit "Drink Water"`;
+    blank lines and lines starting with '#' are skipped. Errors are reported per line on stderr.
+
+    :param commands: Optional. File with the command lines, '-' (the default) reads stdin.
+    :param transaction: Optional. Run all commands in one transaction, each line in its own savepoint.
+    :param stop_on_error: Optional. Stop at the first failing command.
+    """
+    from batch import run_batch
+
+    count, failures, seconds = run_batch(cli, commands, transaction, stop_on_error)
+    rate = count / seconds if seconds else 0.0
+    click.echo(f"{count} command(s), {failures} failed, {seconds:.3f} s ({rate:.0f} commands/s)", err=True)
+    if failures:
+        sys.exit(1)
+
+
+@cli.group(cls=OrderedGroup)
+@click.option('--shard-dir', envvar='HABITS_SHARD_DIR', default='shards', show_default=True,
+              help="Directory holding one database per user (also set with HABITS_SHARD_DIR).")
+@click.pass_context
+def shards(ctx, shard_dir):
+    """Per-user databases and reports across all of them."""
+    ctx.obj = shard_dir
+
+@shards.command('add-user')
+@click.argument('user')
+@click.pass_obj
+def shards_add_user(shard_dir, user):
+    """
+    Create the database of a user (or upgrade its schema).
+
+    :param user: Name of the user.
+    """
+    from shards import open_shard
+    click.echo(f"Database of user '{user}': {open_shard(user, shard_dir)}")
+
+@shards.command('check-habits')
+@click.option('--backend', type=click.Choice(sorted(STREAK_BACKENDS)), default=None,
+              help="Backend providing the last completion of each habit (default: one aggregate MAX query).")
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help="Worker processes (default: one per CPU core).")
+@click.pass_obj
+def shards_check_habits(shard_dir, backend, workers):
+    """
+    Check the habits of all users for broken habits, using a process pool.
+
+    :param backend: Optional. Streak backend to use.
+    :param workers: Optional. Number of worker processes.
+    """
+    from shards import check_all_broken_habits as check_shards
+
+    broken_habits = check_shards(shard_dir, backend, workers)
+    for user, messages in broken_habits.items():
+        for message in messages:
+            print(f"[{user}] {message}")
+    if not broken_habits:
+        print("All habits of all users are up to date and not broken.")
+
+@shards.command('longest-streak')
+@click.option('--backend', type=click.Choice(sorted(STREAK_BACKENDS)), default=None,
+              help="Streak backend: read the stored statistics or compute in Python or inside SQLite.")
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help="Worker processes (default: one per CPU core).")
+@click.pass_obj
+def shards_longest_streak(shard_dir, backend, workers):
+    """
+    Show the longest streak across the habits of all users, using a process pool.
+
+    :param backend: Optional. Streak backend to use.
+    :param workers: Optional. Number of worker processes.
+    """
+    from shards import get_longest_streak as longest_across_shards
+
+    longest_streaks = longest_across_shards(shard_dir, backend, workers)
+    for user, habit, streak, period_type in longest_streaks:
+        print(f"[{user}] The longest streak for habit '{habit}' is {streak} {period_type}, without interruption.")
+    if not longest_streaks:
+        print("No streaks found for any habits.")
+
 
 if __name__ == '__main__':
-    init_db()
     cli()
\ No newline at end of file
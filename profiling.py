@@ -0,0 +1,206 @@
+import functools
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+### opt-in profiling of commands: function wall times, SQL statement timings and connections
+
+_lock = threading.Lock()
+_enabled = False
+_started = None
+_functions = {}   # name -> [calls, seconds]
+_statements = {}  # SQL statement -> [calls, rows, seconds]
+_connections = 0
+_cprofile = None
+_dump_path = None
+
+
+def enabled():
+    """
+    Return whether profiling is active.
+
+    :return: True between start() and finish().
+    """
+    return _enabled
+
+
+def start(dump_path=None):
+    """
+    Start profiling: connections opened from now on time their SQL statements, and the functions
+    decorated with @profiled record their wall time.
+
+    :param dump_path: Optional; also run cProfile and write its statistics to this file on finish().
+    """
+    global _enabled, _started, _connections, _cprofile, _dump_path
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+        _connections = 0
+        _started = time.perf_counter()
+        _enabled = True
+    if dump_path:
+        import cProfile  # only needed for dumps
+        _cprofile = cProfile.Profile()
+        _dump_path = dump_path
+        _cprofile.enable()
+
+
+def finish(output_format=None, file=None):
+    """
+    Stop profiling, write the cProfile dump if requested and print the summary.
+
+    :param output_format: Optional; 'table' or 'json' summary, or None to print nothing.
+    :param file: Optional; file the summary is written to (defaults to stderr, so it doesn't mix with command output).
+    :return: The summary as returned by summary().
+    """
+    global _enabled, _cprofile
+    if _cprofile is not None:
+        _cprofile.disable()
+        _cprofile.dump_stats(_dump_path)
+        _cprofile = None
+    result = summary()
+    _enabled = False
+
+    file = file or sys.stderr
+    if output_format == 'json':
+        import json  # only needed for JSON output
+        print(json.dumps(result, indent=2), file=file)
+    elif output_format == 'table':
+        print(format_table(result), file=file)
+    return result
+
+
+def summary():
+    """
+    Summarize the recorded timings.
+
+    :return: Dictionary with the wall time, opened connections, functions (sorted by total time)
+             and SQL statements (sorted by total time), times in ms.
+    """
+    with _lock:
+        return {
+            'wall_ms': round((time.perf_counter() - _started) * 1000, 3) if _started else 0.0,
+            'connections_opened': _connections,
+            'functions': [
+                {'name': name, 'calls': calls, 'total_ms': round(seconds * 1000, 3)}
+                for name, (calls, seconds) in sorted(_functions.items(), key=lambda item: -item[1][1])
+            ],
+            'sql': [
+                {'statement': statement, 'calls': calls, 'rows': rows, 'total_ms': round(seconds * 1000, 3)}
+                for statement, (calls, rows, seconds) in sorted(_statements.items(), key=lambda item: -item[1][2])
+            ],
+        }
+
+
+def format_table(result, width=72):
+    """
+    Format a summary as a text table.
+
+    :param result: Summary as returned by summary().
+    :param width: Width of the name/statement column.
+    :return: The table as a string.
+    """
+    lines = [f"Profile: {result['wall_ms']:.1f} ms wall time, {result['connections_opened']} connection(s) opened",
+             "", f"{'Function':<{width}} {'Calls':>7} {'Total ms':>10}"]
+    lines += [f"{entry['name'][:width]:<{width}} {entry['calls']:>7} {entry['total_ms']:>10.3f}"
+              for entry in result['functions']]
+    lines += ["", f"{'SQL statement':<{width}} {'Calls':>7} {'Rows':>8} {'Total ms':>10}"]
+    lines += [f"{entry['statement'][:width]:<{width}} {entry['calls']:>7} {entry['rows']:>8} {entry['total_ms']:>10.3f}"
+              for entry in result['sql']]
+    return "\n".join(lines)
+
+
+def profiled(function):
+    """
+    Decorator recording the wall time of a function while profiling is active.
+
+    :param function: Function to time, recorded under its qualified name.
+    :return: The wrapped function (a plain call while profiling is off).
+    """
+    name = f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with _lock:
+                entry = _functions.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+
+    return wrapper
+
+
+def _record_sql(statement, seconds, rows=0, calls=0):
+    with _lock:
+        entry = _statements.setdefault(statement, [0, 0, 0.0])
+        entry[0] += calls
+        entry[1] += rows
+        entry[2] += seconds
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    Cursor recording the time and row count of its statements.
+
+    The time of execute and of fetching the rows is added to the statement executed last,
+    so statements that are streamed (e.g. with fetchmany or iteration) are timed completely.
+    """
+    _statement = None
+
+    def _run(self, method, sql, *args):
+        self._statement = re.sub(r'\s+', ' ', sql).strip()
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            # rowcount is the number of modified rows for INSERT/UPDATE/DELETE, -1 for queries
+            _record_sql(self._statement, time.perf_counter() - started, max(self.rowcount, 0), calls=1)
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(super().executescript, sql_script)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        count = len(rows) if isinstance(rows, list) else int(rows is not None)
+        if self._statement is not None:
+            _record_sql(self._statement, time.perf_counter() - started, count)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+def count_connection():
+    """
+    Count a connection opened by get_connection while profiling is active.
+    """
+    global _connections
+    with _lock:
+        _connections += 1
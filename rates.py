@@ -0,0 +1,81 @@
+from array import array
+from datetime import date
+from itertools import accumulate
+from streaks import day_number, period_number
+from daymap import load_daymaps
+
+### completion rates over rolling windows, answered from prefix sums
+
+# Default windows of the completion rates, in days
+DEFAULT_WINDOWS = (7, 30, 90, 365)
+
+
+def window_periods(window_days, periodicity):
+    """
+    Number of periods of a habit in a window of days.
+
+    :param window_days: Length of the window in days.
+    :param periodicity: 'daily' or 'weekly'.
+    :return: window_days for daily habits, the number of whole weeks (at least 1) for weekly habits.
+    """
+    return window_days if periodicity == 'daily' else max(1, window_days // 7)
+
+
+def build_prefix_sums(bits):
+    """
+    Build the prefix sums of a completion bitset.
+
+    :param bits: Bitset of the completed periods (see daymap.py), bit 0 being the first period.
+    :return: Array where element i is the number of completed periods among the first i periods
+             (4 bytes per period instead of a list of int objects).
+    """
+    completed = bin(bits)[:1:-1]  # one character per period, the first period first
+    prefix = array('I', [0])
+    prefix.extend(accumulate(character == '1' for character in completed))
+    return prefix
+
+
+def load_prefix_sums(cursor):
+    """
+    Build the prefix sums of every habit.
+
+    Habits without completions get an empty history, so they count as never completed.
+
+    :param cursor: Cursor of an open database connection.
+    :return: List of (habit_name, periodicity, start_period, first_period, prefix) tuples in habit id order;
+             start_period is the period the habit was created in (or completed first, if earlier).
+    """
+    daymaps = {name: (first_period, bits) for name, _, first_period, bits, _ in load_daymaps(cursor)}
+    habits = cursor.execute('SELECT name, periodicity, created_at FROM habits ORDER BY id').fetchall()
+
+    result = []
+    for name, periodicity, created_at in habits:
+        start_period = period_number(day_number(date.fromisoformat(str(created_at)[:10])), periodicity)
+        first_period, bits = daymaps.get(name, (start_period, 0))
+        result.append((name, periodicity, min(start_period, first_period), first_period, build_prefix_sums(bits)))
+    return result
+
+
+def window_counts(habit_prefix, window_days, today):
+    """
+    Count the completed periods of a habit in the window of days ending today, in O(1).
+
+    The window starts no earlier than the habit's start period, so new habits are not
+    counted as missed before they existed.
+
+    :param habit_prefix: Tuple of load_prefix_sums.
+    :param window_days: Length of the window in days.
+    :param today: Day number of today.
+    :return: Tuple (completed_periods, periods) of the window.
+    """
+    _, periodicity, start_period, first_period, prefix = habit_prefix
+    end = period_number(today, periodicity)
+    start = max(end - window_periods(window_days, periodicity) + 1, start_period)
+    if start > end:
+        return 0, 0
+
+    def completed_before(period):
+        # Completed periods before the given period (prefix sums are relative to first_period)
+        return prefix[min(max(period - first_period, 0), len(prefix) - 1)]
+
+    return completed_before(end + 1) - completed_before(start), end - start + 1
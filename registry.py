@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+
+# Seconds between checks whether the habits were changed by another process (changes made through
+# Habit in this process update the registry right away)
+CHECK_INTERVAL = 1.0
+
+# Registries of this process by database path
+_registries = {}
+_lock = threading.Lock()
+
+### in-memory registry of the habits, serving name lookups without SQL
+
+
+class HabitRecord:
+    """
+    A row of the habits table.
+
+    Records use __slots__, so a registry of 100k habits takes a few MB instead of one dict per habit.
+    """
+    __slots__ = ('id', 'name', 'periodicity', 'created_at', 'description')
+
+    def __init__(self, id, name, periodicity, created_at=None, description=None):
+        self.id = id
+        self.name = name
+        self.periodicity = periodicity
+        self.created_at = created_at
+        self.description = description
+
+    def __repr__(self):
+        return f"HabitRecord(id={self.id!r}, name={self.name!r}, periodicity={self.periodicity!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, HabitRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+
+class HabitRegistry:
+    """
+    All habits of a database, indexed by name.
+
+    The habits are loaded once and kept in sync by Habit.add_habit and Habit.delete_habit.
+    Changes made by other processes increase the version in habit_catalog (maintained by
+    triggers), which is compared at most every CHECK_INTERVAL seconds; the habits are reloaded
+    if it differs.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        """
+        Initialize the registry; the habits are loaded on first use.
+
+        :param db_path: Path of the SQLite database file.
+        """
+        self.db_path = db_path
+        self._records = None  # habit name -> HabitRecord
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self, check=False):
+        """
+        Return the records by name, reloaded first if the habits changed since they were loaded.
+
+        :param check: Optional; compare the version now, even if it was compared less than CHECK_INTERVAL ago.
+        """
+        records = self._records
+        now = time.monotonic()
+        if records is not None and not check and now - self._checked < CHECK_INTERVAL:
+            return records
+
+        db = get_connection(self.db_path)
+        version = db.execute('SELECT version FROM habit_catalog').fetchone()[0]
+        with self._lock:
+            if self._records is None or version != self._version:
+                cursor = db.execute('SELECT id, name, periodicity, created_at, description FROM habits')
+                self._records = {row[1]: HabitRecord(*row) for row in cursor}
+                self._version = version
+            self._checked = now
+            return self._records
+
+    def get(self, name):
+        """
+        Look up a habit by name.
+
+        :param name: Name of the habit.
+        :return: The HabitRecord, or None if there is no habit with this name.
+        """
+        record = self._current().get(name)
+        if record is None:
+            record = self._current(check=True).get(name)  # the habit may have been added by another process
+        return record
+
+    def records(self):
+        """
+        Return all habits.
+
+        :return: List of HabitRecord objects.
+        """
+        return list(self._current().values())
+
+    def add(self, record):
+        """
+        Add a habit that has just been inserted.
+
+        :param record: HabitRecord of the new habit.
+        """
+        with self._lock:
+            if self._records is not None:
+                self._records[record.name] = record
+
+    def remove(self, name):
+        """
+        Remove a habit that has just been deleted.
+
+        :param name: Name of the deleted habit.
+        """
+        with self._lock:
+            if self._records is not None:
+                self._records.pop(name, None)
+
+    def clear(self):
+        """
+        Forget the loaded habits, so they are read again on the next lookup.
+        """
+        with self._lock:
+            self._records = None
+
+
+def get_registry(db_path=DB_PATH):
+    """
+    Return the process-wide registry of a database.
+
+    :param db_path: Path of the SQLite database file.
+    :return: The HabitRegistry of the database.
+    """
+    key = os.fspath(db_path)
+    registry = _registries.get(key)
+    if registry is None:
+        with _lock:
+            registry = _registries.setdefault(key, HabitRegistry(key))
+    return registry
@@ -0,0 +1,247 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from streaks import last_completion_days
+from storage import day_to_date
+import hooks
+
+# Seconds between checks for changes committed by other processes (changes made in this process
+# are picked up right away through hooks.py)
+DEFAULT_REFRESH_INTERVAL = 60.0
+
+# Marks the heap entries of habits that were rescheduled or deleted, which are skipped when popped
+_REMOVED = object()
+
+### reminder scheduler: the next deadline of every habit in a min-heap
+
+
+def _day_start(day):
+    """
+    Return the timestamp of local midnight at the start of a day.
+
+    :param day: Day number.
+    :return: Seconds since the epoch, comparable with time.time().
+    """
+    return datetime.combine(day_to_date(day), datetime.min.time()).timestamp()
+
+
+class HabitWatcher:
+    """
+    Scheduler emitting events when habits become due and when they are broken.
+
+    A habit is due on the last day of the period after its last completion ('due' event at the
+    start of that day) and broken from the next day on ('broken' event), the same rule as
+    check_all_broken_habits. Every habit has at most one entry in a min-heap ordered by the time of
+    its next event, so run() sleeps until the earliest event instead of polling. Completions, new
+    and deleted habits of this process only reschedule the habit concerned (see hooks.py); changes
+    committed by other processes are detected with PRAGMA data_version every refresh_interval seconds.
+
+    Usage:
+        with HabitWatcher(on_event=print) as watcher:
+            watcher.run()  # until watcher.stop() is called from another thread
+    """
+
+    def __init__(self, db_path=DB_PATH, on_event=None, refresh_interval=DEFAULT_REFRESH_INTERVAL, clock=time.time):
+        """
+        Initialize the watcher; the habits are loaded on the first run_pending() call.
+
+        :param db_path: Path of the SQLite database file.
+        :param on_event: Optional; callable receiving every event as a dictionary with the keys
+                         'event' ('due' or 'broken'), 'habit', 'periodicity', 'last_completed', 'due_date' and 'time'.
+        :param refresh_interval: Seconds between checks for changes made by other processes.
+        :param clock: Optional; function returning the current time in seconds since the epoch.
+        """
+        self.db_path = db_path
+        self.on_event = on_event
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._heap = []        # [time, sequence, habit_name, event] entries
+        self._entries = {}     # habit name -> its entry in the heap
+        self._habits = {}      # habit name -> (periodicity, last_day)
+        self._sequence = itertools.count()  # keeps entries with the same time in scheduling order
+        self._changed = set()  # habits changed in this process since the last run_pending()
+        self._reload = True    # read every habit on the next run_pending()
+        self._data_version = None
+        self._checked = 0.0
+        self._stopped = False
+        self._condition = threading.Condition()
+        hooks.add_listener(self._on_change)
+
+    def _on_change(self, db_path, habit_name, change):
+        """
+        Listener of hooks.py: remember the changed habit and wake up run().
+        """
+        if db_path != os.fspath(self.db_path):
+            return
+        with self._condition:
+            if habit_name is None:
+                self._reload = True
+            else:
+                self._changed.add(habit_name)
+            self._condition.notify()
+
+    def _schedule(self, name, periodicity, last_day):
+        """
+        Replace the heap entry of a habit after it was loaded, added or completed.
+
+        :param name: Name of the habit.
+        :param periodicity: 'daily' or 'weekly'.
+        :param last_day: Day number of the last completion, None if it was never completed.
+        """
+        self._unschedule(name)
+        self._habits[name] = (periodicity, last_day)
+        if last_day is None:
+            self._push(name, 0.0, 'broken')  # never completed: broken right away
+        else:
+            self._push(name, _day_start(last_day + (1 if periodicity == 'daily' else 7)), 'due')
+
+    def _unschedule(self, name):
+        """
+        Forget a habit; its heap entry is marked as removed instead of searched for in the heap.
+        """
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            entry[2] = _REMOVED
+        self._habits.pop(name, None)
+
+    def _push(self, name, at, event):
+        entry = [at, next(self._sequence), name, event]
+        self._entries[name] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _refresh(self, cursor, habit_name=None):
+        """
+        Reschedule the habits whose last completion changed, and forget deleted habits.
+
+        :param cursor: Cursor of the watcher's connection.
+        :param habit_name: Optional; only check this habit, otherwise check every habit.
+        """
+        seen = set()
+        for name, periodicity, last_day in last_completion_days(cursor, habit_name):
+            seen.add(name)
+            if self._habits.get(name) != (periodicity, last_day):
+                self._schedule(name, periodicity, last_day)
+        stale = [habit_name] if habit_name else list(self._habits)
+        for name in stale:
+            if name not in seen:
+                self._unschedule(name)
+
+    def _check_changes(self, db):
+        """
+        Apply the changes made since the last call.
+
+        :param db: Connection of the watcher's thread.
+        """
+        with self._condition:
+            changed, self._changed = self._changed, set()
+            reload, self._reload = self._reload, False
+
+        now = self.clock()
+        if not reload and now - self._checked >= self.refresh_interval:
+            # Commits of other connections (e.g. other processes) change the data version of this one
+            reload = db.execute('PRAGMA data_version').fetchone()[0] != self._data_version
+        if reload:
+            self._checked = now
+            self._data_version = db.execute('PRAGMA data_version').fetchone()[0]
+            self._refresh(db.cursor())
+        else:
+            for name in changed:
+                self._refresh(db.cursor(), name)
+
+    def _event(self, event, name, now):
+        periodicity, last_day = self._habits[name]
+        return {
+            'event': event,
+            'habit': name,
+            'periodicity': periodicity,
+            'last_completed': None if last_day is None else day_to_date(last_day).isoformat(),
+            'due_date': None if last_day is None else
+                day_to_date(last_day + (1 if periodicity == 'daily' else 7)).isoformat(),
+            'time': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+        }
+
+    def run_pending(self):
+        """
+        Apply pending changes and emit the events whose time has come.
+
+        :return: List of the emitted events, in the order of their times.
+        """
+        db = get_connection(self.db_path)
+        self._check_changes(db)
+        db.commit()  # don't keep a read transaction open while sleeping
+
+        now = self.clock()
+        events = []
+        while self._heap and self._heap[0][0] <= now:
+            at, _, name, event = heapq.heappop(self._heap)
+            if name is _REMOVED:
+                continue
+            del self._entries[name]
+            periodicity, last_day = self._habits[name]
+            if event == 'due':
+                broken_at = _day_start(last_day + (2 if periodicity == 'daily' else 8))
+                if broken_at > now:
+                    events.append(self._event('due', name, now))
+                    self._push(name, broken_at, 'broken')
+                    continue
+            events.append(self._event('broken', name, now))  # nothing more until the next completion
+
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    def next_event_time(self):
+        """
+        Return the time of the next event.
+
+        :return: Seconds since the epoch, or None if no event is scheduled.
+        """
+        while self._heap and self._heap[0][2] is _REMOVED:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def run(self):
+        """
+        Emit events until stop() is called, sleeping until the next event or change in between.
+        """
+        while True:
+            self.run_pending()
+            with self._condition:
+                if self._stopped:
+                    return
+                if self._changed or self._reload:
+                    continue
+                timeout = self.refresh_interval
+                next_at = self.next_event_time()
+                if next_at is not None:
+                    timeout = min(max(next_at - self.clock(), 0.0), timeout)
+                self._condition.wait(timeout)
+                if self._stopped:
+                    return
+
+    def stop(self):
+        """
+        Make run() return (callable from any thread).
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def close(self):
+        """
+        Stop the watcher and unregister it from the change notifications.
+        """
+        self.stop()
+        hooks.remove_listener(self._on_change)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import analytics
+from db import init_db
+from connection import close_connections
+
+# Directory holding one database file per user, can be overridden with the HABITS_SHARD_DIR environment variable
+SHARD_DIR = os.environ.get('HABITS_SHARD_DIR', 'shards')
+
+# User names that can be used in file names as they are: lowercase only, so that no two of them share a
+# file on case-insensitive file systems, and without '.', which Windows drops at the end of file names
+_SAFE_NAME = re.compile(r'[a-z0-9_-]{1,64}')
+
+### per-user database shards
+
+def shard_path(user, shard_dir=SHARD_DIR):
+    """
+    Return the path of the database file of a user.
+
+    Names of lowercase letters, digits, '_' and '-' are used in the file name as they are
+    ('user-<name>.db'); other names get a file name derived from their SHA-1 hash ('hash-<sha1>.db').
+    The prefixes keep the two kinds apart, so no two user names share a database file.
+
+    :param user: Name of the user (tenant).
+    :param shard_dir: Optional; directory holding the shards.
+    :return: Path of the user's database file.
+    """
+    if _SAFE_NAME.fullmatch(user):
+        name = 'user-' + user
+    else:
+        name = 'hash-' + hashlib.sha1(user.encode('utf-8')).hexdigest()
+    return os.path.join(shard_dir, f'{name}.db')
+
+
+def open_shard(user, shard_dir=SHARD_DIR):
+    """
+    Create or upgrade the database of a user and return its path.
+
+    The schema is set up like init_db does for the main database, but without example data.
+    The returned path can be passed to Habit, Completion and the analytics functions.
+
+    :param user: Name of the user (tenant).
+    :param shard_dir: Optional; directory holding the shards.
+    :return: Path of the user's database file.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    path = shard_path(user, shard_dir)
+    init_db(path, example_data=False)
+    return path
+
+
+def list_shards(shard_dir=SHARD_DIR):
+    """
+    List the shards in a directory.
+
+    :param shard_dir: Optional; directory holding the shards.
+    :return: Sorted list of (shard_name, path) tuples, shard_name being the file name without '.db'.
+    """
+    if not os.path.isdir(shard_dir):
+        return []
+    return [(entry[:-3], os.path.join(shard_dir, entry))
+            for entry in sorted(os.listdir(shard_dir)) if entry.endswith('.db')]
+
+
+def _shard_report(report, path, backend):
+    """
+    Run an analytics report on one shard (executed in a worker process).
+
+    :param report: Name of the analytics function ('check_all_broken_habits' or 'get_longest_streak').
+    :param path: Path of the shard.
+    :param backend: Streak backend, or None for the default.
+    :return: Result of the analytics function.
+    """
+    try:
+        if report == 'get_longest_streak':
+            return analytics.get_longest_streak(backend=backend, db_path=path)
+        return analytics.check_all_broken_habits(backend, path)
+    finally:
+        close_connections(path)  # shards are visited once, so their connections are not kept open
+
+
+def _map_shards(report, shard_dir, backend, workers):
+    """
+    Run an analytics report on every shard, fanned out over a process pool.
+
+    :param report: Name of the analytics function to run per shard.
+    :param shard_dir: Directory holding the shards.
+    :param backend: Streak backend, or None for the default.
+    :param workers: Number of worker processes; 1 runs the shards in this process.
+    :return: Generator of (shard_name, result) tuples in shard order.
+    """
+    shards = list_shards(shard_dir)
+    names = [name for name, _ in shards]
+    paths = [path for _, path in shards]
+    if workers == 1 or len(shards) <= 1:
+        yield from zip(names, (_shard_report(report, path, backend) for path in paths))
+        return
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (workers * 4))  # fewer round trips for many small shards
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_shard_report, [report] * len(paths), paths, [backend] * len(paths), chunksize=chunksize)
+        yield from zip(names, results)
+
+
+def check_all_broken_habits(shard_dir=SHARD_DIR, backend=None, workers=None):
+    """
+    Check the habits of every shard for broken habits, with one worker process per CPU core.
+
+    :param shard_dir: Optional; directory holding the shards.
+    :param backend: Optional; streak backend, defaults to analytics.STREAK_BACKEND.
+    :param workers: Optional; number of worker processes, defaults to the number of CPU cores.
+    :return: Dictionary mapping shard names to their lists of broken habit messages (shards without
+             broken habits are left out).
+    """
+    return {name: messages for name, messages in _map_shards('check_all_broken_habits', shard_dir, backend, workers)
+            if messages}
+
+
+def get_longest_streak(shard_dir=SHARD_DIR, backend=None, workers=None):
+    """
+    Find the longest streak across the habits of all shards, with one worker process per CPU core.
+
+    :param shard_dir: Optional; directory holding the shards.
+    :param backend: Optional; streak backend, defaults to analytics.STREAK_BACKEND.
+    :param workers: Optional; number of worker processes, defaults to the number of CPU cores.
+    :return: List of tuples in the format [(shard_name, habit_name, longest_streak, period_type)] with
+             every habit having the longest streak, like analytics.get_longest_streak.
+    """
+    longest_streak = 0
+    longest_habits = []
+    for name, streaks in _map_shards('get_longest_streak', shard_dir, backend, workers):
+        for habit_name, streak, period_type in streaks:
+            if streak > longest_streak:
+                longest_streak = streak
+                longest_habits = [(name, habit_name, streak, period_type)]
+            elif streak == longest_streak:
+                longest_habits.append((name, habit_name, streak, period_type))
+    return longest_habits
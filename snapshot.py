@@ -0,0 +1,216 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from datetime import date, datetime
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from streaks import iter_completion_days, summarize_days, current_streak, day_number
+from hooks import merge_completion_log  # the snapshot includes the completions still in the completion log
+
+# Default path of the snapshot file
+SNAPSHOT_PATH = 'habits.snapshot'
+
+# File layout (little-endian):
+# - header: magic, number of habits, number of completion days, creation time (epoch seconds)
+# - habit table: one entry per habit in id order: id, periodicity (0 daily, 1 weekly), index of its
+#   first completion day, number of completion days, offset and length of its name and description
+# - completion days: int32 day numbers, sorted and distinct per habit, the habits one after the other
+# - strings: the UTF-8 names and descriptions
+MAGIC = b'HABSNAP1'
+HEADER = struct.Struct('<8sIIq')
+ENTRY = struct.Struct('<IIQIIIII')
+PERIODICITIES = ('daily', 'weekly')
+
+# Description length of habits without a description (NULL)
+NO_DESCRIPTION = 0xFFFFFFFF
+
+### columnar snapshot of the completions for read-only analytics
+
+
+def write_snapshot(path=SNAPSHOT_PATH, db_path=DB_PATH):
+    """
+    Write the habits and their completion days into a snapshot file.
+
+    The file is written next to its final path and renamed at the end, so readers never see a
+    half-written snapshot and an open snapshot stays valid while a new one replaces it.
+
+    :param path: Optional; path of the snapshot file.
+    :param db_path: Optional; path of the SQLite database file.
+    :return: Tuple (habits, days) with the number of habits and completion days written.
+    """
+    merge_completion_log(db_path)
+    cursor = get_connection(db_path).cursor()
+    habits = cursor.execute('SELECT id, name, description, periodicity FROM habits ORDER BY id').fetchall()
+    completion_days = {}
+    for habit_id, _, _, days in iter_completion_days(cursor):
+        completion_days[habit_id] = array('i', sorted(set(days)))
+
+    strings = bytearray()
+    entries = []
+    days_written = 0
+    for habit_id, name, description, periodicity in habits:
+        name = name.encode('utf-8')
+        description = None if description is None else description.encode('utf-8')
+        count = len(completion_days.get(habit_id, ()))
+        entries.append(ENTRY.pack(habit_id, PERIODICITIES.index(periodicity), days_written, count,
+                                  len(strings), len(name), len(strings) + len(name),
+                                  NO_DESCRIPTION if description is None else len(description)))
+        strings += name + (description or b'')
+        days_written += count
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(habits), days_written, int(time.time())))
+        file.write(b''.join(entries))
+        for habit_id, *_ in habits:
+            days = completion_days.get(habit_id)
+            if days:
+                if sys.byteorder != 'little':
+                    days.byteswap()
+                days.tofile(file)
+        file.write(strings)
+    os.replace(temporary_path, path)
+    return len(habits), days_written
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file.
+
+    The file is memory-mapped and the completion days are accessed through memoryview slices
+    of the mapping, so nothing is copied, and processes reading the same snapshot share one
+    copy in the page cache. Results match the analytics of the database at the time the
+    snapshot was written.
+
+    Usage:
+        with Snapshot('habits.snapshot') as snapshot:
+            streaks = list(snapshot.habit_streaks())
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        """
+        Map a snapshot file.
+
+        :param path: Optional; path of the snapshot file.
+        :raises ValueError: If the file is not a snapshot.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, habit_count, day_count, created = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"'{path}' is not a habit snapshot.")
+        self.created_at = datetime.fromtimestamp(created)
+
+        table_end = HEADER.size + habit_count * ENTRY.size
+        days_end = table_end + day_count * 4
+        self._view = memoryview(self._map)
+        self._entries = list(ENTRY.iter_unpack(self._view[HEADER.size:table_end]))
+        if sys.byteorder == 'little':
+            self._days = self._view[table_end:days_end].cast('i')
+        else:
+            self._days = array('i', self._view[table_end:days_end])  # copied once to swap the byte order
+            self._days.byteswap()
+        self._strings = self._view[days_end:]
+        self._names = None
+
+    def _string(self, offset, length):
+        if length == NO_DESCRIPTION:
+            return None
+        return str(self._strings[offset:offset + length], 'utf-8')
+
+    def habits(self, periodicity=None):
+        """
+        List the habits of the snapshot.
+
+        :param periodicity: Optional; only list the habits with this periodicity.
+        :return: List of (habit_id, name, description, periodicity) tuples in habit id order.
+        """
+        return [(habit_id, self._string(name_offset, name_length),
+                 self._string(description_offset, description_length), PERIODICITIES[kind])
+                for habit_id, kind, _, _, name_offset, name_length, description_offset, description_length
+                in self._entries if periodicity is None or PERIODICITIES[kind] == periodicity]
+
+    def _index(self, habit_name):
+        if self._names is None:
+            self._names = {self._string(entry[4], entry[5]): index for index, entry in enumerate(self._entries)}
+        return self._names.get(habit_name)
+
+    def has_habit(self, habit_name):
+        """
+        Check whether the snapshot contains a habit.
+
+        :param habit_name: Name of the habit.
+        :return: True if the habit exists in the snapshot.
+        """
+        return self._index(habit_name) is not None
+
+    def days(self, index):
+        """
+        Return the completion days of the habit at a position of the habit table, without copying.
+
+        :param index: Position of the habit in habit id order.
+        :return: Sequence of the distinct day numbers in ascending order (a memoryview of the mapping).
+        """
+        _, _, start, count, *_ = self._entries[index]
+        return self._days[start:start + count]
+
+    def _selected(self, habit_name):
+        if not habit_name:
+            return range(len(self._entries))
+        index = self._index(habit_name)
+        return [] if index is None else [index]
+
+    def habit_streaks(self, habit_name=None, today=None):
+        """
+        Compute the longest and current streak of every habit (or one habit), like the streak backends.
+
+        :param habit_name: Optional; only compute the streaks of this habit.
+        :param today: Optional; reference date for the current streak (defaults to today).
+        :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order,
+                 for the habits with completions.
+        """
+        today = day_number(today or date.today())
+        for index in self._selected(habit_name):
+            days = self.days(index)
+            if not days:
+                continue
+            entry = self._entries[index]
+            periodicity = PERIODICITIES[entry[1]]
+            longest, last_run, last_period, last_day, _ = summarize_days(days, periodicity)
+            yield (self._string(entry[4], entry[5]), periodicity, longest,
+                   current_streak(last_run, last_period, periodicity, today), last_day)
+
+    def last_days(self):
+        """
+        Return the day of the most recent completion of every habit.
+
+        :return: List of (habit_name, periodicity, last_day) tuples in habit id order; last_day is None for
+                 habits without completions.
+        """
+        result = []
+        for index, entry in enumerate(self._entries):
+            days = self.days(index)
+            result.append((self._string(entry[4], entry[5]), PERIODICITIES[entry[1]], days[-1] if days else None))
+        return result
+
+    def close(self):
+        """
+        Release the views and unmap the file.
+        """
+        for name in ('_days', '_strings', '_view'):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
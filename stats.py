@@ -0,0 +1,128 @@
+from datetime import date
+from streaks import day_number, period_number, iter_completion_days, summarize_days, current_streak
+
+### habit_stats: streak statistics maintained on every completion
+
+def record_completion(cursor, habit_id, periodicity, day):
+    """
+    Update the statistics of a habit for a completion that has just been inserted.
+
+    Runs in O(1) inside the caller's transaction. Completions are normally recorded in
+    chronological order; a completion for an earlier period than the latest one
+    (e.g. imported history) triggers a rebuild of this habit's statistics instead.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: ID of the completed habit.
+    :param periodicity: Periodicity of the habit ('daily' or 'weekly').
+    :param day: Day number of the completion.
+    """
+    record_completions(cursor, habit_id, periodicity, (day,))
+
+
+def record_completions(cursor, habit_id, periodicity, days):
+    """
+    Update the statistics of a habit for several completions that have just been inserted,
+    with one read and one write of its statistics row.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: ID of the completed habit.
+    :param periodicity: Periodicity of the habit ('daily' or 'weekly').
+    :param days: Day numbers of the completions in chronological order.
+    """
+    cursor.execute(
+        '''
+        SELECT current_streak, longest_streak, last_period, last_day, total_count
+        FROM habit_stats WHERE habit_id = ?
+        ''',
+        (habit_id,)
+    )
+    row = cursor.fetchone()
+    current, longest, last_period, last_day, total_count = row or (0, 0, None, None, 0)
+
+    for day in days:
+        period = period_number(day, periodicity)
+        if last_period is not None and period < last_period:
+            rebuild_stats(cursor, habit_id)
+            return
+
+        if last_period is not None and period == last_period + 1:
+            current += 1  # the streak continues in the next period
+        elif last_period is None or period > last_period:
+            current = 1  # a period was missed, a new streak starts
+        longest = max(longest, current)
+        last_period = period
+        last_day = day if last_day is None else max(last_day, day)
+        total_count += 1
+
+    if row is None:
+        cursor.execute(
+            '''
+            INSERT INTO habit_stats (habit_id, current_streak, longest_streak, last_period, last_day, total_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (habit_id, current, longest, last_period, last_day, total_count)
+        )
+        return
+
+    cursor.execute(
+        '''
+        UPDATE habit_stats
+        SET current_streak = ?, longest_streak = ?, last_period = ?, last_day = ?, total_count = ?
+        WHERE habit_id = ?
+        ''',
+        (current, longest, last_period, last_day, total_count, habit_id)
+    )
+
+
+def rebuild_stats(cursor, habit_id=None):
+    """
+    Regenerate habit_stats from the raw completions, for all habits or a single habit.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_id: Optional; only rebuild the statistics of this habit.
+    :return: Number of habits with statistics written.
+    """
+    rows = []
+    for stats_habit_id, _, periodicity, days in iter_completion_days(cursor, habit_id=habit_id):
+        longest, last_run, last_period, last_day, count = summarize_days(days, periodicity)
+        rows.append((stats_habit_id, last_run, longest, last_period, last_day, count))
+
+    if habit_id is None:
+        cursor.execute('DELETE FROM habit_stats')
+    else:
+        cursor.execute('DELETE FROM habit_stats WHERE habit_id = ?', (habit_id,))
+    cursor.executemany(
+        '''
+        INSERT INTO habit_stats (habit_id, current_streak, longest_streak, last_period, last_day, total_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+        rows
+    )
+    return len(rows)
+
+
+def stats_habit_streaks(cursor, habit_name=None, today=None):
+    """
+    Read the streaks and last completion day of every habit from habit_stats.
+
+    Same results as the streak backends in streaks.py, without touching the completions table.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only read the statistics of this habit.
+    :param today: Optional; reference date for the current streak (defaults to today).
+    :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order.
+    """
+    today = day_number(today or date.today())
+    query = '''
+        SELECT h.name, h.periodicity, s.longest_streak, s.current_streak, s.last_period, s.last_day
+        FROM habit_stats s
+        JOIN habits h ON h.id = s.habit_id
+    '''
+    params = ()
+    if habit_name:
+        query += ' WHERE h.name = ?'
+        params = (habit_name,)
+    query += ' ORDER BY h.id'
+
+    for name, periodicity, longest, last_run, last_period, last_day in cursor.execute(query, params):
+        yield name, periodicity, longest, current_streak(last_run, last_period, periodicity, today), last_day
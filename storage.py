@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+
+### storage formats of the completions table
+
+# 'iso': completed_at holds ISO text (the original format)
+# 'epoch': completed_at holds integer epoch seconds and day the precomputed day number
+ISO_FORMAT = 'iso'
+EPOCH_FORMAT = 'epoch'
+STORAGE_FORMATS = (ISO_FORMAT, EPOCH_FORMAT)
+
+# Timestamps are naive local wall-clock times, so epoch seconds are counted from a naive 1970-01-01
+EPOCH = datetime(1970, 1, 1)
+
+# SQL expression for the day number (days since 1970-01-01) of a completion row aliased as c
+DAY_SQL = {
+    ISO_FORMAT: 'CAST(julianday(substr(c.completed_at, 1, 10)) - 2440587.5 AS INTEGER)',
+    EPOCH_FORMAT: 'c.day',
+}
+
+# SQL expression for the ISO timestamp of a completion row aliased as c
+COMPLETED_AT_SQL = {
+    ISO_FORMAT: 'c.completed_at',
+    EPOCH_FORMAT: "strftime('%Y-%m-%dT%H:%M:%S', c.completed_at, 'unixepoch')",
+}
+
+INSERT_SQL = {
+    ISO_FORMAT: 'INSERT INTO completions (habit_id, completed_at) VALUES (?, ?)',
+    EPOCH_FORMAT: 'INSERT INTO completions (habit_id, completed_at, day) VALUES (?, ?, ?)',
+}
+
+# Number of conversions in this process; formats cached before the last conversion are detected again
+_conversions = 0
+
+
+def get_storage_format(db):
+    """
+    Detect the storage format of the completions table.
+
+    :param db: Open sqlite3 connection (or cursor).
+    :return: EPOCH_FORMAT if completions has the precomputed day column, otherwise ISO_FORMAT.
+    """
+    columns = {row[1] for row in db.execute('PRAGMA table_info(completions)')}
+    return EPOCH_FORMAT if 'day' in columns else ISO_FORMAT
+
+
+def cached_storage_format(db, refresh=False):
+    """
+    Return the storage format of the completions table, detected once per shared connection.
+
+    Meant for the write path, which runs once per completion. Conversions in this process make
+    every connection detect the format again. A conversion by another process makes the next insert
+    in the cached format fail (the columns differ), after which the caller refreshes the format.
+
+    :param db: Open connection (or cursor) of connection.get_connection; other connections are not cached.
+    :param refresh: Optional; detect the format again.
+    :return: ISO_FORMAT or EPOCH_FORMAT.
+    """
+    connection = getattr(db, 'connection', db)
+    cached = getattr(connection, 'storage_format', None)
+    if cached is not None and cached[0] == _conversions and not refresh:
+        return cached[1]
+    storage_format = get_storage_format(db)
+    if hasattr(connection, 'storage_format'):
+        connection.storage_format = (_conversions, storage_format)
+    return storage_format
+
+
+def completion_row(storage_format, habit_id, completed_at):
+    """
+    Build the values of a completions row in the given storage format.
+
+    :param storage_format: ISO_FORMAT or EPOCH_FORMAT.
+    :param habit_id: ID of the completed habit.
+    :param completed_at: datetime of the completion.
+    :return: Tuple matching the placeholders of INSERT_SQL[storage_format].
+    """
+    if storage_format == EPOCH_FORMAT:
+        delta = completed_at.replace(tzinfo=None) - EPOCH  # the wall-clock time is kept, as in ISO text
+        seconds = delta.days * 86400 + delta.seconds
+        return habit_id, seconds, delta.days
+    return habit_id, completed_at.isoformat()
+
+
+def day_bound(storage_format, day):
+    """
+    Convert a date into a value comparable with completed_at, for range filters.
+
+    :param storage_format: ISO_FORMAT or EPOCH_FORMAT.
+    :param day: datetime.date of the bound.
+    :return: ISO date string or epoch seconds of midnight of that day.
+    """
+    if storage_format == EPOCH_FORMAT:
+        return (day - EPOCH.date()).days * 86400
+    return day.isoformat()
+
+
+def day_to_date(day):
+    """
+    Convert a stored day number back into a date.
+
+    :param day: Day number (days since 1970-01-01).
+    :return: datetime.date
+    """
+    return EPOCH.date() + timedelta(days=day)
+
+
+def convert_storage(db, storage_format, vacuum=False):
+    """
+    Convert the completions table of a database into the given storage format.
+
+    The table is rebuilt in a single transaction, including its index. Fractional seconds
+    and UTC offsets are dropped when converting to epoch seconds, so every completion keeps
+    its wall-clock time and day, as in completion_row.
+
+    :param db: Open sqlite3 connection.
+    :param storage_format: ISO_FORMAT or EPOCH_FORMAT.
+    :param vacuum: Optional; run VACUUM afterwards to give the freed pages back to the file system.
+    :return: True if the table was converted, False if it already had this format.
+    """
+    global _conversions
+    if get_storage_format(db) == storage_format:
+        return False
+
+    if storage_format == EPOCH_FORMAT:
+        columns = 'habit_id INTEGER, completed_at INTEGER NOT NULL, day INTEGER NOT NULL'
+        copy = '''
+            INSERT INTO completions_new (habit_id, completed_at, day)
+            SELECT habit_id, seconds, CASE WHEN seconds >= 0 THEN seconds / 86400 ELSE (seconds - 86399) / 86400 END
+            FROM (SELECT habit_id, CAST(strftime('%s', substr(completed_at, 1, 19)) AS INTEGER) AS seconds
+                  FROM completions)
+            ORDER BY habit_id, seconds
+        '''
+    else:
+        columns = 'habit_id INTEGER, completed_at TEXT NOT NULL'
+        copy = '''
+            INSERT INTO completions_new (habit_id, completed_at)
+            SELECT habit_id, strftime('%Y-%m-%dT%H:%M:%S', completed_at, 'unixepoch')
+            FROM completions
+            ORDER BY habit_id, completed_at
+        '''
+
+    cursor = db.cursor()
+    cursor.execute('BEGIN')
+    try:
+        cursor.execute(f'CREATE TABLE completions_new ({columns}, FOREIGN KEY(habit_id) REFERENCES habits(id))')
+        cursor.execute(copy)
+        cursor.execute('DROP TABLE completions')
+        cursor.execute('ALTER TABLE completions_new RENAME TO completions')
+        cursor.execute('CREATE INDEX idx_completions_habit_completed ON completions (habit_id, completed_at)')
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+    _conversions += 1
+
+    if vacuum:
+        db.execute('VACUUM')
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # in WAL mode the vacuumed pages land in the WAL file first
+    return True
@@ -0,0 +1,265 @@
+import importlib
+import importlib.util
+from datetime import date
+from itertools import groupby
+from operator import itemgetter
+from storage import get_storage_format, DAY_SQL, EPOCH_FORMAT
+
+# Available streak backends by name, as (module, function), so a backend's module is only imported
+# when it is used. Each one yields (habit_name, periodicity, longest, current, last_day) for every
+# habit with completions:
+# - 'stats' reads the habit_stats table maintained on every completion
+# - 'python' streams all completions once and computes the streaks in Python
+# - 'sql' computes the streaks inside SQLite with window functions
+# - 'bitset' computes the streaks with bit operations on the per-habit completion bitsets
+# - 'numpy' computes the streaks with vectorized array operations (only if NumPy is installed)
+STREAK_BACKENDS = {
+    'stats': ('stats', 'stats_habit_streaks'),
+    'python': ('streaks', 'python_habit_streaks'),
+    'sql': ('streaks', 'sql_habit_streaks'),
+    'bitset': ('daymap', 'bitset_habit_streaks'),
+}
+if importlib.util.find_spec('numpy') is not None:
+    STREAK_BACKENDS['numpy'] = ('vectorized', 'numpy_habit_streaks')
+
+
+def get_streak_backend(name):
+    """
+    Import a streak backend.
+
+    :param name: Name of the backend, a key of STREAK_BACKENDS.
+    :return: The backend function, taking (cursor, habit_name=None).
+    """
+    module, function = STREAK_BACKENDS[name]
+    return getattr(importlib.import_module(module), function)
+
+
+# Day numbers count days since 1970-01-01, the same numbering SQLite yields for julianday() - 2440587.5
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_number(day):
+    """
+    Convert a date into its day number (days since 1970-01-01).
+
+    :param day: datetime.date to convert.
+    :return: Day number as int.
+    """
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+def period_number(day, periodicity):
+    """
+    Map a day number onto the period it belongs to.
+
+    Daily habits use one period per day, weekly habits one period per calendar week
+    starting on Monday (1970-01-01 was a Thursday, hence the offset of 3 days).
+
+    :param day: Day number.
+    :param periodicity: 'daily' or 'weekly'.
+    :return: Period number as int.
+    """
+    return day if periodicity == 'daily' else (day + 3) // 7
+
+### Python backend: one ordered stream of all completions
+
+def _day_parser():
+    """
+    Create a parser turning stored completed_at values into day numbers.
+
+    completed_at holds ISO strings with either a 'T' or a space separator (or plain dates),
+    so the date part is always the first 10 characters. Parsed values are memoized,
+    since most completions of different habits share the same days.
+    """
+    cache = {}
+
+    def parse(completed_at):
+        day = cache.get(completed_at)
+        if day is None:
+            day = cache[completed_at] = date.fromisoformat(completed_at[:10]).toordinal() - EPOCH_ORDINAL
+        return day
+
+    return parse
+
+
+def iter_completion_days(cursor, habit_name=None, habit_id=None):
+    """
+    Stream the completion days of every habit using one query ordered by (habit_id, completed_at).
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; restrict the stream to this habit.
+    :param habit_id: Optional; restrict the stream to the habit with this ID.
+    :return: Generator of (habit_id, name, periodicity, days) tuples, one per habit with completions.
+             days is an iterator of day numbers in ascending order and must be consumed
+             before the next habit is requested.
+    """
+    # Databases in the epoch storage format provide the day numbers directly, without parsing
+    precomputed = get_storage_format(cursor) == EPOCH_FORMAT
+    query = f'''
+        SELECT c.habit_id, h.name, h.periodicity, {'c.day' if precomputed else 'c.completed_at'}
+        FROM completions c
+        JOIN habits h ON h.id = c.habit_id
+    '''
+    params = ()
+    if habit_name:
+        query += ' WHERE h.name = ?'
+        params = (habit_name,)
+    elif habit_id is not None:
+        query += ' WHERE c.habit_id = ?'
+        params = (habit_id,)
+    query += ' ORDER BY c.habit_id, c.completed_at'
+
+    parse = (lambda day: day) if precomputed else _day_parser()
+    rows = cursor.execute(query, params)  # iterating the cursor streams the rows
+    for (habit_id, name, periodicity), group in groupby(rows, key=itemgetter(0, 1, 2)):
+        yield habit_id, name, periodicity, (parse(row[3]) for row in group)
+
+
+
+def last_completion_days(cursor, habit_name=None):
+    """
+    Read the day of the most recent completion of every habit with one aggregate query.
+
+    The correlated MAX(completed_at) is answered with one seek into idx_completions_habit_completed
+    per habit, so the cost grows with the number of habits instead of the number of completions.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only read the last completion of this habit.
+    :return: Generator of (habit_name, periodicity, last_day) tuples in habit id order;
+             last_day is None for habits without completions.
+    """
+    query = """
+        SELECT h.name, h.periodicity,
+               (SELECT MAX(c.completed_at) FROM completions c WHERE c.habit_id = h.id)
+        FROM habits h
+    """
+    params = ()
+    if habit_name:
+        query += ' WHERE h.name = ?'
+        params = (habit_name,)
+    query += ' ORDER BY h.id'
+    if get_storage_format(cursor) == EPOCH_FORMAT:
+        to_day = lambda seconds: seconds // 86400  # epoch seconds of the completion
+    else:
+        parse = _day_parser()
+        to_day = lambda completed_at: parse(str(completed_at))
+    for name, periodicity, last_completed in cursor.execute(query, params):
+        yield name, periodicity, None if last_completed is None else to_day(last_completed)
+
+
+def summarize_days(days, periodicity):
+    """
+    Summarize the completion days of one habit into runs of consecutive periods.
+
+    Several completions within the same period count once for the streaks.
+
+    :param days: Iterable of day numbers in ascending order (at least one).
+    :param periodicity: 'daily' or 'weekly'.
+    :return: Tuple (longest, last_run, last_period, last_day, count), where last_run is the length
+             of the run ending at the latest completed period.
+    """
+    longest = run = count = 0
+    previous = last_day = None
+    for last_day in days:
+        count += 1
+        period = period_number(last_day, periodicity)
+        if period == previous:
+            continue
+        run = run + 1 if previous is not None and period == previous + 1 else 1
+        longest = max(longest, run)
+        previous = period
+    return longest, run, previous, last_day, count
+
+
+def current_streak(last_run, last_period, periodicity, today):
+    """
+    Decide whether the run ending at the latest completed period is still alive.
+
+    The run is alive if the latest completed period is the current or the previous one.
+
+    :param last_run: Length of the run ending at last_period.
+    :param last_period: Latest completed period number.
+    :param periodicity: 'daily' or 'weekly'.
+    :param today: Day number of today.
+    :return: The current streak (0 if the habit was missed in the previous period).
+    """
+    return last_run if last_period >= period_number(today, periodicity) - 1 else 0
+
+
+def python_habit_streaks(cursor, habit_name=None, today=None):
+    """
+    Compute the streaks and last completion day of every habit in a single pass over the completions.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only compute the streaks of this habit.
+    :param today: Optional; reference date for the current streak (defaults to today).
+    :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order,
+             for every habit with at least one completion. last_day is a day number.
+    """
+    today = day_number(today or date.today())
+    for _, name, periodicity, days in iter_completion_days(cursor, habit_name):
+        longest, last_run, last_period, last_day, _ = summarize_days(days, periodicity)
+        yield name, periodicity, longest, current_streak(last_run, last_period, periodicity, today), last_day
+
+### SQL backend: gaps-and-islands with window functions inside SQLite
+
+# Consecutive periods of a habit form an island: period - ROW_NUMBER() is constant within it.
+SQL_STREAKS_QUERY = '''
+    WITH periods AS (
+        SELECT d.habit_id,
+               CASE WHEN h.periodicity = 'daily' THEN d.day ELSE (d.day + 3) / 7 END AS period,
+               MAX(d.day) AS last_day
+        FROM (
+            SELECT c.habit_id, {day} AS day
+            FROM completions c
+        ) d
+        JOIN habits h ON h.id = d.habit_id
+        WHERE :habit_name IS NULL OR h.name = :habit_name
+        GROUP BY d.habit_id, period
+    ),
+    islands AS (
+        SELECT habit_id, period, last_day,
+               period - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY period) AS island
+        FROM periods
+    ),
+    runs AS (
+        SELECT habit_id, COUNT(*) AS length, MAX(period) AS last_period, MAX(last_day) AS last_day
+        FROM islands
+        GROUP BY habit_id, island
+    ),
+    ranked AS (
+        SELECT habit_id, length, last_period, last_day,
+               MAX(last_period) OVER (PARTITION BY habit_id) AS latest_period
+        FROM runs
+    )
+    SELECT h.name, h.periodicity,
+           MAX(r.length) AS longest,
+           MAX(CASE
+                   WHEN r.last_period = r.latest_period
+                        AND r.last_period >= CASE WHEN h.periodicity = 'daily' THEN :today
+                                                  ELSE (:today + 3) / 7 END - 1
+                   THEN r.length ELSE 0
+               END) AS current,
+           MAX(r.last_day) AS last_day
+    FROM ranked r
+    JOIN habits h ON h.id = r.habit_id
+    GROUP BY h.id
+    ORDER BY h.id
+'''
+
+
+def sql_habit_streaks(cursor, habit_name=None, today=None):
+    """
+    Compute the longest and current streak of every habit inside SQLite.
+
+    Same results as python_habit_streaks, but only the final numbers per habit leave the database.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only compute the streaks of this habit.
+    :param today: Optional; reference date for the current streak (defaults to today).
+    :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order.
+    """
+    params = {'habit_name': habit_name or None, 'today': day_number(today or date.today())}
+    query = SQL_STREAKS_QUERY.format(day=DAY_SQL[get_storage_format(cursor)])
+    yield from cursor.execute(query, params)
+
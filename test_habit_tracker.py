@@ -1,11 +1,41 @@
 import os
-from db import init_db, DB_PATH  # Import the DB_PATH
+from db import init_db, migrate, get_schema_version, DB_PATH, SCHEMA_VERSION  # Import the DB_PATH
 import pytest
 import sqlite3
 from example_data import add_example_habits
 from habit import Habit
 from completion import Completion
+from connection import get_connection, opened_connections, close_connections
+from streaks import python_habit_streaks, sql_habit_streaks, day_number, period_number, iter_completion_days
+from stats import stats_habit_streaks, record_completion, rebuild_stats
+from importer import import_completions
+from exporter import iter_export_records, export_records
+import io
+from benchmarks.generator import generate_history
+from async_store import AsyncHabitStore
+import asyncio
+from write_queue import CompletionQueue
+import shards
+from daymap import bitset_habit_streaks, bitset_completion_rates, rebuild_daymaps, build_daymap, longest_run, last_run, to_blob
+from rates import load_prefix_sums, window_counts, window_periods
+import profiling
+from scheduler import HabitWatcher
+import completion_log
+from completion_log import CompletionLog, RECORD, list_segments, segment_path
+from snapshot import Snapshot, write_snapshot
+import registry
+import hooks
+import json
+from cache import cached_query, cache_info, clear_cache
+from storage import convert_storage, get_storage_format, ISO_FORMAT, EPOCH_FORMAT
+import subprocess
+import sys
+from datetime import date, datetime, timedelta
+import random
+import threading
+import time
 from analytics import get_longest_streak, get_all_habits, get_habits_by_periodicity, check_all_broken_habits
+from analytics import get_completion_rates, get_due_habits, get_habits_page, iter_habits
 
 @pytest.fixture(scope="session", autouse=True) # The fixture is configured to be executed automatically once per test run before all tests.
 def setup_test_database():
@@ -51,6 +81,29 @@ def completion_tracker():
     """
     return Completion(DB_PATH)
 
+def add_random_history(db, today, seed=42):
+    """
+    Fills a new database with 40 random daily and weekly habits and their completions,
+    stored in the different date formats found in existing databases.
+
+    Parameters:
+        db (sqlite3.Connection): Connection to an empty database.
+        today (date): Date of the most recent possible completion.
+        seed (int): Seed for the random generator.
+    """
+    rng = random.Random(seed)
+    migrate(db)
+    for habit_id in range(1, 41):
+        periodicity = rng.choice(["daily", "weekly"])
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES (?, ?, ?)",
+                   (f"Habit {habit_id}", periodicity, today.isoformat()))
+        for offset in range(rng.randint(0, 120)):
+            if rng.random() < 0.7:
+                day = today - timedelta(days=offset)
+                completed_at = rng.choice([day.isoformat(), f"{day} 08:30:00", f"{day}T21:15:00.5"])
+                db.execute("INSERT INTO completions VALUES (?, ?)", (habit_id, completed_at))
+    rebuild_stats(db.cursor())
+
 # Tests
 
 def test_add_habit(habit_tracker):
@@ -225,3 +278,1159 @@ def test_longest_streak_across_all_habits(habit_tracker, completion_tracker):
             f"The habit with the longest streak should be one of the tracked habits, found: '{habit}'"
         assert streak >= 1, "The longest streak should be at least 1"
         assert period_type in ["days", "weeks"], "The period type should be either 'days' or 'weeks'"
+
+def test_migrate_upgrades_existing_database(tmp_path):
+    """
+    Tests that an unversioned database with the original schema is upgraded in place,
+    keeps its data and gets the completion and habit name indexes.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the legacy database file.
+    """
+    legacy_path = tmp_path / "legacy.db"
+    with sqlite3.connect(legacy_path) as db:
+        db.execute("CREATE TABLE habits (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                   "description TEXT, periodicity TEXT NOT NULL, created_at TEXT NOT NULL)")
+        db.execute("CREATE TABLE completions (habit_id INTEGER, completed_at TEXT NOT NULL, "
+                   "FOREIGN KEY(habit_id) REFERENCES habits(id))")
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Legacy', 'daily', '2024-01-01')")
+        db.execute("INSERT INTO completions VALUES (1, '2024-01-02T08:00:00')")
+
+    with sqlite3.connect(legacy_path) as db:
+        assert get_schema_version(db) == 0
+        assert migrate(db) == SCHEMA_VERSION
+        assert migrate(db) == SCHEMA_VERSION  # running again is a no-op
+
+        assert db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] == 1
+        plan = db.execute("EXPLAIN QUERY PLAN SELECT completed_at FROM completions "
+                          "WHERE habit_id = 1 ORDER BY completed_at DESC").fetchall()
+        assert any("idx_completions_habit_completed" in row[-1] for row in plan)
+
+        with pytest.raises(sqlite3.IntegrityError):
+            db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Legacy', 'daily', '2024-01-01')")
+
+def test_migrate_resolves_duplicate_habit_names(tmp_path, capsys):
+    """
+    Tests that upgrading a database holding duplicate habit names, which older versions allowed,
+    merges the duplicates with the same periodicity and renames the others instead of failing
+    on the unique name index.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the legacy database file.
+        capsys (pytest fixture): Captures the messages about the resolved duplicates.
+    """
+    legacy_path = tmp_path / "duplicates.db"
+    with sqlite3.connect(legacy_path) as db:
+        db.execute("CREATE TABLE habits (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                   "description TEXT, periodicity TEXT NOT NULL, created_at TEXT NOT NULL)")
+        db.execute("CREATE TABLE completions (habit_id INTEGER, completed_at TEXT NOT NULL, "
+                   "FOREIGN KEY(habit_id) REFERENCES habits(id))")
+        for name, periodicity in [("Run", "daily"), ("Run", "daily"), ("Run", "weekly"), ("Run (weekly)", "daily")]:
+            db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES (?, ?, '2024-01-01')",
+                       (name, periodicity))
+        db.executemany("INSERT INTO completions VALUES (?, ?)",
+                       [(1, "2024-01-02T08:00:00"), (2, "2024-01-03T08:00:00"), (3, "2024-01-04T08:00:00")])
+
+    with sqlite3.connect(legacy_path) as db:
+        assert migrate(db) == SCHEMA_VERSION
+        assert db.execute("SELECT id, name, periodicity FROM habits ORDER BY id").fetchall() == [
+            (1, "Run", "daily"), (3, "Run (weekly 2)", "weekly"), (4, "Run (weekly)", "daily")]
+        assert db.execute("SELECT habit_id, COUNT(*) FROM completions GROUP BY habit_id").fetchall() == [(1, 2), (3, 1)]
+        assert db.execute("SELECT total_count FROM habit_stats WHERE habit_id = 1").fetchone() == (2,)
+    assert "merged into habit id 1" in capsys.readouterr().out
+
+
+def test_shared_connection_is_reused():
+    """
+    Tests that the analytics functions reuse the shared per-thread connection
+    instead of opening one connection per habit, and that WAL mode is enabled.
+    """
+    db = get_connection(DB_PATH)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    opened_before = opened_connections()
+    get_all_habits()
+    get_longest_streak()
+    check_all_broken_habits()
+    assert opened_connections() == opened_before, "Analytics calls should not open new connections"
+    assert get_connection(DB_PATH) is db
+
+def test_single_pass_streaks_match_per_habit_completions(completion_tracker):
+    """
+    Tests that the single-pass streak engine finds the same longest streaks as walking the
+    completions of every habit one by one.
+
+    Parameters:
+        completion_tracker (Completion): An instance of the Completion class.
+    """
+    db = get_connection(DB_PATH)
+    expected = []
+    for habit_id, name, periodicity in db.execute("SELECT id, name, periodicity FROM habits ORDER BY id").fetchall():
+        completions = completion_tracker.get_completions(habit_id)
+        if not completions:
+            continue
+        periods = sorted({period_number(day_number(day), periodicity) for day in completions})
+        longest = streak = 1
+        for older, newer in zip(periods, periods[1:]):
+            streak = streak + 1 if newer - older == 1 else 1
+            longest = max(longest, streak)
+        expected.append((name, periodicity, longest))
+
+    assert [row[:3] for row in python_habit_streaks(db.cursor())] == expected
+
+
+def test_streak_backends_give_same_results(tmp_path):
+    """
+    Tests that the Python, SQL and stored statistics backends compute the same longest and current
+    streaks, both on the test data and on random completion histories in mixed date formats.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    db = get_connection(DB_PATH)
+    for engine in (sql_habit_streaks, stats_habit_streaks):
+        assert list(python_habit_streaks(db.cursor())) == list(engine(db.cursor()))
+        assert list(python_habit_streaks(db.cursor(), "Read Book")) == list(engine(db.cursor(), "Read Book"))
+
+    today = date(2024, 11, 6)
+    with sqlite3.connect(tmp_path / "random.db") as random_db:
+        add_random_history(random_db, today)
+
+        for reference in (today, today + timedelta(days=1), today + timedelta(days=9)):
+            python_rows = list(python_habit_streaks(random_db.cursor(), today=reference))
+            assert python_rows, "The random history should contain streaks"
+            assert python_rows == list(sql_habit_streaks(random_db.cursor(), today=reference))
+            assert python_rows == list(stats_habit_streaks(random_db.cursor(), today=reference))
+
+
+def test_longest_streak_finds_longest_run():
+    """
+    Tests that the longest streak is the longest run of consecutive periods and not
+    the run that happens to start at the oldest completion.
+    """
+    db = get_connection(DB_PATH)
+    with sqlite3.connect(":memory:") as memory_db:
+        migrate(memory_db)
+        memory_db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Run', 'daily', '2024-01-01')")
+        for day in ["2024-01-01", "2024-01-03", "2024-01-04", "2024-01-05", "2024-01-05", "2024-01-07"]:
+            memory_db.execute("INSERT INTO completions VALUES (1, ?)", (day,))
+
+        for engine in (python_habit_streaks, sql_habit_streaks):
+            assert [row[:4] for row in engine(memory_db.cursor(), today=date(2024, 1, 8))] == [("Run", "daily", 3, 1)]
+            assert [row[:4] for row in engine(memory_db.cursor(), today=date(2024, 1, 9))] == [("Run", "daily", 3, 0)]
+
+
+def test_habit_stats_are_maintained_incrementally(tmp_path):
+    """
+    Tests that recording completions one by one (including an out-of-order completion)
+    leaves habit_stats in the same state as a full rebuild, and that deleting a habit
+    removes its statistics.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database.
+    """
+    stats_path = tmp_path / "stats.db"
+    with sqlite3.connect(stats_path) as db:
+        migrate(db)
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Stretch', 'weekly', '2024-01-01')")
+        start = date(2024, 1, 1)
+        for offset in [0, 2, 8, 15, 29, 36, 37, 5]:  # the last completion is recorded out of order
+            day = start + timedelta(days=offset)
+            cursor.execute("INSERT INTO completions VALUES (1, ?)", (day.isoformat(),))
+            record_completion(cursor, 1, "weekly", day_number(day))
+
+        incremental = cursor.execute("SELECT * FROM habit_stats").fetchall()
+        rebuild_stats(cursor)
+        assert cursor.execute("SELECT * FROM habit_stats").fetchall() == incremental
+        assert incremental[0][1:3] == (2, 3)  # current streak of 2 weeks, longest streak of 3 weeks
+
+    Habit(stats_path).delete_habit("Stretch")
+    with sqlite3.connect(stats_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM habit_stats").fetchone()[0] == 0
+
+
+def test_add_completion_updates_habit_stats(completion_tracker):
+    """
+    Tests that marking a habit as complete updates its stored statistics in the same transaction.
+
+    Parameters:
+        completion_tracker (Completion): An instance of the Completion class.
+    """
+    db = get_connection(DB_PATH)
+    count_query = ("SELECT total_count FROM habit_stats "
+                   "WHERE habit_id = (SELECT id FROM habits WHERE name = 'Meditate')")
+    count_before = db.execute(count_query).fetchone()[0]
+    completion_tracker.add_completion("Meditate")
+    assert db.execute(count_query).fetchone()[0] == count_before + 1
+
+    # Restore the test data state, since Meditate is expected to be broken in test_check_habits
+    db.execute("DELETE FROM completions WHERE rowid = (SELECT MAX(rowid) FROM completions)")
+    rebuild_stats(db.cursor())
+    rebuild_daymaps(db.cursor())
+    db.commit()
+
+
+def test_broken_habits_match_across_backends():
+    """
+    Tests that every streak backend detects the same broken habits.
+    """
+    expected = check_all_broken_habits("python")
+    assert check_all_broken_habits("sql") == expected
+    assert check_all_broken_habits("stats") == expected
+
+
+def test_numpy_backend_matches_python_backend(tmp_path):
+    """
+    Tests that the vectorized NumPy backend computes the same streaks and broken habits
+    as the Python backend. Skipped if NumPy is not installed.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    pytest.importorskip("numpy")
+    from vectorized import numpy_habit_streaks
+
+    db = get_connection(DB_PATH)
+    assert list(numpy_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+    assert list(numpy_habit_streaks(db.cursor(), "Clean House")) == list(python_habit_streaks(db.cursor(), "Clean House"))
+    assert list(numpy_habit_streaks(db.cursor(), "Unknown")) == []
+    assert check_all_broken_habits("numpy") == check_all_broken_habits("python")
+
+    today = date(2024, 11, 6)
+    with sqlite3.connect(tmp_path / "random.db") as random_db:
+        add_random_history(random_db, today, seed=7)
+        for reference in (today, today + timedelta(days=1), today + timedelta(days=9)):
+            assert list(numpy_habit_streaks(random_db.cursor(), today=reference)) == \
+                list(python_habit_streaks(random_db.cursor(), today=reference))
+
+
+def test_import_completions_from_csv_and_jsonl(tmp_path):
+    """
+    Tests importing completion history from CSV and JSONL files in small chunks,
+    skipping rows of unknown habits and rebuilding the streak statistics.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and import files.
+    """
+    import_path = tmp_path / "import.db"
+    with sqlite3.connect(import_path) as db:
+        migrate(db)
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Walk', 'daily', '2024-01-01')")
+
+    csv_file = tmp_path / "history.csv"
+    csv_file.write_text("habit,completed_at\n"
+                        "Walk,2024-01-01T07:00:00\n"
+                        "Walk,2024-01-02 07:00:00\n"
+                        "Swim,2024-01-02T07:00:00\n"
+                        "Walk,2024-01-03\n")
+    jsonl_file = tmp_path / "history.jsonl"
+    jsonl_file.write_text('{"habit": "Walk", "completed_at": "2024-01-05T07:00:00"}\n'
+                          '{"habit": "Walk", "completed_at": "not a date"}\n')
+
+    assert import_completions(csv_file, chunk_size=2, db_path=import_path)[:2] == (3, 1)
+    assert import_completions(jsonl_file, db_path=import_path)[:2] == (1, 1)
+
+    with sqlite3.connect(import_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] == 4
+        assert db.execute("SELECT longest_streak, total_count FROM habit_stats").fetchone() == (3, 4)
+
+
+def test_failed_import_keeps_stats_of_committed_chunks(tmp_path):
+    """
+    Tests that malformed rows are skipped without stopping the import, and that an import failing
+    after some chunks were committed still rebuilds the streak statistics of the habits in those
+    chunks, so the stats backend matches the completions.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and the import file.
+    """
+    import_path = tmp_path / "failed.db"
+    with sqlite3.connect(import_path) as db:
+        migrate(db)
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Walk', 'daily', '2024-01-01')")
+
+    jsonl_file = tmp_path / "malformed.jsonl"
+    jsonl_file.write_text("".join(f'{{"habit": "Walk", "completed_at": "2024-01-0{day}T07:00:00"}}\n'
+                                  for day in range(1, 6))
+                          + '{not json\n{"habit": "Walk"}\n["Walk", "2024-01-06"]\n{"habit": ["Walk"], "completed_at": 1}\n')
+    assert import_completions(jsonl_file, chunk_size=2, db_path=import_path)[:2] == (5, 4)
+
+    # The file can't be decoded beyond the first read buffer, after some chunks were committed
+    broken_file = tmp_path / "broken.jsonl"
+    days = [date(2023, 1, 1) + timedelta(days=offset) for offset in range(300)]
+    broken_file.write_bytes("".join(f'{{"habit": "Walk", "completed_at": "{day}T07:00:00"}}\n'
+                                    for day in days).encode() + b"\xff\n")
+    with pytest.raises(UnicodeDecodeError):
+        import_completions(broken_file, chunk_size=2, db_path=import_path)
+
+    with sqlite3.connect(import_path) as db:
+        committed = db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - 5
+        assert 0 < committed < len(days) and committed % 2 == 0  # whole chunks only
+        assert db.execute("SELECT longest_streak, total_count FROM habit_stats").fetchone() == (committed, committed + 5)
+    close_connections(import_path)
+
+
+def test_export_round_trips_through_import(tmp_path):
+    """
+    Tests that exported completions stream in the import format and can be imported again,
+    and that the date filters and habit export work.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the export file and target database.
+    """
+    export_file = tmp_path / "export.jsonl"
+    with open(export_file, "w") as file:
+        exported = export_records(iter_export_records("completions", "Exercise"), file, file_format="jsonl")
+    assert exported == len(Completion(DB_PATH).get_completions(2))
+
+    target_path = tmp_path / "target.db"
+    with sqlite3.connect(target_path) as db:
+        migrate(db)
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Exercise', 'daily', '2024-01-01')")
+    assert import_completions(export_file, db_path=target_path)[:2] == (exported, 0)
+
+    today = date.today()
+    recent = list(iter_export_records("completions", since=today - timedelta(days=3), until=today))
+    assert recent and all(record["completed_at"] >= str(today - timedelta(days=3)) for record in recent)
+
+    output = io.StringIO()
+    assert export_records(iter_export_records("habits"), output, kind="habits") >= 5
+    assert output.getvalue().startswith("id,name,description,periodicity,created_at")
+
+
+def test_init_db_fast_path_skips_schema_ddl():
+    """
+    Tests that init_db on a database with a current schema only reads the schema version
+    and runs no DDL statements.
+    """
+    statements = []
+    db = get_connection(DB_PATH)
+    db.set_trace_callback(statements.append)
+    try:
+        init_db()
+    finally:
+        db.set_trace_callback(None)
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_cli_import_is_lazy(tmp_path):
+    """
+    Tests that importing the CLI module doesn't import optional or command-specific modules
+    (NumPy, the example data generator, the importer and the exporter), and that a simple
+    listing doesn't import the streak backends, the snapshot reader or the completion log.
+
+    Parameters:
+        tmp_path (pytest fixture): Working directory of the listing, holding its database.
+    """
+    code = ("import sys, main; "
+            "print(sorted(m for m in ('numpy', 'example_data', 'importer', 'exporter', 'random') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == "[]"
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ("import sys; sys.path.insert(0, sys.argv[1]); import main; "
+            "main.cli(['list-habits'], standalone_mode=False); "
+            "print(sorted(m for m in ('snapshot', 'completion_log', 'daymap', 'rates', 'vectorized', 'registry', "
+            "'concurrent.futures', 'mmap') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code, package_dir], capture_output=True, text=True, check=True,
+                            cwd=tmp_path)
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_benchmark_generator_is_deterministic():
+    """
+    Tests that the benchmark data generator produces the same history for the same seed
+    and end date, with consistent streak statistics.
+    """
+    dumps = []
+    for _ in range(2):
+        with sqlite3.connect(":memory:") as memory_db:
+            count = generate_history(memory_db, habits=5, years=1, seed=3, end=date(2024, 6, 30))
+            assert memory_db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] == count
+            assert memory_db.execute("SELECT SUM(total_count) FROM habit_stats").fetchone()[0] == count
+            dumps.append(list(memory_db.iterdump()))
+    assert dumps[0] == dumps[1]
+
+
+def test_epoch_storage_gives_same_results(tmp_path):
+    """
+    Tests that converting the completions to epoch seconds keeps the streaks of every backend,
+    the completion dates and the exported records, that new completions are stored in the
+    epoch format, and that the conversion can be reverted, also by another process.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    storage_path = tmp_path / "storage.db"
+    today = date(2024, 11, 6)
+    with sqlite3.connect(storage_path) as random_db:
+        add_random_history(random_db, today, seed=11)
+        random_db.execute("UPDATE completions SET completed_at = substr(completed_at, 1, 19)")  # epoch has no fractions
+        # the wall-clock day is kept for times with a UTC offset and for times before 1970
+        random_db.executemany("INSERT INTO completions VALUES (1, ?)",
+                              [("2024-01-02T01:30:00+02:00",), ("1969-12-31T12:00:00",)])
+        rebuild_stats(random_db.cursor())
+
+    db = get_connection(storage_path)
+    engines = [python_habit_streaks, sql_habit_streaks, stats_habit_streaks]
+    expected = list(python_habit_streaks(db.cursor(), today=today))
+    completions = Completion(storage_path)
+    expected_days = completions.get_completions(1)
+    expected_records = [(habit_id, name, datetime.fromisoformat(completed_at))
+                        for habit_id, name, completed_at in completions.iter_completions(since=today - timedelta(days=30))]
+
+    assert convert_storage(db, EPOCH_FORMAT, vacuum=True)
+    assert not convert_storage(db, EPOCH_FORMAT)
+    assert get_storage_format(db) == EPOCH_FORMAT
+    assert db.execute("SELECT completed_at, day FROM completions WHERE habit_id = 1 AND day IN (?, ?)",
+                      (day_number(date(2024, 1, 2)), -1)).fetchall() \
+        == [(-43200, -1), (day_number(date(2024, 1, 2)) * 86400 + 5400, day_number(date(2024, 1, 2)))]
+    for engine in engines:
+        assert list(engine(db.cursor(), today=today)) == expected
+    assert completions.get_completions(1) == expected_days
+    assert [(habit_id, name, datetime.fromisoformat(completed_at))
+            for habit_id, name, completed_at in completions.iter_completions(since=today - timedelta(days=30))] \
+        == expected_records
+
+    completions.add_completion("Habit 1")
+    assert completions.get_completions(1)[0] == date.today()
+    assert db.execute("SELECT typeof(completed_at), day FROM completions ORDER BY rowid DESC LIMIT 1").fetchone() \
+        == ("integer", day_number(date.today()))
+
+    assert convert_storage(db, ISO_FORMAT)
+    assert get_storage_format(db) == ISO_FORMAT
+    assert completions.get_completions(1)[1:] == expected_days
+
+    # the format cached by this completion is outdated once another process converts the table
+    completions.add_completion("Habit 1")
+    code = "import sys, sqlite3; from storage import convert_storage; convert_storage(sqlite3.connect(sys.argv[1]), 'epoch')"
+    subprocess.run([sys.executable, "-c", code, str(storage_path)], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    completions.add_completion("Habit 1")
+    assert db.execute("SELECT typeof(completed_at) FROM completions ORDER BY rowid DESC LIMIT 1").fetchone() \
+        == ("integer",)
+
+
+def test_query_cache_reuses_results_until_data_changes(habit_tracker, completion_tracker):
+    """
+    Tests that repeated analytics reads are served from the query cache, and that the cache
+    is invalidated by Habit/Completion writes and by commits of other connections.
+
+    Parameters:
+        habit_tracker (Habit): An instance of the Habit class.
+        completion_tracker (Completion): An instance of the Completion class.
+    """
+    clear_cache()
+    habits = get_all_habits()
+    assert get_all_habits() == habits
+    assert check_all_broken_habits() == check_all_broken_habits()
+    assert completion_tracker.get_completions(2) == completion_tracker.get_completions(2)
+    assert cache_info().hits == 3 and cache_info().misses == 3
+
+    habit_tracker.add_habit("Cached Habit", "Invalidates the cache", "weekly")
+    assert len(get_all_habits()) == len(habits) + 1
+    assert any("'Cached Habit'" in message for message in check_all_broken_habits())
+
+    with sqlite3.connect(DB_PATH) as other_db:  # a write through another connection bumps data_version
+        other_db.execute("DELETE FROM habits WHERE name = 'Cached Habit'")
+    assert get_all_habits() == habits
+    assert cache_info().hits == 3
+
+
+def test_query_cache_is_bounded():
+    """
+    Tests that the query cache evicts the least recently used result beyond its size limit.
+    """
+    clear_cache()
+    db = get_connection(DB_PATH)
+    calls = []
+    for key in ("a", "b", "a", "c", "b"):
+        cached_query(db, ("bounded", key), lambda: calls.append(key) or key, maxsize=2)
+    assert calls == ["a", "b", "c", "b"], "'b' should have been evicted by 'c'"
+    assert cache_info().currsize == 2
+    clear_cache()
+
+
+def test_async_store_matches_synchronous_api(completion_tracker):
+    """
+    Tests that the awaitable operations of AsyncHabitStore return the same results as the
+    synchronous API, with many concurrent coroutines and a small pending-operation limit, also
+    when the store is created outside the event loop.
+
+    Parameters:
+        completion_tracker (Completion): An instance of the Completion class.
+    """
+    async def scenario():
+        async with AsyncHabitStore(DB_PATH, read_workers=3, max_pending=4) as store:
+            await store.add_habit("Async Habit", "Added from a coroutine", "daily")
+            await asyncio.gather(*(store.add_completion("Async Habit") for _ in range(3)))
+            reads = await asyncio.gather(*(store.get_longest_streak("Async Habit") for _ in range(50)))
+            habits = await store.get_all_habits()
+            broken = await store.check_all_broken_habits()
+            await store.delete_habit("Async Habit")
+            return reads, habits, broken, await store.get_all_habits()
+
+    reads, habits, broken, habits_after_delete = asyncio.run(scenario())
+    assert all(streak == [("Async Habit", 1, "days")] for streak in reads)
+    assert any(habit.startswith("Async Habit:") for habit in habits)
+    assert not any("'Async Habit'" in message for message in broken)
+    assert habits_after_delete == get_all_habits()
+    assert not any(habit.startswith("Async Habit:") for habit in habits_after_delete)
+
+    # A store created outside the event loop queues its operations in the loop running them
+    store = AsyncHabitStore(DB_PATH, read_workers=2, max_pending=2)
+
+    async def created_outside():
+        async with store:
+            return await asyncio.gather(*(store.get_all_habits() for _ in range(10)))
+
+    assert all(habits == habits_after_delete for habits in asyncio.run(created_outside()))
+
+
+def test_write_behind_queue_commits_completions_in_groups(tmp_path):
+    """
+    Tests that completions submitted to the write-behind queue are committed in few transactions,
+    resolve their futures after the commit, and leave the same rows and statistics as
+    synchronous completions.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the queue database.
+    """
+    queue_path = tmp_path / "queue.db"
+    with sqlite3.connect(queue_path) as db:
+        migrate(db)
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Walk', 'daily', '2024-01-01')")
+        db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Swim', 'weekly', '2024-01-01')")
+
+    with CompletionQueue(queue_path, flush_interval_ms=50, max_batch=100) as completion_queue:
+        completion = Completion(queue_path, write_behind=completion_queue)
+        futures = [completion.add_completion(name) for name in ["Walk", "Swim", "Unknown"] * 50]
+        completion_queue.flush()
+        assert all(future.done() for future in futures)
+        assert [future.result() is None for future in futures[:3]] == [False, False, True]
+        assert completion_queue.commits < 10
+
+        with sqlite3.connect(queue_path) as db:  # the futures are resolved only after the commit
+            assert db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] == 100
+        assert Completion(queue_path).get_completions(1) == [datetime.now().date()] * 50
+
+        late = completion.add_completion("Walk")
+    assert late.result() is not None, "Closing the queue should commit the remaining completions"
+    with pytest.raises(RuntimeError):
+        completion_queue.submit("Walk")
+
+    # Completions submitted while another thread closes the queue are either committed or refused
+    racing_queue = CompletionQueue(queue_path, flush_interval_ms=1)
+    accepted = []
+
+    def submit_until_closed():
+        try:
+            while True:
+                accepted.append(racing_queue.submit("Walk"))
+        except RuntimeError:
+            pass
+
+    submitters = [threading.Thread(target=submit_until_closed) for _ in range(4)]
+    for submitter in submitters:
+        submitter.start()
+    time.sleep(0.05)
+    racing_queue.close()
+    for submitter in submitters:
+        submitter.join()
+    assert all(future.result(timeout=5) is not None for future in accepted)
+
+    db = get_connection(queue_path)
+    assert list(stats_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+    assert db.execute("SELECT SUM(total_count) FROM habit_stats").fetchone()[0] == 101 + len(accepted)
+
+
+def test_failing_listener_does_not_break_writers(tmp_path, capsys):
+    """
+    Tests that a listener raising an exception is reported on stderr, while the synchronous
+    writes return normally and the write-behind queue keeps resolving its futures.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database.
+        capsys (pytest fixture): Captures the reported listener errors.
+    """
+    listener_path = tmp_path / "listener.db"
+    init_db(listener_path, example_data=False)
+
+    def failing_listener(db_path, habit_name, change):
+        raise ValueError("listener failed")
+
+    hooks.add_listener(failing_listener)
+    try:
+        Habit(listener_path).add_habit("Walk", "", "daily")
+        Completion(listener_path).add_completion("Walk")
+        with CompletionQueue(listener_path, flush_interval_ms=1) as completion_queue:
+            assert completion_queue.submit("Walk").result(timeout=5) is not None
+            assert completion_queue.submit("Walk").result(timeout=5) is not None
+        Habit(listener_path).delete_habit("Walk")
+    finally:
+        hooks.remove_listener(failing_listener)
+    assert capsys.readouterr().err.count("ValueError: listener failed") == 5
+
+
+def test_shards_route_users_and_merge_reports(tmp_path):
+    """
+    Tests that every user gets a database of their own, and that the cross-shard reports run
+    in a process pool give the same merged results as running them shard by shard.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory holding the shards.
+    """
+    shard_dir = tmp_path / "shards"
+    ann = shards.open_shard("ann", shard_dir)
+    bob = shards.open_shard("Bob Smith/..", shard_dir)
+    assert os.path.dirname(bob) == str(shard_dir) and ann != bob
+    assert get_all_habits(ann) == [], "Shards should not get example data"
+
+    Habit(ann).add_habit("Walk", "", "daily")
+    Habit(bob).add_habit("Swim", "", "weekly")
+    Habit(bob).add_habit("Read", "", "daily")
+    Completion(ann).add_completion("Walk")
+    Completion(bob).add_completion("Swim")
+    assert [name for name, _ in shards.list_shards(shard_dir)] == sorted(["user-ann", os.path.basename(bob)[:-3]])
+    # names differing in case only, or looking like the hashed file of another name, get files of their own
+    hashed_name = os.path.basename(bob)[:-3]
+    paths = {shards.shard_path(user, shard_dir) for user in ["Ann", "ann", hashed_name, "Bob Smith/.."]}
+    assert len({path.lower() for path in paths}) == 4
+
+    broken = shards.check_all_broken_habits(shard_dir, workers=1)
+    assert broken == {os.path.basename(bob)[:-3]: ["Habit 'Read' (Daily) has never been completed and is broken."]}
+    assert shards.check_all_broken_habits(shard_dir, workers=2) == broken
+
+    longest = shards.get_longest_streak(shard_dir, workers=1)
+    assert sorted(habit for _, habit, _, _ in longest) == ["Swim", "Walk"]
+    assert shards.get_longest_streak(shard_dir, workers=2) == longest
+
+    # The shard commands don't create the default database in the working directory
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    subprocess.run([sys.executable, main_path, "shards", "--shard-dir", str(shard_dir), "add-user", "carol"],
+                   capture_output=True, text=True, check=True, cwd=tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["shards"]
+
+
+def test_bitset_backend_matches_python_backend(tmp_path):
+    """
+    Tests that the bitset backend computes the same streaks as the Python backend, keeps its
+    bitsets up to date on new completions, builds outdated bitsets in memory without storing them
+    on reads, and stores a 10-year daily history in about 460 bytes.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    first_period, bits = build_daymap([10, 11, 12, 20, 21, 25, 26, 27, 28])
+    assert (first_period, longest_run(bits), last_run(bits)) == (10, 4, 4)
+    assert len(to_blob(build_daymap(range(3650))[1])) == 457
+
+    today = date(2024, 11, 6)
+    with sqlite3.connect(tmp_path / "random.db") as random_db:
+        add_random_history(random_db, today, seed=5)
+        for reference in (today, today + timedelta(days=1), today + timedelta(days=9)):
+            assert list(bitset_habit_streaks(random_db.cursor(), today=reference)) == \
+                list(python_habit_streaks(random_db.cursor(), today=reference))
+        assert random_db.execute("SELECT COUNT(*) FROM habit_daymaps").fetchone()[0] == 0, "Reads should not store bitsets"
+        rebuild_daymaps(random_db.cursor())
+        assert list(bitset_habit_streaks(random_db.cursor(), today=today)) == \
+            list(python_habit_streaks(random_db.cursor(), today=today))
+
+        rates = {name: rate for name, _, _, rate in bitset_completion_rates(random_db.cursor(), 7, today=today)}
+        name, periodicity, days = next((name, periodicity, [day for day in days])
+                                       for _, name, periodicity, days in iter_completion_days(random_db.cursor())
+                                       if periodicity == "daily")
+        recent = {day for day in days if day > day_number(today) - 7}
+        assert rates[name] == len(recent) / 7
+
+    db = get_connection(DB_PATH)
+    last_rowid = db.execute("SELECT MAX(rowid) FROM completions").fetchone()[0]
+    try:
+        assert list(bitset_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+        Completion(DB_PATH).add_completion("Meditate")
+        assert db.execute("SELECT d.total_count = s.total_count FROM habit_daymaps d JOIN habit_stats s USING (habit_id) "
+                          "WHERE habit_id = (SELECT id FROM habits WHERE name = 'Meditate')").fetchone() == (1,), \
+            "The bitset should be updated on add_completion"
+        assert list(bitset_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+        assert check_all_broken_habits("bitset") == check_all_broken_habits("python")
+
+        # Outdated bitsets are built in memory by reads, without writing to the database
+        db.execute("DELETE FROM habit_daymaps")
+        db.commit()
+        changes = db.total_changes
+        assert list(bitset_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+        assert db.total_changes == changes and not db.in_transaction
+        assert db.execute("SELECT COUNT(*) FROM habit_daymaps").fetchone() == (0,)
+        Completion(DB_PATH).add_completion("Meditate")
+        assert db.execute("SELECT COUNT(*) FROM habit_daymaps").fetchone() == (1,), "Writes build the missing bitset"
+    finally:
+        # Restore the test data state, since Meditate is expected to be broken in test_check_habits
+        db.execute("DELETE FROM completions WHERE rowid > ?", (last_rowid,))
+        rebuild_stats(db.cursor())
+        rebuild_daymaps(db.cursor())
+        db.commit()
+
+
+def test_completion_rates_match_rescanning_completions(tmp_path):
+    """
+    Tests that the completion rates answered from prefix sums match counting the completed
+    periods of every window directly, and that the aggregate rate combines all habits.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    today = date(2024, 11, 6)
+    with sqlite3.connect(tmp_path / "random.db") as random_db:
+        add_random_history(random_db, today, seed=9)
+        random_db.execute("UPDATE habits SET created_at = '2024-06-01'")
+        prefix_sums = load_prefix_sums(random_db.cursor())
+        periods = {name: {period_number(day, periodicity) for day in days}
+                   for _, name, periodicity, days in iter_completion_days(random_db.cursor())}
+
+    assert len(prefix_sums) == 40, "Habits without completions should be included"
+    end = day_number(today)
+    for habit_prefix in prefix_sums:
+        name, periodicity = habit_prefix[:2]
+        for window in (1, 7, 30, 90, 365):
+            last = period_number(end, periodicity)
+            first = max(last - window_periods(window, periodicity) + 1, period_number(day_number(date(2024, 6, 1)), periodicity))
+            expected = len([period for period in periods.get(name, ()) if first <= period <= last])
+            assert window_counts(habit_prefix, window, end) == (expected, last - first + 1)
+
+    habit_rates, overall_rates = get_completion_rates((7, 30))
+    assert [name for name, _, _ in habit_rates] == ["Read Book", "Exercise", "Weekly Review", "Clean House", "Meditate"]
+    assert all(0 <= rate <= 1 for _, _, rates in habit_rates for rate in rates)
+    assert min(rates[1] for _, _, rates in habit_rates) <= overall_rates[1] <= max(rates[1] for _, _, rates in habit_rates)
+    assert get_completion_rates((7,), "Unknown") == ([], [None])
+
+
+def test_profiling_records_functions_sql_and_connections(tmp_path):
+    """
+    Tests that profiling times the analytics functions and every SQL statement with its row count
+    on connections opened while it is active, and that the CLI prints the summary as JSON on stderr.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the profiled databases.
+    """
+    profile_path = tmp_path / "profile.db"
+    with sqlite3.connect(profile_path) as db:
+        add_random_history(db, date(2024, 11, 6), seed=3)
+
+    profiling.start()
+    try:
+        get_longest_streak(backend="python", db_path=profile_path)
+        get_longest_streak(backend="python", db_path=profile_path)  # answered from the query cache
+        Habit(profile_path).add_habit("Profiled", "", "daily")
+    finally:
+        result = profiling.finish()
+        close_connections(profile_path)
+
+    assert result["connections_opened"] == 1
+    functions = {entry["name"]: entry["calls"] for entry in result["functions"]}
+    assert functions["analytics.get_longest_streak"] == 2 and functions["habit.Habit.add_habit"] == 1
+    statements = {entry["statement"]: entry for entry in result["sql"]}
+    scan = next(entry for statement, entry in statements.items() if statement.startswith("SELECT c.habit_id"))
+    assert scan["calls"] == 1, "The cached second call should not scan the completions again"
+    with sqlite3.connect(profile_path) as db:
+        assert scan["rows"] == db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+    assert statements["INSERT INTO habits (name, description, periodicity, created_at) VALUES (?, ?, ?, ?)"]["rows"] == 1
+    assert not profiling.enabled()
+
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    output = subprocess.run([sys.executable, main_path, "--profile", "--profile-format", "json", "list-habits"],
+                            capture_output=True, text=True, check=True, cwd=tmp_path)
+    assert "Read Book" in output.stdout
+    summary = json.loads(output.stderr)
+    assert summary["connections_opened"] == 1
+    assert [entry["name"] for entry in summary["functions"]] == ["analytics.get_all_habits"]
+
+
+def test_batch_runs_commands_in_one_process(tmp_path):
+    """
+    Tests that the batch command runs every line as a CLI command in one process, reports the
+    failing lines on stderr and commits the writes of the successful lines.
+
+    Parameters:
+        tmp_path (pytest fixture): Working directory of the CLI, holding its database.
+    """
+    commands = "\n".join([
+        "add-habit Stretch daily",
+        "# comments and blank lines are skipped",
+        "",
+        'complete-habit "Stretch"',
+        "complete-habit Unknown",
+        "no-such-command",
+        'add-habit "unclosed daily',
+        "batch",
+        "longest-streak --habit-name Stretch",
+    ])
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    output = subprocess.run([sys.executable, main_path, "batch"], input=commands,
+                            capture_output=True, text=True, cwd=tmp_path)
+
+    assert output.returncode == 1
+    assert "Habit 'Unknown' does not exist." in output.stdout
+    assert "The longest streak for habit 'Stretch' is 1 days" in output.stdout
+    errors = output.stderr.splitlines()
+    assert [line.split(":")[0] for line in errors[:-1]] == ["line 6", "line 7", "line 8"]
+    assert errors[-1].startswith("7 command(s), 3 failed")
+
+    db_path = next(tmp_path.glob("*.db"))
+    with sqlite3.connect(db_path) as db:
+        completions = db.execute(
+            "SELECT COUNT(*) FROM completions c JOIN habits h ON h.id = c.habit_id WHERE h.name = 'Stretch'").fetchone()[0]
+    assert completions == 1
+
+
+def test_broken_habits_pushdown_and_due_habits(tmp_path):
+    """
+    Tests that the aggregate MAX(completed_at) query finds the same broken habits as the streak
+    backends in both storage formats, and that due habits are ordered by their next deadline.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the random database.
+    """
+    due_path = tmp_path / "due.db"
+    today = date.today()
+    with sqlite3.connect(due_path) as db:
+        add_random_history(db, today - timedelta(days=3), seed=5)
+        db.execute("UPDATE completions SET completed_at = substr(completed_at, 1, 19)")
+
+    expected = check_all_broken_habits("python", db_path=due_path)
+    assert check_all_broken_habits(db_path=due_path) == expected
+    convert_storage(get_connection(due_path), EPOCH_FORMAT)
+    assert check_all_broken_habits(db_path=due_path) == expected
+
+    due_habits = get_due_habits(db_path=due_path)
+    assert len(due_habits) == 40
+    never_completed = [habit for habit in due_habits if habit[2] is None]
+    assert due_habits[:len(never_completed)] == never_completed
+    days_left = [habit[3] for habit in due_habits[len(never_completed):]]
+    assert days_left == sorted(days_left) and max(days_left) <= 7 - 3
+    assert all(due_date - today == timedelta(days=left)
+               for _, _, due_date, left in due_habits[len(never_completed):])
+    assert get_due_habits(limit=5, db_path=due_path) == due_habits[:5]
+    close_connections(due_path)
+
+
+def test_habit_watcher_emits_due_and_broken_events(tmp_path):
+    """
+    Tests that the watcher emits 'due' and 'broken' events at the deadlines of the habits and that
+    completions and deletions of this process only reschedule the habit concerned.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the watched database.
+    """
+    watch_path = tmp_path / "watch.db"
+    today = date.today()
+    with sqlite3.connect(watch_path) as db:
+        migrate(db)
+        for name, periodicity, last_completed in [("Run", "daily", today - timedelta(days=1)),
+                                                  ("Plan", "weekly", today - timedelta(days=3)),
+                                                  ("Stale", "daily", today - timedelta(days=5)),
+                                                  ("Never", "weekly", None)]:
+            cursor = db.execute("INSERT INTO habits (name, periodicity, created_at) VALUES (?, ?, ?)",
+                                (name, periodicity, today.isoformat()))
+            if last_completed:
+                db.execute("INSERT INTO completions VALUES (?, ?)", (cursor.lastrowid, f"{last_completed}T08:00:00"))
+
+    def at(day, hour=12):
+        return datetime.combine(day, datetime.min.time()).replace(hour=hour).timestamp()
+
+    now = [at(today)]
+    events = []
+    watcher = HabitWatcher(watch_path, events.append, clock=lambda: now[0])
+    try:
+        assert [(event["event"], event["habit"]) for event in watcher.run_pending()] \
+            == [("broken", "Never"), ("broken", "Stale"), ("due", "Run")]
+        assert watcher.run_pending() == []
+        assert watcher.next_event_time() == at(today + timedelta(days=1), hour=0)
+
+        Completion(watch_path).add_completion("Run")  # reschedules Run for tomorrow
+        Habit(watch_path).delete_habit("Plan")
+        now[0] = at(today + timedelta(days=1))
+        assert [(event["event"], event["habit"], event["due_date"]) for event in watcher.run_pending()] \
+            == [("due", "Run", (today + timedelta(days=1)).isoformat())]
+        now[0] = at(today + timedelta(days=10))
+        assert [(event["event"], event["habit"]) for event in watcher.run_pending()] == [("broken", "Run")]
+        assert watcher.next_event_time() is None and len(events) == 5
+    finally:
+        watcher.close()
+        close_connections(watch_path)
+
+
+def test_completion_log_merges_into_completions(tmp_path):
+    """
+    Tests that completions appended to the completion log are visible to reads before they are
+    compacted, that merging keeps the statistics exact, and that segments left by a crash are
+    merged once when the log is opened again.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and its log segments.
+    """
+    log_path = tmp_path / "log.db"
+    with sqlite3.connect(log_path) as db:
+        add_random_history(db, date.today() - timedelta(days=2), seed=8)
+    completions = Completion(log_path)
+    before = completions.get_completions(1)
+
+    with CompletionLog(log_path, compact_interval_s=3600) as completion_log:
+        logged = Completion(log_path, write_behind=completion_log)
+        futures = [logged.add_completion(name) for name in ["Habit 1", "Habit 2", "Habit 1"]]
+        assert all(isinstance(future.result(), datetime) for future in futures)
+        assert logged.add_completion("Unknown").result() is None
+        assert completions.get_completions(1) == [date.today()] * 2 + before  # merged on read
+        assert completion_log.compactions == 1
+        logged.add_completion("Habit 3").result()
+    assert list_segments(log_path) == []
+
+    db = get_connection(log_path)
+    stats_rows = db.execute("SELECT * FROM habit_stats ORDER BY habit_id").fetchall()
+    rebuild_stats(db.cursor())
+    assert db.execute("SELECT * FROM habit_stats ORDER BY habit_id").fetchall() == stats_rows
+    assert list(bitset_habit_streaks(db.cursor())) == list(python_habit_streaks(db.cursor()))
+    db.commit()
+
+    # Leftovers of a crash: the first segment was merged before its file was removed, the second one was not
+    last_merged = db.execute("SELECT MAX(segment) FROM completion_log_segments").fetchone()[0]
+    db.execute("INSERT INTO completion_log_segments VALUES (?, 1)", (last_merged + 5,))
+    db.commit()
+    seconds = (datetime.now() - datetime(1970, 1, 1)).days * 86400
+    for segment, habit_id in [(last_merged + 5, 4), (last_merged + 6, 5)]:
+        with open(segment_path(log_path, segment), "wb") as file:
+            file.write(RECORD.pack(habit_id, seconds) + b"\x01\x02")  # torn last record
+    count = db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+    CompletionLog(log_path).close()
+    assert db.execute("SELECT habit_id, COUNT(*) FROM completions WHERE rowid > ? GROUP BY habit_id",
+                      (count,)).fetchall() == [(5, 1)]
+    assert list_segments(log_path) == []
+    close_connections(log_path)
+
+
+def test_completion_log_survives_failed_merges(tmp_path, monkeypatch, capsys):
+    """
+    Tests that a merge failing in the background (e.g. on a locked database) is reported and retried
+    without stopping the log, and that completions submitted while another thread closes the log
+    are either merged or refused.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and its log segments.
+        monkeypatch (pytest fixture): Used to let the first merge fail.
+        capsys (pytest fixture): Captures the reported merge error.
+    """
+    log_path = tmp_path / "failing.db"
+    with sqlite3.connect(log_path) as db:
+        add_random_history(db, date.today() - timedelta(days=2), seed=10)
+        count = db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    merge_segment = completion_log.merge_segment
+    failures = []
+
+    def merge_segment_failing_once(*args):
+        if not failures:
+            failures.append(True)
+            raise sqlite3.OperationalError("database is locked")
+        return merge_segment(*args)
+
+    monkeypatch.setattr(completion_log, "merge_segment", merge_segment_failing_once)
+    with CompletionLog(log_path, compact_interval_s=0.01) as failing_log:
+        assert failing_log.submit("Habit 1").result(timeout=5) is not None
+        time.sleep(0.1)
+        assert failures and failing_log.submit("Habit 2").result(timeout=5) is not None
+    assert "database is locked" in capsys.readouterr().err
+    assert list_segments(log_path) == []
+
+    racing_log = CompletionLog(log_path, compact_interval_s=3600)
+    accepted = []
+
+    def submit_until_closed():
+        try:
+            while True:
+                accepted.append(racing_log.submit("Habit 3"))
+        except RuntimeError:
+            pass
+
+    submitters = [threading.Thread(target=submit_until_closed) for _ in range(4)]
+    for submitter in submitters:
+        submitter.start()
+    time.sleep(0.05)
+    racing_log.close()
+    for submitter in submitters:
+        submitter.join()
+    assert all(future.result(timeout=5) is not None for future in accepted)
+    with sqlite3.connect(log_path) as db:
+        assert db.execute("SELECT habit_id, COUNT(*) FROM completions WHERE rowid > ? GROUP BY habit_id",
+                          (count,)).fetchall() == [(1, 1), (2, 1), (3, len(accepted))]
+    assert list_segments(log_path) == []
+    close_connections(log_path)
+
+
+def test_completion_log_leaves_segments_of_other_processes_alone(tmp_path):
+    """
+    Tests that opening and closing a completion log doesn't merge or remove the segment of a log
+    open in another process, so completions acknowledged by that process are not lost.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and its log segments.
+    """
+    log_path = tmp_path / "shared.db"
+    with sqlite3.connect(log_path) as db:
+        add_random_history(db, date.today() - timedelta(days=2), seed=9)
+        count = db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    code = ("import sys; from completion_log import CompletionLog; "
+            "log = CompletionLog(sys.argv[1], compact_interval_s=3600); "
+            "futures = [log.submit('Habit 1') for _ in range(10)]; "
+            "[future.result() for future in futures]; "
+            "print('ready', flush=True); sys.stdin.readline(); log.close()")
+    other = subprocess.Popen([sys.executable, "-c", code, str(log_path)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        assert other.stdout.readline().strip() == "ready"
+        other_segments = list_segments(log_path)
+        with CompletionLog(log_path, compact_interval_s=3600) as completion_log:
+            assert completion_log.submit("Habit 2").result() is not None
+            assert len(list_segments(log_path)) == 2  # its own segment next to the other one
+        assert list_segments(log_path) == other_segments
+    finally:
+        other.communicate("\n", timeout=30)
+    assert other.returncode == 0
+    with sqlite3.connect(log_path) as db:
+        assert db.execute("SELECT habit_id, COUNT(*) FROM completions WHERE rowid > ? GROUP BY habit_id",
+                          (count,)).fetchall() == [(1, 10), (2, 1)]
+    assert list_segments(log_path) == []
+    close_connections(log_path)
+
+
+def test_snapshot_matches_live_analytics(tmp_path):
+    """
+    Tests that the listing functions, the streaks and the broken habits computed from a snapshot
+    file match those of the database it was written from, and that the completion days are
+    read from the memory-mapped file without copying.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and the snapshot.
+    """
+    live_path = tmp_path / "live.db"
+    snapshot_path = tmp_path / "habits.snapshot"
+    with sqlite3.connect(live_path) as db:
+        add_random_history(db, date.today(), seed=13)
+        db.execute("UPDATE habits SET description = 'Ümlaut ✓' WHERE id = 2")
+
+    assert write_snapshot(snapshot_path, live_path)[0] == 40
+    assert get_all_habits(snapshot=snapshot_path) == get_all_habits(live_path)
+    assert get_habits_by_periodicity("weekly", snapshot=snapshot_path) == get_habits_by_periodicity("weekly", live_path)
+    assert get_longest_streak(snapshot=snapshot_path) == get_longest_streak(backend="python", db_path=live_path)
+    assert get_longest_streak("Habit 3", snapshot=snapshot_path) == get_longest_streak("Habit 3", "python", live_path)
+    assert get_longest_streak("Unknown", snapshot=snapshot_path) == []
+    assert check_all_broken_habits(snapshot=snapshot_path) == check_all_broken_habits(db_path=live_path)
+
+    with Snapshot(snapshot_path) as snap:
+        assert list(snap.habit_streaks()) == list(python_habit_streaks(get_connection(live_path).cursor()))
+        days = snap.days(0)
+        assert isinstance(days, memoryview) and days.format == "i"
+        assert list(days) == sorted(set(days))
+        del days
+    close_connections(live_path)
+
+
+def test_habit_registry_serves_lookups_without_sql(tmp_path, monkeypatch):
+    """
+    Tests that completions look up their habit in the registry instead of the habits table, that
+    the registry follows habits added and deleted through Habit, and that it picks up habits
+    changed directly in the database once the catalog version is checked again.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database.
+        monkeypatch (pytest fixture): Used to check the catalog version on every lookup.
+    """
+    registry_path = tmp_path / "registry.db"
+    init_db(registry_path)
+    habits = Habit(registry_path)
+    habits.add_habit("Read", "Ten pages", "daily")
+    completions = Completion(registry_path)
+    completions.add_completion("Read")
+
+    statements = []
+    db = get_connection(registry_path)
+    db.set_trace_callback(statements.append)
+    completions.add_completion("Read")
+    db.set_trace_callback(None)
+    # one insert plus the read and update of habit_stats and habit_daymaps; no name or format lookups
+    statements = [" ".join(statement.split()) for statement in statements]
+    assert [statement.split()[0] for statement in statements] == [
+        "BEGIN", "INSERT", "SELECT", "UPDATE", "SELECT", "UPDATE", "COMMIT"]
+    assert not any("FROM habits" in statement or "PRAGMA" in statement for statement in statements)
+
+    registry_of_db = registry.get_registry(registry_path)
+    record = registry_of_db.get("Read")
+    assert (record.name, record.periodicity, record.description) == ("Read", "daily", "Ten pages")
+    habits.delete_habit("Read")
+    assert registry_of_db.get("Read") is None
+
+    # Another process: the triggers bump the catalog version, unknown names check it right away
+    with sqlite3.connect(registry_path) as other:
+        other.execute("INSERT INTO habits (name, periodicity, created_at) VALUES ('Run', 'weekly', '2024-01-01')")
+    assert registry_of_db.get("Run").periodicity == "weekly"
+    with sqlite3.connect(registry_path) as other:
+        other.execute("UPDATE habits SET periodicity = 'daily' WHERE name = 'Run'")
+    monkeypatch.setattr(registry, "CHECK_INTERVAL", 0)
+    assert registry_of_db.get("Run").periodicity == "daily"
+    names = [record.name for record in registry_of_db.records()]
+    assert "Run" in names and "Read" not in names
+    close_connections(registry_path)
+
+
+def test_keyset_pages_cover_filtered_habits_in_order(tmp_path):
+    """
+    Tests that paging through the habits with get_habits_page returns every matching habit once,
+    in name or id order, that the pages are read with index seeks instead of OFFSET, and that
+    the CLI prints the key of the next page.
+
+    Parameters:
+        tmp_path (pytest fixture): Temporary directory for the database and the CLI working directory.
+    """
+    page_path = tmp_path / "pages.db"
+    init_db(page_path, example_data=False)
+    with sqlite3.connect(page_path) as db:
+        generate_history(db, 250, 0.1, seed=3)
+        db.execute("UPDATE habits SET name = 'Stretch ' || id WHERE id % 7 = 0")
+        rows = db.execute("SELECT id, name, periodicity FROM habits").fetchall()
+
+    for sort, periodicity, name_prefix in [("name", None, None), ("id", "weekly", None), ("name", "daily", "Stretch"),
+                                           ("id", None, "Habit 001")]:
+        expected = sorted((row for row in rows if periodicity in (None, row[2])
+                           and (name_prefix is None or row[1].startswith(name_prefix))),
+                          key=lambda row: row[0 if sort == "id" else 1])
+        pages = []
+        after = None
+        while True:
+            page = get_habits_page(17, after, periodicity, name_prefix, sort, page_path)
+            pages.append(page)
+            if len(page) < 17:
+                break
+            after = getattr(page[-1], sort)
+        assert [(record.id, record.name, record.periodicity) for page in pages for record in page] == expected
+        assert [record.id for record in iter_habits(17, periodicity, name_prefix, sort, page_path)] == \
+            [row[0] for row in expected]
+
+    statements = []
+    db = get_connection(page_path)
+    db.set_trace_callback(statements.append)
+    clear_cache()
+    get_habits_page(5, "Habit 00100", "daily", db_path=page_path)
+    db.set_trace_callback(None)
+    plan = db.execute("EXPLAIN QUERY PLAN " + statements[-1]).fetchall()
+    assert "OFFSET" not in statements[-1] and all("SCAN" not in row[3] and "TEMP" not in row[3] for row in plan)
+    with pytest.raises(ValueError):
+        get_habits_page(sort="created_at", db_path=page_path)
+    close_connections(page_path)
+
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    output = subprocess.run([sys.executable, main_path, "list-habits", "--limit", "2", "--periodicity", "weekly"],
+                            capture_output=True, text=True, check=True, cwd=tmp_path)
+    lines = output.stdout.splitlines()
+    assert lines[0].startswith("- Clean House (weekly, id ")
+    assert lines[-1] == "Next page: --after 'Weekly Review'"
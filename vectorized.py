@@ -0,0 +1,101 @@
+import importlib.util
+from datetime import date
+from itertools import chain
+from streaks import day_number
+from storage import get_storage_format, DAY_SQL
+
+# NumPy is optional: the backend is only registered if it is installed, and NumPy itself
+# is imported on first use so that CLI commands not using this backend don't pay for the import
+AVAILABLE = importlib.util.find_spec('numpy') is not None
+
+### NumPy backend: streaks of all habits from one contiguous array of day numbers
+
+def load_completion_days(cursor, habit_name=None):
+    """
+    Load the completion days of all habits (or one habit) into NumPy arrays.
+
+    The day numbers are computed inside SQLite (or read from the day column of the epoch
+    storage format), so no date strings are parsed in Python.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only load the completions of this habit.
+    :return: Tuple (habit_ids, offsets, days): the IDs of all habits with completions,
+             offsets into days (habit i owns days[offsets[i]:offsets[i + 1]]) and the
+             contiguous int32 array of day numbers, ascending per habit.
+    """
+    import numpy as np
+
+    query = f'''
+        SELECT c.habit_id, {DAY_SQL[get_storage_format(cursor)]}
+        FROM completions c
+        JOIN habits h ON h.id = c.habit_id
+    '''
+    params = ()
+    if habit_name:
+        query += ' WHERE h.name = ?'
+        params = (habit_name,)
+    query += ' ORDER BY c.habit_id, c.completed_at'
+
+    rows = np.fromiter(chain.from_iterable(cursor.execute(query, params)), dtype=np.int64).reshape(-1, 2)
+    row_habit_ids = rows[:, 0]
+    days = rows[:, 1].astype(np.int32)
+
+    if not len(days):
+        return row_habit_ids, np.zeros(1, dtype=np.int64), days
+
+    starts = np.flatnonzero(np.r_[True, row_habit_ids[1:] != row_habit_ids[:-1]])
+    offsets = np.r_[starts, len(days)]
+    return row_habit_ids[starts], offsets, days
+
+
+def numpy_habit_streaks(cursor, habit_name=None, today=None):
+    """
+    Compute the streaks and last completion day of every habit with vectorized array operations.
+
+    Same results as streaks.python_habit_streaks: the periods of each habit are deduplicated,
+    runs of consecutive periods are found with diff/cumsum and reduced per habit.
+
+    :param cursor: Cursor of an open database connection.
+    :param habit_name: Optional; only compute the streaks of this habit.
+    :param today: Optional; reference date for the current streak (defaults to today).
+    :return: Generator of (habit_name, periodicity, longest, current, last_day) tuples in habit id order.
+    """
+    import numpy as np
+
+    today = day_number(today or date.today())
+    habit_ids, offsets, days = load_completion_days(cursor, habit_name)
+    if not len(days):
+        return
+
+    habits = {habit_id: (name, periodicity)
+              for habit_id, name, periodicity in cursor.execute('SELECT id, name, periodicity FROM habits')}
+    periodicities = [habits[habit_id][1] for habit_id in habit_ids.tolist()]
+    weekly = np.array([periodicity != 'daily' for periodicity in periodicities])
+    counts = np.diff(offsets)
+
+    # Period number of every completion and the habit it belongs to
+    periods = np.where(np.repeat(weekly, counts), (days + 3) // 7, days)
+    habit_index = np.repeat(np.arange(len(habit_ids)), counts)
+    first = np.zeros(len(days), dtype=bool)
+    first[offsets[:-1]] = True
+
+    # Several completions within one period count once
+    distinct = first | (np.diff(periods, prepend=periods[0]) != 0)
+    periods, habit_index, first = periods[distinct], habit_index[distinct], first[distinct]
+
+    # A run starts at the first period of a habit or after a missed period
+    run_start = first | (np.diff(periods, prepend=periods[0]) != 1)
+    run_id = np.cumsum(run_start) - 1
+    run_length = np.bincount(run_id)
+    longest = np.maximum.reduceat(run_length, np.flatnonzero(first[run_start]))
+
+    # The latest period of every habit and the run ending there
+    last = np.flatnonzero(np.r_[habit_index[1:] != habit_index[:-1], True])
+    last_run = run_length[run_id[last]]
+    today_period = np.where(weekly, (today + 3) // 7, today)
+    current = np.where(periods[last] >= today_period - 1, last_run, 0)
+    last_day = days[offsets[1:] - 1]
+
+    for habit_id, periodicity, row in zip(habit_ids.tolist(), periodicities,
+                                          zip(longest.tolist(), current.tolist(), last_day.tolist())):
+        yield (habits[habit_id][0], periodicity) + row
@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from db import DB_PATH  # Import the DB_PATH
+from connection import get_connection  # shared per-thread connection
+from completion import write_completion
+from storage import get_storage_format
+from cache import bump_write_counter
+import hooks
+
+# Longest time a queued completion waits for its transaction, in milliseconds
+DEFAULT_FLUSH_INTERVAL_MS = 5
+
+# Largest number of completions written in one transaction
+DEFAULT_MAX_BATCH = 1000
+
+# Queue item asking the flusher to commit everything queued before it
+_FLUSH = object()
+
+### write-behind queue committing completions in groups
+
+class CompletionQueue:
+    """
+    Write-behind queue for completions (group commit).
+
+    submit() only timestamps the completion and puts it on an in-process queue. A flusher
+    thread writes the queued completions in one transaction as soon as max_batch of them are
+    waiting or the oldest has waited flush_interval_ms, so a burst of completions costs one
+    commit instead of one per completion. Callers learn about durability through the returned
+    futures, which are resolved after the commit.
+
+    Usage:
+        with CompletionQueue() as completions:
+            future = completions.submit("Read Book")
+            future.result()  # wait until the completion is committed
+    """
+
+    def __init__(self, db_path=DB_PATH, flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS, max_batch=DEFAULT_MAX_BATCH):
+        """
+        Initialize the queue and start its flusher thread.
+
+        :param db_path: Path of the SQLite database file.
+        :param flush_interval_ms: Longest time a completion waits before its transaction is started.
+        :param max_batch: Largest number of completions written in one transaction.
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.commits = 0  # number of transactions written so far
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()  # nothing is queued after the stop item of close()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._run, name='habits-completion-flusher', daemon=True)
+        self._flusher.start()
+
+    def submit(self, habit_name):
+        """
+        Queue a completion of a habit, timestamped now.
+
+        :param habit_name: The name of the habit to mark as complete.
+        :return: Future resolved with the completion time (datetime) once it is committed,
+                 or with None if the habit does not exist.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The completion queue is closed.")
+            self._queue.put((habit_name, datetime.now(), future))
+        return future
+
+    def flush(self):
+        """
+        Commit all completions queued so far and wait for the commit.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The completion queue is closed.")
+            self._queue.put((_FLUSH, None, future))
+        future.result()
+
+    def close(self):
+        """
+        Commit the remaining completions and stop the flusher thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._flusher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        """
+        Flusher thread: collect queued completions into batches and write each batch in one transaction.
+        """
+        db = get_connection(self.db_path)
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if item[0] is _FLUSH or len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self._write_batch(db, batch)
+        db.close()
+
+    def _write_batch(self, db, batch):
+        """
+        Write a batch of queued completions in one transaction and resolve their futures.
+
+        :param db: Connection of the flusher thread.
+        :param batch: List of (habit_name, completed_at, future) items.
+        """
+        completions = [item for item in batch if item[0] is not _FLUSH]
+        results = []
+        completed = set()
+        if completions:
+            cursor = db.cursor()
+            try:
+                storage_format = get_storage_format(cursor)
+                habits = {}  # each habit is looked up once per batch
+                for habit_name, completed_at, _ in completions:
+                    if habit_name not in habits:
+                        cursor.execute("SELECT id, periodicity FROM habits WHERE name = ?", (habit_name,))
+                        habits[habit_name] = cursor.fetchone()
+                    habit = habits[habit_name]
+                    if habit is None:
+                        results.append(None)
+                        continue
+                    write_completion(cursor, habit[0], habit[1], completed_at, storage_format)
+                    results.append(completed_at)
+                db.commit()
+            except Exception as error:
+                db.rollback()
+                for _, _, future in completions:
+                    future.set_exception(error)
+                completions = []
+            else:
+                self.commits += 1
+                bump_write_counter()
+                completed = {item[0] for item, result in zip(completions, results) if result is not None}
+
+        for (_, _, future), result in zip(completions, results):
+            future.set_result(result)
+        for item in batch:
+            if item[0] is _FLUSH:
+                item[2].set_result(None)
+        # the listeners run after the futures are resolved, so waiting writers aren't held up by them
+        for habit_name in completed:
+            hooks.notify(self.db_path, habit_name, 'completed')